@@ -0,0 +1,99 @@
+"""充值活动匹配基准测试
+
+同时进行的活动数量逐步增加（其中一部分已结束或尚未开始），测量为一笔充值选出最优活动的耗时：
+- scan：原来的实现，逐个检查全部活动，每个活动读取两次系统时间
+- index：MemberSystem._find_best_activity，由活动索引取出候选活动
+
+用法：
+    python -m benchmarks.activity_match
+    python -m benchmarks.activity_match --campaigns 10,100,1000,10000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from store.member import MemberLevel, MemberSystem, RechargeActivity, RechargeActivityType
+from store.money import ZERO, Money
+
+AMOUNTS = tuple(Money(amount) for amount in (50, 100, 200, 500, 1000))
+
+
+def scan_best_activity(member_system: MemberSystem, user_id: int, amount: Money):
+    """原来的实现（对比用）"""
+    user = member_system.get_user(user_id)
+    best_activity = None
+    best_bonus = ZERO
+    for activity in member_system.activities.values():
+        if not activity.is_valid():
+            continue
+        if activity.level_requirement and user.level.value < activity.level_requirement.value:
+            continue
+        if not member_system.quotas.has_room(activity, user_id):
+            continue
+        if activity.activity_type == RechargeActivityType.FIRST_TIME and user.total_recharged > ZERO:
+            continue
+        if amount < activity.min_amount:
+            continue
+        bonus = activity.bonus_for(amount)
+        if bonus > best_bonus:
+            best_bonus = bonus
+            best_activity = activity
+    return best_activity
+
+
+def build(campaigns: int, users: int, rng: random.Random) -> MemberSystem:
+    member_system = MemberSystem()
+    now = datetime.now()
+    for _ in range(campaigns):
+        # 约一半的活动当前进行中，其余已结束或尚未开始
+        start = now + timedelta(days=rng.uniform(-30, 10))
+        activity = RechargeActivity(
+            activity_type=rng.choice(list(RechargeActivityType)),
+            min_amount=rng.choice((0.0, 100.0, 200.0, 500.0, 2000.0, 5000.0)),
+            bonus_rate=rng.choice((0.02, 0.05, 0.1)),
+            start_time=start,
+            end_time=start + timedelta(days=rng.uniform(1, 40)),
+            user_limit=rng.randint(1, 10),
+            level_requirement=rng.choice((None, None, MemberLevel.GOLD, MemberLevel.DIAMOND, MemberLevel.SUPREME)),
+        )
+        member_system.activities[activity.id] = activity
+    member_system.activity_index.rebuild(member_system.activities.values())
+
+    for user_id in range(1, users + 1):
+        user = member_system.register_user(user_id, f"user{user_id}", f"User {user_id}")
+        user.total_recharged = rng.choice((0.0, 600.0, 2500.0, 12000.0))
+        user.update_level()
+    return member_system
+
+
+def measure(func, requests) -> float:
+    """返回单次匹配的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for user_id, amount in requests:
+        func(user_id, amount)
+    return (time.perf_counter() - start) / len(requests) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--campaigns', default='10,100,1000,10000', help='逗号分隔的活动数量')
+    parser.add_argument('--users', type=int, default=1000, help='用户数量')
+    parser.add_argument('--requests', type=int, default=20000, help='每次测量的匹配次数')
+    args = parser.parse_args()
+
+    print(f"{'campaigns':>10} {'live':>6} {'scan(us)':>10} {'index(us)':>10} {'speedup':>8}")
+    for campaigns in (int(s) for s in args.campaigns.split(',')):
+        rng = random.Random(42)
+        member_system = build(campaigns, args.users, rng)
+        requests = [(rng.randint(1, args.users), rng.choice(AMOUNTS)) for _ in range(args.requests)]
+        live = len(member_system.get_active_activities())
+
+        repeat = max(1, len(requests) // max(campaigns // 10, 1))
+        scan = measure(lambda user_id, amount: scan_best_activity(member_system, user_id, amount), requests[:repeat])
+        index = measure(member_system._find_best_activity, requests)
+        print(f"{campaigns:>10} {live:>6} {scan:>10.2f} {index:>10.2f} {scan / index:>7.1f}x", flush=True)
+
+
+if __name__ == '__main__':
+    main()
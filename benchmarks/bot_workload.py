@@ -0,0 +1,425 @@
+"""机器人端到端负载模拟
+
+构建与生产相同的 Application（处理器、会话顺序处理、状态同步），用内存中的
+模拟 Bot API 和模拟 BEpusdt 网关代替网络，按真实的命令组合（/shop、/buy、/member、
+/recharge、充值按钮、check_recharge_ 刷新等）为大量模拟用户生成更新并放入更新队列。
+
+报告：
+- 每个处理器的执行延迟分位数和直方图、错误回复（❌）数量、处理异常数
+- 更新从入队到处理完成的端到端延迟、丢弃/合并的更新数
+- 各操作实际由哪个处理器处理（用于发现路由问题）
+- 事件循环延迟（定时器实际触发时间与计划时间之差）
+- 内存增长（RSS、会员/充值记录数，可选 tracemalloc 分配热点）
+
+每个用户规模在独立进程中运行，数据库和内存状态互不影响。
+
+用法：
+    python -m benchmarks.bot_workload
+    python -m benchmarks.bot_workload --users 10000,100000,1000000 --updates 50000
+    python -m benchmarks.bot_workload --rate 500 --api-latency 30 --tracemalloc
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+# 操作 -> 权重
+MIX = {
+    'shop': 15,
+    'buy': 5,
+    'member': 20,
+    'recharge': 5,
+    'rechargecenter': 5,
+    'recharge_amount': 10,
+    'create_recharge': 10,
+    'check_recharge': 30,
+}
+
+# 直方图上界（毫秒）
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+# 当前正在执行的处理器，模拟 Bot API 据此统计错误回复
+current_handler: contextvars.ContextVar = contextvars.ContextVar('current_handler', default='')
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def histogram(values) -> List[int]:
+    counts = [0] * (len(BUCKETS_MS) + 1)
+    for value in values:
+        ms = value * 1000
+        index = 0
+        while index < len(BUCKETS_MS) and ms > BUCKETS_MS[index]:
+            index += 1
+        counts[index] += 1
+    return counts
+
+
+def rss_mb() -> float:
+    """当前进程常驻内存（MB）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_stub_request(latency: float):
+    """内存中的 Bot API：不发网络请求，按接口返回最小的合法结果"""
+    from telegram.request import BaseRequest
+
+    class StubBotAPI(BaseRequest):
+
+        def __init__(self):
+            self.calls: Counter = Counter()
+            self.error_replies: Counter = Counter()
+            self._message_id = 0
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None) -> Tuple[int, bytes]:
+            endpoint = url.rsplit('/', 1)[-1]
+            params = request_data.parameters if request_data else {}
+            self.calls[endpoint] += 1
+            if latency:
+                await asyncio.sleep(latency)
+
+            if endpoint == 'getMe':
+                result = dict(BOT_USER, can_join_groups=False, can_read_all_group_messages=False,
+                              supports_inline_queries=False)
+            elif endpoint in ('sendMessage', 'editMessageText'):
+                text = str(params.get('text', ''))
+                if text.startswith('❌'):
+                    self.error_replies[current_handler.get()] += 1
+                self._message_id += 1
+                chat_id = params.get('chat_id') or 0
+                result = {'message_id': params.get('message_id') or self._message_id, 'date': int(time.time()),
+                          'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER, 'text': text}
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    return StubBotAPI()
+
+
+def stub_bepusdt(client, latency: float):
+    """用模拟网关替换异步 BEpusdt 客户端的连接池"""
+    import httpx
+
+    async def handler(request):
+        if latency:
+            await asyncio.sleep(latency)
+        trade_id = uuid.uuid4().hex
+        return httpx.Response(200, json={'trade_id': trade_id,
+                                         'payment_url': f"https://pay.example.com/{trade_id}"})
+
+    client._get_client()
+    client._client = httpx.AsyncClient(base_url=client.api_url, transport=httpx.MockTransport(handler))
+
+
+class HandlerStats:
+    """包装处理器回调，记录执行延迟、端到端延迟和路由"""
+
+    def __init__(self):
+        self.run: Dict[str, List[float]] = defaultdict(list)
+        self.end_to_end: List[float] = []
+        self.exceptions: Counter = Counter()
+        self.routes: Counter = Counter()
+        self.enqueued: Dict[int, float] = {}
+        self.actions: Dict[int, str] = {}
+
+    def wrap(self, callback, group: int):
+        name = callback.__name__
+
+        async def timed(update, context):
+            token = current_handler.set(name)
+            start = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.exceptions[name] += 1
+                raise
+            finally:
+                done = time.perf_counter()
+                current_handler.reset(token)
+                self.run[name].append(done - start)
+                if group >= 0:
+                    update_id = update.update_id
+                    enqueued = self.enqueued.pop(update_id, None)
+                    if enqueued is not None:
+                        self.end_to_end.append(done - enqueued)
+                    self.routes[(self.actions.get(update_id, '?'), name)] += 1
+
+        timed.__name__ = name
+        return timed
+
+
+class Workload:
+    """按命令组合为模拟用户生成更新"""
+
+    def __init__(self, args, users: int, member_system, shop):
+        self.args = args
+        self.users = users
+        self.member_system = member_system
+        self.rng = random.Random(args.seed)
+        self.hot_users = max(1, int(users * args.hot_users))
+        self.registered = int(users * args.registered)
+        self.products = [product.id for product in shop.get_all_products()]
+        self.records: Dict[int, str] = {}
+        self.actions = list(MIX)
+        self.weights = [MIX[action] for action in self.actions]
+
+    def user(self) -> int:
+        # 少数活跃用户产生大部分更新
+        if self.rng.random() < self.args.hot_share:
+            return self.rng.randint(1, self.hot_users)
+        return self.rng.randint(1, self.users)
+
+    def action(self, user_id: int) -> Tuple[str, str, bool]:
+        """返回 (操作, 命令文本或按钮数据, 是否按钮)"""
+        action = self.rng.choices(self.actions, self.weights)[0]
+        amount = self.rng.choice((50, 100, 200, 500))
+        if action == 'shop':
+            return action, '/shop', False
+        if action == 'buy':
+            method = self.rng.choice(('usdt', 'bepusdt', 'balance'))
+            return action, f"/buy {self.rng.choice(self.products)} {method}", False
+        if action == 'member':
+            return action, '/member', False
+        if action == 'recharge':
+            return action, f"/recharge {amount}", False
+        if action == 'rechargecenter':
+            return action, '/rechargecenter', False
+        if action == 'recharge_amount':
+            return action, f"recharge_{amount}", True
+        if action == 'create_recharge':
+            return action, f"create_recharge_{float(amount)}_{self.rng.choice(('usdt', 'bepusdt'))}", True
+        # 刷新已有充值订单；没有时先创建（视为此前的下单，不计入测试）
+        record_id = self.records.get(user_id)
+        if record_id is None and self.member_system.get_user(user_id):
+            record = self.member_system.create_recharge_order(user_id, float(amount), 'bepusdt')
+            record_id = self.records[user_id] = record.id
+        return action, f"check_recharge_{record_id or 'missing'}", True
+
+    def build(self, bot, count: int, stats: HandlerStats) -> list:
+        from telegram import Update
+
+        updates = []
+        now = int(time.time())
+        joined = set()
+        for update_id in range(1, count + 1):
+            user_id = self.user()
+            sender = {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}", 'username': f"user{user_id}"}
+            chat = {'id': user_id, 'type': 'private'}
+            if user_id > self.registered and user_id not in joined:
+                # 新用户先注册
+                joined.add(user_id)
+                action, text, button = 'register', '/register', False
+            else:
+                action, text, button = self.action(user_id)
+            stats.actions[update_id] = action
+            if button:
+                data = {'update_id': update_id, 'callback_query': {
+                    'id': str(update_id), 'from': sender, 'chat_instance': str(user_id), 'data': text,
+                    'message': {'message_id': 1, 'date': now, 'chat': chat, 'from': BOT_USER, 'text': 'menu'}}}
+            else:
+                command = text.split()[0]
+                data = {'update_id': update_id, 'message': {
+                    'message_id': update_id, 'date': now, 'chat': chat, 'from': sender, 'text': text,
+                    'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]}}
+            updates.append(Update.de_json(data, bot))
+        return updates
+
+
+async def monitor_loop(samples: List[float], interval: float, stop: asyncio.Event):
+    """记录事件循环延迟：定时器实际唤醒时间与计划时间之差"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def drive(args, users: int, state) -> None:
+    import tracemalloc
+    from bot.main import build_application
+    from bot.updates import BoundedUpdateQueue
+
+    api = make_stub_request(args.api_latency / 1000)
+    queue = BoundedUpdateQueue(args.max_outstanding)
+    application = build_application(update_queue=queue, request=api)
+    if state.shop.bepusdt_async:
+        stub_bepusdt(state.shop.bepusdt_async, args.gateway_latency / 1000)
+
+    stats = HandlerStats()
+    for group, handlers in application.handlers.items():
+        for handler in handlers:
+            handler.callback = stats.wrap(handler.callback, group)
+
+    await application.initialize()
+    await application.start()
+
+    workload = Workload(args, users, state.member_system, state.shop)
+    updates = workload.build(application.bot, args.updates, stats)
+    state.flush()
+
+    memory = [(0, rss_mb(), len(state.member_system.users), len(state.member_system.recharge_records))]
+    if args.tracemalloc:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+
+    lag: List[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop(lag, args.lag_interval / 1000, stop))
+    checkpoint = max(1, len(updates) // 10)
+
+    start = time.perf_counter()
+    for index, update in enumerate(updates):
+        if args.rate:
+            delay = start + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        while queue.outstanding >= queue.limit:
+            await asyncio.sleep(0.001)
+        stats.enqueued[update.update_id] = time.perf_counter()
+        queue.offer(update)
+        if (index + 1) % checkpoint == 0:
+            memory.append((index + 1, rss_mb(), len(state.member_system.users),
+                           len(state.member_system.recharge_records)))
+    await queue.join()
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await monitor
+    if args.tracemalloc:
+        growth = tracemalloc.take_snapshot().compare_to(before, 'lineno')[:10]
+        tracemalloc.stop()
+    metrics = application.update_processor.metrics()
+    await application.stop()
+    await application.shutdown()
+
+    report(args, users, len(updates), elapsed, stats, api, metrics, lag, memory,
+           growth if args.tracemalloc else None)
+
+
+def report(args, users, count, elapsed, stats, api, metrics, lag, memory, growth):
+    print(f"\n=== users={users} updates={count} rate={'max' if not args.rate else f'{args.rate:.0f}/s'} "
+          f"api_latency={args.api_latency}ms cpus={os.cpu_count()} ===")
+    print(f"throughput={count / elapsed:.0f} updates/s elapsed={elapsed:.2f}s processed={metrics['processed']} "
+          f"dropped={metrics['dropped']} coalesced={metrics['coalesced']} "
+          f"max_chat_depth={metrics['max_depth']} avg_wait={metrics['avg_wait_ms']}ms")
+    print(f"end-to-end p50={percentile(stats.end_to_end, 0.5) * 1000:.2f}ms "
+          f"p95={percentile(stats.end_to_end, 0.95) * 1000:.2f}ms "
+          f"p99={percentile(stats.end_to_end, 0.99) * 1000:.2f}ms "
+          f"max={max(stats.end_to_end, default=0) * 1000:.2f}ms")
+    print(f"event loop lag p50={percentile(lag, 0.5) * 1000:.2f}ms p99={percentile(lag, 0.99) * 1000:.2f}ms "
+          f"max={max(lag, default=0) * 1000:.2f}ms ({len(lag)} samples every {args.lag_interval}ms)")
+
+    print(f"\n{'handler':<26} {'n':>7} {'❌':>6} {'exc':>5} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'maxms':>8}")
+    for name, values in sorted(stats.run.items(), key=lambda item: -len(item[1])):
+        print(f"{name:<26} {len(values):>7} {api.error_replies[name]:>6} {stats.exceptions[name]:>5} "
+              f"{percentile(values, 0.5) * 1000:>8.2f} {percentile(values, 0.95) * 1000:>8.2f} "
+              f"{percentile(values, 0.99) * 1000:>8.2f} {max(values) * 1000:>8.2f}")
+
+    labels = [f"≤{ms}" for ms in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+    print(f"\n{'histogram (ms)':<26} " + ' '.join(f"{label:>6}" for label in labels))
+    for name, values in sorted(stats.run.items(), key=lambda item: -len(item[1])):
+        print(f"{name:<26} " + ' '.join(f"{count:>6}" for count in histogram(values)))
+
+    print(f"\n{'action':<18} handled by")
+    routes = defaultdict(list)
+    for (action, handler), n in stats.routes.items():
+        routes[action].append(f"{handler}×{n}")
+    for action in sorted(routes):
+        print(f"{action:<18} {', '.join(routes[action])}")
+    print(f"bot api calls: {dict(api.calls)}")
+
+    print(f"\n{'updates':>9} {'rss_mb':>9} {'members':>9} {'recharges':>10}")
+    for done, rss, members, recharges in memory:
+        print(f"{done:>9} {rss:>9.1f} {members:>9} {recharges:>10}")
+    base = memory[0]
+    print(f"growth during run: {memory[-1][1] - base[1]:+.1f} MB; "
+          f"baseline {base[1] / max(base[2], 1) * 1024:.2f} KB per loaded member")
+    if growth:
+        print("\ntop allocations during run:")
+        for stat in growth:
+            print(f"  {stat}")
+
+
+def simulate(args, users: int) -> None:
+    """在独立进程中运行一个用户规模"""
+    db_dir = tempfile.mkdtemp(prefix='bot-workload-')
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(db_dir, 'store.db')}",
+        'TELEGRAM_TOKEN': '1:bench',
+        'BEPUSDT_API_URL': 'http://bepusdt.invalid',
+        'BEPUSDT_APP_ID': 'bench',
+        'BEPUSDT_APP_SECRET': 'bench-secret',
+    })
+    from store.state import get_state
+
+    logging.disable(logging.CRITICAL)
+    state = get_state()
+
+    # 预先注册的用户（代表已有会员，启动时加载到内存）
+    start = time.perf_counter()
+    for user_id in range(1, int(users * args.registered) + 1):
+        state.member_system.register_user(user_id, f"user{user_id}", f"User {user_id}")
+    state.flush()
+    print(f"[users={users}] registered {int(users * args.registered)} members in "
+          f"{time.perf_counter() - start:.1f}s, rss={rss_mb():.1f} MB", flush=True)
+
+    asyncio.run(drive(args, users, state))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', default='10000,100000', help='模拟用户数（逗号分隔，逐个测试），如 10000,100000,1000000')
+    parser.add_argument('--updates', type=int, default=20000, help='每个规模发送的更新数')
+    parser.add_argument('--rate', type=float, default=500, help='每秒放入的更新数，0 表示尽快放入（测量最大吞吐）')
+    parser.add_argument('--max-outstanding', type=int, default=512, help='尚未处理完的更新上限（有界更新队列）')
+    parser.add_argument('--registered', type=float, default=0.9, help='预先注册为会员的用户比例，其余用户先发送 /register')
+    parser.add_argument('--hot-users', type=float, default=0.05, help='活跃用户比例')
+    parser.add_argument('--hot-share', type=float, default=0.5, help='活跃用户产生的更新比例')
+    parser.add_argument('--api-latency', type=float, default=0, help='模拟 Bot API 每次调用的延迟（毫秒）')
+    parser.add_argument('--gateway-latency', type=float, default=0, help='模拟 BEpusdt 网关的延迟（毫秒）')
+    parser.add_argument('--lag-interval', type=float, default=10, help='事件循环延迟采样间隔（毫秒）')
+    parser.add_argument('--tracemalloc', action='store_true', help='记录运行期间的内存分配热点（较慢）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    for users in (int(u) for u in args.users.split(',')):
+        process = context.Process(target=simulate, args=(args, users))
+        process.start()
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
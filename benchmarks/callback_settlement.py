@@ -0,0 +1,146 @@
+"""支付回调确认延迟与结算吞吐基准测试
+
+在本地启动会员充值回调服务（werkzeug 多线程服务器）和模拟的 Telegram 服务器，
+模拟网关在独立进程中按固定速率（开环）发送签名的 UMPay 回调，其中一部分为
+重复回调。对每个速率报告回调确认延迟（p50/p99/max，从计划发送时间算起）、
+实际吞吐，以及结算线程把所有回调入账所需的时间。
+
+用法：
+    python -m benchmarks.callback_settlement
+    python -m benchmarks.callback_settlement --rates 500,1000 --seconds 10 --workers 4
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from benchmarks.webhook_load import StubTelegram, percentile
+
+SECRET = 'bench-secret'
+
+
+def gateway(port: int, path: str, bodies, rate: float, clients: int, results):
+    """模拟网关（独立进程）：按计划时间开环发送回调，延迟从计划发送时间算起"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(len(bodies)))
+    start = time.perf_counter() + 0.2
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                conn.close()
+                return
+            scheduled = start + index / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            conn.request('POST', path, body=bodies[index], headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            finished = time.perf_counter()
+            with lock:
+                latencies.append(finished - scheduled)
+                if response.status != 200:
+                    errors.append(response.status)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((time.perf_counter() - start, latencies, errors))
+
+
+def run(callback, rate: float, count: int, duplicates: float, users: int, clients: int) -> None:
+    member_system = callback.member_system
+    unique = int(count * (1 - duplicates))
+    records = [member_system.create_recharge_order(i % users + 1, 10.0, 'umpay') for i in range(unique)]
+    callback.state.flush()
+
+    bodies = []
+    for i in range(count):
+        record = records[i] if i < unique else records[(i * 7919) % unique]
+        data = {'order_id': record.id, 'status': 'paid', 'payment_order_id': f"tx-{record.id}"}
+        bodies.append(json.dumps(dict(data, signature=callback.umpay_signature(data))))
+    settled_before = callback.settlement.settled
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=gateway, args=(callback.port, '/webhook/member/umpay',
+                                                    bodies, rate, clients, results))
+    start = time.perf_counter()
+    process.start()
+    elapsed, latencies, errors = results.get()
+    process.join()
+
+    # 等待本轮回调全部结算
+    while callback.settlement.settled - settled_before < unique:
+        time.sleep(0.01)
+    settled = time.perf_counter() - start
+    paid = sum(1 for record in records if member_system.get_recharge_record(record.id).status == 'paid')
+
+    print(f"target={rate:>6.0f}/s achieved={count / elapsed:>6.0f}/s errors={len(errors):<4} "
+          f"ack p50={percentile(latencies, 0.5) * 1000:>8.2f}ms p99={percentile(latencies, 0.99) * 1000:>8.2f}ms "
+          f"max={max(latencies) * 1000:>8.2f}ms | settled {paid}/{unique} in {settled:>5.2f}s "
+          f"({unique / settled:>5.0f}/s) max_lag={callback.settlement.max_lag * 1000:>6.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rates', default='250,500,1000', help='每秒发送的回调数（逗号分隔，逐个测试）')
+    parser.add_argument('--seconds', type=float, default=5, help='每个速率的发送时长（秒）')
+    parser.add_argument('--duplicates', type=float, default=0.1, help='重复回调比例')
+    parser.add_argument('--users', type=int, default=500, help='用户数')
+    parser.add_argument('--clients', type=int, default=64, help='模拟网关的并发连接数')
+    parser.add_argument('--workers', type=int, default=4, help='结算线程数')
+    args = parser.parse_args()
+
+    telegram = ThreadingHTTPServer(('127.0.0.1', 0), StubTelegram)
+    threading.Thread(target=telegram.serve_forever, daemon=True).start()
+
+    db_dir = tempfile.mkdtemp(prefix='callback-bench-')
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(db_dir, 'store.db')}",
+        'UMPAY_SECRET': SECRET,
+        'TELEGRAM_TOKEN': '1:bench',
+        'TELEGRAM_API_BASE': f"http://127.0.0.1:{telegram.server_port}",
+        'SETTLEMENT_WORKERS': str(args.workers),
+    })
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import webhooks.member_callback as callback
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    for user_id in range(1, args.users + 1):
+        callback.member_system.register_user(user_id, f"user{user_id}", f"User {user_id}")
+
+    server = make_server('127.0.0.1', 0, callback.app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    callback.port = server.server_port
+
+    print(f"workers={args.workers} clients={args.clients} duplicates={args.duplicates:.0%} cpus={os.cpu_count()}")
+    for rate in (float(r) for r in args.rates.split(',')):
+        run(callback, rate, int(rate * args.seconds), args.duplicates, args.users, args.clients)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""余额账本基准测试
+
+- append：Ledger.post 的追加吞吐（记账 + 进入写队列）和持久化吞吐（全部提交到 SQLite）
+- recovery：重启时恢复余额的耗时，对比定期快照（只重放快照之后的分录）与不做快照（重放全部分录）
+- statement：按时间范围读取单个账户对账单的延迟
+
+用法：
+    python -m benchmarks.ledger_append
+    python -m benchmarks.ledger_append --appends 1000000 --users 100000 --path /tmp/ledger.db
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from store.compact import now_micros
+from store.ledger import SNAPSHOT_INTERVAL, Ledger
+from store.storage import SQLiteStorage
+
+CONTRAS = ('recharge', 'purchase', 'refund', 'bonus', 'referral')
+
+
+def reset(path: str):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def append(path: str, appends: int, users: int, snapshot_interval: int) -> Ledger:
+    """追加分录并报告吞吐，返回账本（存储已提交并关闭）"""
+    reset(path)
+    storage = SQLiteStorage(path)
+    ledger = Ledger(storage, snapshot_interval=snapshot_interval)
+    rng = random.Random(42)
+    operations = [(rng.randint(1, users), rng.choice((100, 500, 1000, -300)), CONTRAS[i % 5])
+                  for i in range(appends)]
+    commits_before = storage.commits
+
+    start = time.perf_counter()
+    for account, amount, contra in operations:
+        ledger.post(account, amount, contra, "bench")
+    posted = time.perf_counter() - start
+    storage.flush()
+    elapsed = time.perf_counter() - start
+    commits = storage.commits - commits_before
+    storage.close()
+
+    label = f"snapshot every {snapshot_interval}" if snapshot_interval < appends else "no snapshot"
+    print(f"append   {label:<22} posted={appends / posted:>9.0f}/s durable={appends / elapsed:>9.0f}/s "
+          f"commits={commits} trial_balance={ledger.trial_balance()}", flush=True)
+    return ledger
+
+
+def recover(path: str, expected: Ledger, users: int) -> float:
+    """从数据库恢复余额，核对结果并返回耗时（秒）"""
+    storage = SQLiteStorage(path)
+    start = time.perf_counter()
+    ledger = Ledger(storage)
+    ledger.load()
+    elapsed = time.perf_counter() - start
+    mismatched = sum(1 for account in range(1, users + 1) if ledger.balance(account) != expected.balance(account))
+    storage.close()
+    if mismatched:
+        print(f"  !! {mismatched} 个账户恢复后的余额不一致")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appends', type=int, default=500000, help='追加的分录数')
+    parser.add_argument('--users', type=int, default=10000, help='账户数')
+    parser.add_argument('--snapshot-interval', type=int, default=SNAPSHOT_INTERVAL, help='快照间隔（分录数）')
+    parser.add_argument('--path', default=None, help='数据库文件路径（默认临时目录）')
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(tempfile.mkdtemp(), 'ledger.db')
+
+    # 不做快照：恢复时重放全部分录
+    ledger = append(path, args.appends, args.users, args.appends + 1)
+    full = recover(path, ledger, args.users)
+
+    # 定期快照：恢复时只重放最近一次快照之后的分录
+    ledger = append(path, args.appends, args.users, args.snapshot_interval)
+    tail = recover(path, ledger, args.users)
+    print(f"recovery replay all={full * 1000:.0f}ms  snapshot+tail={tail * 1000:.0f}ms")
+
+    storage = SQLiteStorage(path)
+    reader = Ledger(storage)
+    now = now_micros()
+    repeat = 1000
+    start = time.perf_counter()
+    for i in range(repeat):
+        reader.statement(i % args.users + 1, now - 86400 * 10 ** 6, now + 1, limit=100)
+    print(f"statement 24h range: {(time.perf_counter() - start) / repeat * 1e6:.0f}us per account")
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
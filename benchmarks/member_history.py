@@ -0,0 +1,62 @@
+"""会员交易记录查询基准测试
+
+逐步增加全局余额变动记录总数，测量单个用户"最近N条"查询和游标翻页的延迟，
+用于验证查询耗时与全局记录总数无关。
+
+用法：
+    python -m benchmarks.member_history
+    python -m benchmarks.member_history --sizes 10000,100000,1000000,10000000
+"""
+import argparse
+import random
+import time
+
+from store.member import MemberSystem
+
+HOT_USER_ID = 1
+
+
+def measure(func, repeat: int) -> float:
+    """返回单次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='逗号分隔的全局记录总数')
+    parser.add_argument('--users', type=int, default=10000, help='用户数量')
+    parser.add_argument('--limit', type=int, default=20, help='每页条数')
+    parser.add_argument('--repeat', type=int, default=2000, help='每次测量的重复次数')
+    args = parser.parse_args()
+
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+    member_system = MemberSystem()
+    for user_id in range(1, args.users + 1):
+        member_system.register_user(user_id, f"user{user_id}", f"User {user_id}")
+
+    rng = random.Random(42)
+    total = 0
+    print(f"{'records':>12} {'latest(us)':>12} {'page2(us)':>12} {'recharge(us)':>13}")
+    for size in sizes:
+        while total < size:
+            # 热点用户约占 1% 的写入
+            user_id = HOT_USER_ID if rng.random() < 0.01 else rng.randint(1, args.users)
+            member_system.add_balance(user_id, 1.0, "bench", "benchmark")
+            if total % 10 == 0:
+                member_system.create_recharge_order(user_id, 100.0, "usdt")
+            total += 1
+
+        _, cursor = member_system.get_user_transaction_page(HOT_USER_ID, args.limit)
+        latest = measure(lambda: member_system.get_user_transactions(HOT_USER_ID, args.limit), args.repeat)
+        page2 = measure(lambda: member_system.get_user_transaction_page(HOT_USER_ID, args.limit, cursor),
+                        args.repeat)
+        recharge = measure(lambda: member_system.get_user_recharge_history(HOT_USER_ID, 10), args.repeat)
+        print(f"{total:>12} {latest:>12.2f} {page2:>12.2f} {recharge:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
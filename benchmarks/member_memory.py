@@ -0,0 +1,138 @@
+"""会员记录内存占用基准测试
+
+对比余额变动记录的两种表示在大量记录下的内存占用和属性访问耗时：
+- legacy：原来的 dataclass（实例 __dict__、uuid4 字符串ID、datetime 时间），
+  按字符串ID放入字典
+- compact：当前的 __slots__ 表示（128 位整数ID、微秒整数时间、驻留的类型字符串），
+  按紧凑ID放入 IdMap
+- member_system：经 MemberSystem.add_balance 写入（紧凑表示 + 按用户的时间索引），
+  即生产代码中每条记录的实际占用
+
+每种表示和规模在独立进程中构建，按进程常驻内存（RSS）的增量计算每条记录的字节数。
+1000 万条 legacy 记录约需 5 GB 内存，内存不足时可用 --kinds 只测紧凑表示。
+
+用法：
+    python -m benchmarks.member_memory
+    python -m benchmarks.member_memory --sizes 1000000,10000000 --kinds legacy,compact
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from store.compact import IdMap
+from store.member import BalanceTransaction, MemberSystem
+
+TRANSACTION_TYPES = ('recharge', 'purchase', 'refund', 'bonus', 'referral')
+
+
+@dataclass
+class LegacyTransaction:
+    """原来的余额变动记录表示（对比用）"""
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: int = 0
+    amount: float = 0.0
+    balance_before: float = 0.0
+    balance_after: float = 0.0
+    transaction_type: str = ""
+    description: str = ""
+    related_order_id: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+
+
+def rss_mb() -> float:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def build(kind: str, count: int, users: int):
+    """构建 count 条记录，返回持有它们的容器"""
+    if kind == 'member_system':
+        member_system = MemberSystem()
+        for user_id in range(1, users + 1):
+            member_system.register_user(user_id, f"user{user_id}", f"User {user_id}")
+        for i in range(count):
+            # 交易类型来自运行时字符串（如从数据库读取），检验驻留效果
+            member_system.add_balance(i % users + 1, 1.0, ''.join(TRANSACTION_TYPES[i % 5]), "bench")
+        return member_system
+
+    if kind == 'legacy':
+        records = {}
+        for i in range(count):
+            record = LegacyTransaction(user_id=i % users + 1, amount=1.0, balance_before=float(i),
+                                       balance_after=float(i + 1),
+                                       transaction_type=''.join(TRANSACTION_TYPES[i % 5]), description="bench")
+            records[record.id] = record
+        return records
+
+    records = IdMap()
+    for i in range(count):
+        record = BalanceTransaction(user_id=i % users + 1, amount=1.0, balance_before=float(i),
+                                    balance_after=float(i + 1),
+                                    transaction_type=''.join(TRANSACTION_TYPES[i % 5]), description="bench")
+        records[record.key] = record
+    return records
+
+
+def access_ns(record, attr: str, repeat: int = 200000) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        getattr(record, attr)
+    return (time.perf_counter() - start) / repeat * 1e9
+
+
+def measure(kind: str, count: int, users: int, output):
+    # 模块在子进程启动时已随本模块导入，模块本身的占用不计入
+    gc.collect()
+    before = rss_mb()
+    start = time.perf_counter()
+    container = build(kind, count, users)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    used = rss_mb() - before
+
+    if kind == 'member_system':
+        record = next(iter(container.transactions.values()))
+    else:
+        record = next(iter(container.values()))
+    output.put({
+        'kind': kind,
+        'count': count,
+        'mb': used,
+        'bytes': used * 2 ** 20 / count,
+        'build_us': elapsed / count * 1e6,
+        'id_ns': access_ns(record, 'id'),
+        'created_ns': access_ns(record, 'created_at'),
+        'amount_ns': access_ns(record, 'amount'),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000000,10000000', help='逗号分隔的记录数')
+    parser.add_argument('--kinds', default='legacy,compact,member_system',
+                        help='逗号分隔的表示：legacy, compact, member_system')
+    parser.add_argument('--users', type=int, default=100000, help='用户数')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    print(f"{'kind':<14} {'records':>10} {'rss_mb':>9} {'bytes/rec':>10} {'build_us':>9} "
+          f"{'.id_ns':>7} {'.created_ns':>11} {'.amount_ns':>10}")
+    for count in (int(s) for s in args.sizes.split(',')):
+        for kind in args.kinds.split(','):
+            output = context.Queue()
+            process = context.Process(target=measure, args=(kind, count, args.users, output))
+            process.start()
+            result = output.get()
+            process.join()
+            print(f"{kind:<14} {count:>10} {result['mb']:>9.0f} {result['bytes']:>10.0f} {result['build_us']:>9.2f} "
+                  f"{result['id_ns']:>7.0f} {result['created_ns']:>11.0f} {result['amount_ns']:>10.0f}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""金额运算基准测试（以购买为主的负载）
+
+每次购买计算会员折扣、检查余额、扣款记账（账本以分为单位）、生成折扣备注，对比两种金额表示：
+- mixed：原来的实现，商品价格为 Decimal，折扣经 Decimal(str(rate)) 计算，
+  检查余额和扣款时用 float(total) 转为浮点数，记账前再换算为分，累计消费为浮点数
+- money：Money（整数分），折扣按等级表中预先换算的基点计算，全程整数运算
+
+另外用 Shop.create_order（余额支付，无持久化）测量完整下单流程的吞吐，
+并核对累计消费、账本和订单金额是否一致。
+
+用法：
+    python -m benchmarks.money_checkout
+    python -m benchmarks.money_checkout --purchases 500000 --users 1000
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+
+from store.member import MemberSystem
+from store.models import Product
+from store.money import MINOR_UNITS, ZERO, Money
+from store.shop import Shop
+from store.tiers import DEFAULT_TIERS
+
+STARTING_BALANCE = 10 ** 7  # 元，保证购买不会因余额不足失败
+
+
+class MixedAccounts:
+    """原来的余额表示（对比用）：用户余额和累计消费为浮点数（元），账本余额为整数（分）"""
+
+    def __init__(self, users: int):
+        self.balance = {user_id: float(STARTING_BALANCE) for user_id in range(users)}
+        self.spent = {user_id: 0.0 for user_id in range(users)}
+        self.ledger = {user_id: STARTING_BALANCE * MINOR_UNITS for user_id in range(users)}
+
+
+class MoneyAccounts:
+    """整数分表示：与 MemberSystem 相同，用户余额、累计消费和账本余额都是整数分"""
+
+    def __init__(self, users: int):
+        self.spent = {user_id: 0 for user_id in range(users)}
+        self.ledger = {user_id: STARTING_BALANCE * MINOR_UNITS for user_id in range(users)}
+
+
+def mixed_checkout(accounts: MixedAccounts, user_id: int, price: Decimal, discount_rate: float):
+    """原来的实现：Shop.create_order + MemberSystem.deduct_balance 中的金额运算"""
+    total_amount = price
+    discount_amount = Decimal('0.0')
+    if discount_rate > 0:
+        discount_amount = price * Decimal(str(discount_rate))
+        total_amount = price - discount_amount
+    if not accounts.balance[user_id] >= float(total_amount):
+        return None
+    amount = float(total_amount)
+    minor = int(round(amount * MINOR_UNITS))
+    balance = accounts.ledger[user_id] - minor
+    if balance < 0:
+        return None
+    accounts.ledger[user_id] = balance
+    balance_before = (balance + minor) / MINOR_UNITS
+    accounts.balance[user_id] = balance_after = balance / MINOR_UNITS
+    accounts.spent[user_id] += amount
+    notes = f"会员折扣：-¥{discount_amount:.2f}" if discount_amount > 0 else None
+    return total_amount, balance_before, balance_after, notes
+
+
+def money_checkout(accounts: MoneyAccounts, user_id: int, price: Money, discount_bp: int):
+    """Money 实现：Shop.quote + MemberSystem.deduct_balance 中的金额运算"""
+    discount_amount, total_amount = ZERO, price
+    if discount_bp:
+        discount_amount = price.at_rate(discount_bp)
+        total_amount = price - discount_amount
+    cents = total_amount.cents
+    balance = accounts.ledger[user_id] - cents
+    if balance < 0:
+        return None
+    accounts.ledger[user_id] = balance
+    balance_before = Money.from_cents(balance + cents)
+    balance_after = Money.from_cents(balance)
+    accounts.spent[user_id] += cents
+    notes = f"会员折扣：-¥{discount_amount:.2f}" if discount_amount else None
+    return total_amount, balance_before, balance_after, notes
+
+
+def arithmetic(purchases: int, users: int, products: int, rng: random.Random):
+    prices = ['%d.%02d' % (rng.randint(1, 500), rng.randint(0, 99)) for _ in range(products)]
+    tiers = [DEFAULT_TIERS.benefits(rng.choice(DEFAULT_TIERS.levels)) for _ in range(users)]
+    workload = [(rng.randrange(users), rng.randrange(products)) for _ in range(purchases)]
+
+    decimal_prices = [Decimal(price) for price in prices]
+    mixed = MixedAccounts(users)
+    start = time.perf_counter()
+    for user_id, product in workload:
+        mixed_checkout(mixed, user_id, decimal_prices[product], tiers[user_id].discount)
+    mixed_time = time.perf_counter() - start
+
+    money_prices = [Money(price) for price in prices]
+    exact = MoneyAccounts(users)
+    start = time.perf_counter()
+    for user_id, product in workload:
+        money_checkout(exact, user_id, money_prices[product], tiers[user_id].discount_bp)
+    money_time = time.perf_counter() - start
+
+    print(f"{'':<8} {'us/purchase':>12} {'purchases/s':>12}")
+    for label, elapsed in (('mixed', mixed_time), ('money', money_time)):
+        print(f"{label:<8} {elapsed / purchases * 1e6:>12.2f} {purchases / elapsed:>12.0f}")
+    print(f"speedup {mixed_time / money_time:.2f}x")
+
+    # 精确性：账本（整数分）是实际扣款，累计消费与其比较
+    def charged(accounts):
+        return sum(STARTING_BALANCE * MINOR_UNITS - balance for balance in accounts.ledger.values())
+    drift = abs(sum(mixed.spent.values()) * MINOR_UNITS - charged(mixed))
+    print(f"mixed: 累计消费（浮点）与实际扣款相差 {drift:.6f} 分；"
+          f"money: 累计消费与实际扣款{'一致' if sum(exact.spent.values()) == charged(exact) else '不一致'}")
+
+
+def end_to_end(purchases: int, users: int, products: int, rng: random.Random):
+    shop = Shop(MemberSystem())
+    shop._process_order_fulfillment = lambda order: None  # 不打印发货信息
+    member_system = shop.member_system
+    for user_id in range(1, users + 1):
+        member_system.register_user(user_id, f"user{user_id}", f"User {user_id}")
+        member_system.add_balance(user_id, Money(STARTING_BALANCE), "recharge", "benchmark")
+        user = member_system.get_user(user_id)
+        user.total_recharged = Money(rng.choice((0, 600, 2500, 6000, 12000, 40000)))
+        user.update_level()
+    catalog = []
+    for i in range(products):
+        product = Product(id=f"bench-{i}", name=f"Bench {i}", description="benchmark",
+                          price=Money('%d.%02d' % (rng.randint(1, 500), rng.randint(0, 99))), stock=purchases)
+        shop.add_product(product)
+        catalog.append(product.id)
+    workload = [(str(rng.randint(1, users)), rng.choice(catalog)) for _ in range(purchases)]
+
+    start = time.perf_counter()
+    orders = [shop.create_order(user_id, product_id, 'balance')['order'] for user_id, product_id in workload]
+    elapsed = time.perf_counter() - start
+
+    spent = sum(member_system.get_user(user_id).total_spent for user_id in range(1, users + 1))
+    consistent = (spent == sum(order.total_amount for order in orders)
+                  and spent.cents == member_system.ledger.system_balance('purchase')
+                  and member_system.ledger.trial_balance() == 0)
+    print(f"Shop.create_order(balance): {elapsed / purchases * 1e6:.1f}us/purchase "
+          f"({purchases / elapsed:.0f}/s), 累计消费 ¥{spent}，与订单和账本{'一致' if consistent else '不一致'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--purchases', type=int, default=200000, help='购买次数')
+    parser.add_argument('--users', type=int, default=1000, help='用户数')
+    parser.add_argument('--products', type=int, default=200, help='商品数')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    arithmetic(args.purchases, args.users, args.products, random.Random(args.seed))
+    end_to_end(min(args.purchases, 50000), args.users, args.products, random.Random(args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""热点商品库存争用基准测试
+
+多个线程、每个线程内多个协程同时抢购同一个商品，对比：
+- naive：先检查 stock 再在 await 之后扣减（原 create_order 的写法）
+- reservations：StockReservations 原子预占
+
+报告吞吐量以及成功数是否超过库存（超卖）。
+
+用法：
+    python -m benchmarks.stock_contention
+    python -m benchmarks.stock_contention --threads 8 --coroutines 500 --stock 1000
+"""
+import argparse
+import asyncio
+import threading
+import time
+import uuid
+
+from store.inventory import StockReservations
+
+PRODUCT_ID = "hot_sku"
+
+
+class NaiveStock:
+    """原先的检查后扣减写法"""
+
+    def __init__(self, stock: int):
+        self.stock = stock
+
+    async def buy(self) -> bool:
+        if self.stock <= 0:
+            return False
+        await asyncio.sleep(0)  # 模拟创建支付订单时让出事件循环
+        self.stock -= 1
+        return True
+
+
+class ReservedStock:
+    def __init__(self, stock: int):
+        self.inventory = StockReservations()
+        self.inventory.set_stock(PRODUCT_ID, stock)
+
+    async def buy(self) -> bool:
+        order_id = uuid.uuid4().hex
+        if not self.inventory.reserve(order_id, PRODUCT_ID):
+            return False
+        await asyncio.sleep(0)
+        return self.inventory.commit(order_id)
+
+
+def run(target, threads: int, coroutines: int, attempts: int):
+    successes = []
+    lock = threading.Lock()
+
+    async def worker():
+        count = 0
+        for _ in range(attempts):
+            if await target.buy():
+                count += 1
+        return count
+
+    async def thread_main():
+        return sum(await asyncio.gather(*(worker() for _ in range(coroutines))))
+
+    def thread_entry():
+        result = asyncio.run(thread_main())
+        with lock:
+            successes.append(result)
+
+    workers = [threading.Thread(target=thread_entry) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return sum(successes), threads * coroutines * attempts, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=4, help='线程数')
+    parser.add_argument('--coroutines', type=int, default=200, help='每个线程的协程数')
+    parser.add_argument('--attempts', type=int, default=20, help='每个协程的下单次数')
+    parser.add_argument('--stock', type=int, default=5000, help='热点商品库存')
+    args = parser.parse_args()
+
+    for name, factory in (('naive', NaiveStock), ('reservations', ReservedStock)):
+        target = factory(args.stock)
+        sold, attempts, elapsed = run(target, args.threads, args.coroutines, args.attempts)
+        oversold = max(0, sold - args.stock)
+        print(f"{name:<13} attempts={attempts:<8} sold={sold:<7} stock={args.stock:<7} "
+              f"oversold={oversold:<6} {attempts / elapsed:>10.0f} ops/s")
+
+
+if __name__ == '__main__':
+    main()
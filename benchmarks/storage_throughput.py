@@ -0,0 +1,59 @@
+"""SQLite 持久化写入吞吐基准测试
+
+对比分组提交与逐条提交（batch_size=1）下余额变动的写入吞吐和提交次数。
+
+用法：
+    python -m benchmarks.storage_throughput
+    python -m benchmarks.storage_throughput --writes 200000 --path /tmp/bench.db
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from store.member import MemberSystem
+from store.storage import SQLiteStorage
+
+
+def run(path: str, writes: int, users: int, batch_size: int) -> None:
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    storage = SQLiteStorage(path, batch_size=batch_size)
+    member_system = MemberSystem(storage)
+    for user_id in range(1, users + 1):
+        member_system.register_user(user_id, f"user{user_id}", f"User {user_id}")
+    storage.flush()
+    commits_before = storage.commits
+
+    start = time.perf_counter()
+    for i in range(writes):
+        member_system.add_balance(i % users + 1, 1.0, "bench", "benchmark")
+    enqueued = time.perf_counter() - start
+    storage.flush()
+    elapsed = time.perf_counter() - start
+    commits = storage.commits - commits_before
+    storage.close()
+
+    print(f"batch_size={batch_size:<6} writes={writes:<8} "
+          f"enqueue={writes / enqueued:>10.0f}/s durable={writes / elapsed:>10.0f}/s "
+          f"commits={commits:<8} rows/commit={writes * 2 / max(commits, 1):.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writes', type=int, default=50000, help='余额变动次数')
+    parser.add_argument('--users', type=int, default=1000, help='用户数量')
+    parser.add_argument('--path', default=os.path.join(tempfile.gettempdir(), 'umbot_bench.db'),
+                        help='数据库文件路径')
+    parser.add_argument('--unbatched-writes', type=int, default=2000,
+                        help='逐条提交模式的写入次数（每次提交都会 fsync，较慢）')
+    args = parser.parse_args()
+
+    run(args.path, args.writes, args.users, batch_size=1000)
+    run(args.path, args.unbatched_writes, args.users, batch_size=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,442 @@
+"""支付回调负载测试
+
+为会员充值回调（UMPay MD5 / BEpusdt SHA256 签名）和商城 BEpusdt 回调（MD5 签名）
+生成正确签名的回调，按指定速率开环重放，其中包含重复回调和错误签名的回调。
+可以在进程内（Flask test client）发送，也可以通过本机回环发送（werkzeug 服务器，
+模拟网关在独立进程中运行）。
+
+报告吞吐、确认延迟分位数，并在结算完成后检查正确性：
+- 错误签名全部被拒绝，对应的充值记录/订单保持待支付
+- 重复回调全部被确认且不再结算
+- 每笔充值只入账一次：用户余额 = 已支付充值的金额 + 赠送，每笔充值只有一条通知
+- 每个订单只完成、发货一次，库存没有超卖
+
+用法：
+    python -m benchmarks.webhook_load
+    python -m benchmarks.webhook_load --transport loopback --rate 500 --seconds 10
+    python -m benchmarks.webhook_load --gateways umpay --duplicates 0.3 --bad-signatures 0.1
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, NamedTuple
+
+from store.money import ZERO, Money
+
+UMPAY_SECRET = 'bench-umpay-secret'
+BEPUSDT_SECRET = 'bench-bepusdt-secret'
+
+# 网关 -> 回调路径
+PATHS = {
+    'umpay': '/webhook/member/umpay',
+    'bepusdt_member': '/webhook/member/bepusdt',
+    'bepusdt_shop': '/webhook/bepusdt',
+}
+
+VALID = 'valid'
+DUPLICATE = 'duplicate'
+BAD_SIGNATURE = 'bad_signature'
+
+
+class Callback(NamedTuple):
+    gateway: str
+    kind: str
+    target: str     # 充值记录ID / 订单ID
+    body: str
+
+
+class StubTelegram(BaseHTTPRequestHandler):
+    """只接受 sendMessage 的模拟 Bot API"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        body = b'{"ok":true,"result":{}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def schedule(count: int, rate: float, clients: int, send):
+    """按计划时间开环调用 send(index)，返回 (耗时, [(index, 状态码, 延迟)])
+
+    延迟从计划发送时间算起，服务变慢时排队时间也计入延迟。
+    """
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(count))
+    start = time.perf_counter() + 0.2
+
+    def client():
+        sender = send()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            scheduled = start + index / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            status = sender(index)
+            latency = time.perf_counter() - scheduled
+            with lock:
+                results.append((index, status, latency))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, results
+
+
+def gateway(targets: List, rate: float, clients: int, output):
+    """模拟网关（独立进程）：targets 为 [(端口, 路径, 请求体)]，每个连接保持长连接"""
+    def send():
+        connections: Dict[int, http.client.HTTPConnection] = {}
+
+        def post(index):
+            port, path, body = targets[index]
+            conn = connections.get(port)
+            if conn is None:
+                conn = connections[port] = http.client.HTTPConnection('127.0.0.1', port)
+            conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        return post
+
+    output.put(schedule(len(targets), rate, clients, send))
+
+
+class Harness:
+    """准备数据、生成回调、发送并检查结果"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+        from store.models import Product
+        import webhooks.bepusdt_callback as shop_app
+        import webhooks.member_callback as member_app
+
+        self.member_app = member_app
+        self.shop_app = shop_app
+        self.member_system = member_app.member_system
+        self.shop = shop_app.shop
+        self.storage = member_app.state.storage
+        self.Product = Product
+
+        # 统计每个订单的发货次数
+        self.deliveries: Counter = Counter()
+        deliver = self.shop.deliver_order
+
+        def counting_deliver(order):
+            self.deliveries[order.id] += 1
+            return deliver(order)
+        self.shop.deliver_order = counting_deliver
+
+        self.records = {}       # 充值记录ID -> 目标类型（VALID / BAD_SIGNATURE）
+        self.orders = {}        # 订单ID -> 目标类型
+        self.order_products: Counter = Counter()
+        self.stock: Dict[str, int] = {}
+        self.starting_balance: Dict[int, Money] = {}
+
+    # ---- 数据准备 ----
+
+    def seed(self, gateway: str, count: int) -> List[str]:
+        if gateway == 'bepusdt_shop':
+            return self._seed_orders(count)
+        return self._seed_records(gateway, count)
+
+    def _user(self, index: int) -> int:
+        user_id = 1 + index % self.args.users
+        if user_id not in self.starting_balance:
+            if not self.member_system.get_user(user_id):
+                self.member_system.register_user(user_id, f"user{user_id}", f"User {user_id}")
+            self.starting_balance[user_id] = self.member_system.get_user(user_id).balance
+        return user_id
+
+    def _seed_records(self, gateway: str, count: int) -> List[str]:
+        method = 'umpay' if gateway == 'umpay' else 'bepusdt'
+        return [self.member_system.create_recharge_order(self._user(i), float(10 + i % 50), method).id
+                for i in range(count)]
+
+    def _seed_orders(self, count: int) -> List[str]:
+        # 每个商品价格不同，避免同一金额的唯一金额偏移耗尽
+        per_product = 500
+        products = []
+        for i in range(count // per_product + 1):
+            product = self.Product(id=f"bench-{uuid.uuid4().hex[:8]}", name=f"Bench {i}",
+                                   description="load test", price=Money(10 + i), stock=per_product + 10)
+            self.shop.add_product(product)
+            self.stock[product.id] = product.stock
+            products.append(product)
+        ids = []
+        for i in range(count):
+            product = products[i // per_product]
+            result = self.shop.create_order(str(self._user(i)), product.id, 'usdt')
+            ids.append(result['order'].id)
+            self.order_products[product.id] += 1
+        return ids
+
+    # ---- 生成回调 ----
+
+    def payload(self, gateway: str, target: str) -> Dict:
+        tx = uuid.uuid4().hex
+        if gateway == 'bepusdt_shop':
+            return {'order_id': target, 'status': 'paid', 'amount': '10', 'currency': 'USDT',
+                    'tx_hash': tx, 'paid_at': int(time.time())}
+        return {'order_id': target, 'status': 'paid', 'payment_order_id': tx}
+
+    def sign(self, gateway: str, data: Dict) -> str:
+        if gateway == 'umpay':
+            return self.member_app.umpay_signature(data)
+        if gateway == 'bepusdt_member':
+            return self.member_app.bepusdt_member_signature(data)
+        return self.shop.bepusdt._generate_signature(data)
+
+    def build(self) -> List[Callback]:
+        args = self.args
+        gateways = args.gateways.split(',')
+        total = int(args.rate * args.seconds)
+        per_gateway = total // len(gateways)
+        callbacks = []
+        for gateway in gateways:
+            duplicates = int(per_gateway * args.duplicates)
+            bad = int(per_gateway * args.bad_signatures)
+            valid = per_gateway - duplicates - bad
+            targets = self.seed(gateway, valid + bad)
+            registry = self.orders if gateway == 'bepusdt_shop' else self.records
+
+            originals = []
+            for index, target in enumerate(targets):
+                data = self.payload(gateway, target)
+                if index < valid:
+                    data['signature'] = self.sign(gateway, data)
+                    registry[target] = VALID
+                    originals.append(data)
+                    callbacks.append(Callback(gateway, VALID, target, json.dumps(data)))
+                else:
+                    data['signature'] = self.sign(gateway, dict(data, amount='999999'))
+                    registry[target] = BAD_SIGNATURE
+                    callbacks.append(Callback(gateway, BAD_SIGNATURE, target, json.dumps(data)))
+            for _ in range(duplicates):
+                data = self.rng.choice(originals)
+                callbacks.append(Callback(gateway, DUPLICATE, data['order_id'], json.dumps(data)))
+        self.rng.shuffle(callbacks)
+        # 重复回调排在同一笔回调之后，模拟网关重试
+        seen = set()
+        for index, callback in enumerate(callbacks):
+            if callback.kind == DUPLICATE and callback.target not in seen:
+                callbacks[index] = callback._replace(kind=VALID)
+                seen.add(callback.target)
+            elif callback.kind == VALID:
+                if callback.target in seen:
+                    callbacks[index] = callback._replace(kind=DUPLICATE)
+                seen.add(callback.target)
+        self.storage.flush()
+        return callbacks
+
+    # ---- 发送 ----
+
+    def send_inprocess(self, callbacks: List[Callback]):
+        apps = {'bepusdt_shop': self.shop_app.app}
+
+        def send():
+            clients = {id(app): app.test_client() for app in (self.member_app.app, self.shop_app.app)}
+
+            def post(index):
+                callback = callbacks[index]
+                app = apps.get(callback.gateway, self.member_app.app)
+                response = clients[id(app)].post(PATHS[callback.gateway], data=callback.body,
+                                                 headers={'Content-Type': 'application/json'})
+                return response.status_code
+            return post
+
+        return schedule(len(callbacks), self.args.rate, self.args.clients, send)
+
+    def send_loopback(self, callbacks: List[Callback]):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class KeepAliveHandler(WSGIRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        servers = {}
+        for name, app in (('member', self.member_app.app), ('shop', self.shop_app.app)):
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            servers[name] = server
+        targets = [(servers['shop' if c.gateway == 'bepusdt_shop' else 'member'].server_port,
+                    PATHS[c.gateway], c.body) for c in callbacks]
+
+        context = multiprocessing.get_context('spawn')
+        output = context.Queue()
+        process = context.Process(target=gateway, args=(targets, self.args.rate, self.args.clients, output))
+        process.start()
+        result = output.get()
+        process.join()
+        for server in servers.values():
+            server.shutdown()
+        return result
+
+    def drain(self, timeout: float = 120.0) -> float:
+        """等待所有回调结算完，返回等待时间"""
+        start = time.perf_counter()
+        pools = (self.member_app.settlement, self.shop_app.settlement)
+        while time.perf_counter() - start < timeout:
+            self.storage.flush()
+            pending = [self.storage.callback_event_counts(pool.gateways) for pool in pools]
+            if all(not counts.get('queued') and not counts.get('settling') and not pool.metrics()['inflight']
+                   for counts, pool in zip(pending, pools)):
+                break
+            time.sleep(0.02)
+        return time.perf_counter() - start
+
+    # ---- 检查 ----
+
+    def check(self, callbacks: List[Callback], results) -> List[tuple]:
+        checks = []
+        statuses = defaultdict(Counter)
+        for index, status, _ in results:
+            statuses[callbacks[index].kind][status] += 1
+
+        bad = statuses[BAD_SIGNATURE]
+        checks.append(("错误签名全部被拒绝(400)", sum(bad.values()) == bad[400], dict(bad)))
+        dup = statuses[DUPLICATE]
+        checks.append(("重复回调全部被确认(200/409)", sum(dup.values()) == dup[200] + dup[409], dict(dup)))
+        valid = statuses[VALID]
+        checks.append(("有效回调全部被确认(200)", sum(valid.values()) == valid[200], dict(valid)))
+
+        if self.records:
+            paid = defaultdict(lambda: ZERO)
+            wrong = 0
+            for record_id, kind in self.records.items():
+                record = self.member_system.get_recharge_record(record_id)
+                expected = 'paid' if kind == VALID else 'pending'
+                wrong += record.status != expected
+                if record.status == 'paid':
+                    paid[record.user_id] += record.amount + record.bonus_amount
+            checks.append(("充值记录状态正确（有效已支付、错误签名仍待支付）", wrong == 0, f"{wrong} 条不符"))
+
+            mismatched = [user_id for user_id, start in self.starting_balance.items()
+                          if self.member_system.get_user(user_id).balance - start != paid[user_id]]
+            checks.append(("没有重复入账（余额 = 入账充值 + 赠送）", not mismatched, f"{len(mismatched)} 个用户不符"))
+
+            notified = sum(self.storage.notification_counts().values())
+            expected = sum(1 for kind in self.records.values() if kind == VALID)
+            checks.append(("每笔充值只有一条通知", notified == expected, f"{notified}/{expected}"))
+
+        if self.orders:
+            from store.models import PaymentStatus
+            wrong = 0
+            for order_id, kind in self.orders.items():
+                order = self.shop.get_order(order_id)
+                expected = PaymentStatus.COMPLETED if kind == VALID else PaymentStatus.PENDING
+                wrong += order.payment_status != expected
+            checks.append(("订单状态正确（有效已完成、错误签名仍待支付）", wrong == 0, f"{wrong} 个不符"))
+
+            valid_orders = sum(1 for kind in self.orders.values() if kind == VALID)
+            twice = sum(1 for count in self.deliveries.values() if count > 1)
+            delivered = sum(self.deliveries.values())
+            checks.append(("每个订单只发货一次", twice == 0 and delivered == valid_orders,
+                           f"发货 {delivered} 次 / 订单 {valid_orders} 个"))
+
+            oversold = [product_id for product_id, stock in self.stock.items()
+                        if self.shop.inventory.available(product_id) != stock - self.order_products[product_id]]
+            checks.append(("库存没有超卖或重复扣减", not oversold, f"{len(oversold)} 个商品不符"))
+        return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transport', choices=('inprocess', 'loopback'), default='inprocess',
+                        help='进程内调用 Flask 应用，或通过本机回环发送 HTTP 请求')
+    parser.add_argument('--gateways', default='umpay,bepusdt_member,bepusdt_shop',
+                        help='发送的回调类型（逗号分隔）: ' + ', '.join(PATHS))
+    parser.add_argument('--rate', type=float, default=500, help='每秒发送的回调数')
+    parser.add_argument('--seconds', type=float, default=5, help='发送时长（秒）')
+    parser.add_argument('--duplicates', type=float, default=0.1, help='重复回调比例')
+    parser.add_argument('--bad-signatures', type=float, default=0.05, help='错误签名回调比例')
+    parser.add_argument('--users', type=int, default=200, help='用户数')
+    parser.add_argument('--clients', type=int, default=32, help='并发连接数')
+    parser.add_argument('--workers', type=int, default=4, help='结算线程数')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    args = parser.parse_args()
+
+    telegram = ThreadingHTTPServer(('127.0.0.1', 0), StubTelegram)
+    threading.Thread(target=telegram.serve_forever, daemon=True).start()
+    db_dir = tempfile.mkdtemp(prefix='webhook-load-')
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(db_dir, 'store.db')}",
+        'UMPAY_SECRET': UMPAY_SECRET,
+        'BEPUSDT_API_URL': 'http://127.0.0.1:9',
+        'BEPUSDT_APP_ID': 'bench',
+        'BEPUSDT_APP_SECRET': BEPUSDT_SECRET,
+        'TELEGRAM_TOKEN': '1:bench',
+        'TELEGRAM_API_BASE': f"http://127.0.0.1:{telegram.server_port}",
+        'SETTLEMENT_WORKERS': str(args.workers),
+    })
+
+    # 商城发货会打印日志，测试期间屏蔽
+    with contextlib.redirect_stdout(io.StringIO()):
+        harness = Harness(args)
+        logging.getLogger().setLevel(logging.CRITICAL)
+        callbacks = harness.build()
+        send = harness.send_loopback if args.transport == 'loopback' else harness.send_inprocess
+        elapsed, results = send(callbacks)
+        drained = harness.drain()
+        checks = harness.check(callbacks, results)
+
+    kinds = Counter(c.kind for c in callbacks)
+    print(f"transport={args.transport} gateways={args.gateways} workers={args.workers} cpus={os.cpu_count()}")
+    print(f"sent={len(callbacks)} ({kinds[VALID]} valid, {kinds[DUPLICATE]} duplicate, "
+          f"{kinds[BAD_SIGNATURE]} bad signature) target={args.rate:.0f}/s "
+          f"achieved={len(callbacks) / elapsed:.0f}/s settlement drained {drained:.2f}s after sending")
+    by_gateway = defaultdict(list)
+    for index, status, latency in results:
+        by_gateway[callbacks[index].gateway].append(latency)
+    by_gateway['all'] = [latency for _, _, latency in results]
+    for name, latencies in by_gateway.items():
+        print(f"  {name:<15} n={len(latencies):<6} p50={percentile(latencies, 0.5) * 1000:>8.2f}ms "
+              f"p95={percentile(latencies, 0.95) * 1000:>8.2f}ms p99={percentile(latencies, 0.99) * 1000:>8.2f}ms "
+              f"max={max(latencies) * 1000:>8.2f}ms")
+    failed = False
+    for name, ok, detail in checks:
+        failed |= not ok
+        print(f"  [{'OK' if ok else 'FAIL'}] {name}: {detail}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 调用类型
+CHAIN = "chain"         # 链上查询（UMPay / tronpy）
+GATEWAY = "gateway"     # 同步 HTTP 网关调用
+SHOP = "shop"           # 商城下单等会修改余额/库存的操作
+STATE = "state"         # 同步其他进程写入的共享状态
+
+# 每种调用类型的并发上限。下单会检查并扣减会员余额（MemberSystem 未加锁），
+# 因此逐个执行；链上查询限制并发，避免慢请求占满线程池。同步共享状态同时只有一次。
+DEFAULT_LIMITS = {
+    CHAIN: 4,
+    GATEWAY: 8,
+    SHOP: 1,
+    STATE: 1,
+}
+
+
+class CallStats:
+    """单个调用类型的统计"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.calls = 0
+        self.errors = 0
+        self.waiting = 0            # 等待并发名额或线程的调用数
+        self.running = 0
+        self.queue_time = 0.0       # 累计排队时间（提交到开始执行）
+        self.max_queue_time = 0.0
+        self.run_time = 0.0         # 累计执行时间
+        self.max_run_time = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        done = max(self.calls, 1)
+        return {
+            'limit': self.limit,
+            'calls': self.calls,
+            'errors': self.errors,
+            'waiting': self.waiting,
+            'running': self.running,
+            'avg_queue_ms': round(self.queue_time / done * 1000, 2),
+            'max_queue_ms': round(self.max_queue_time * 1000, 2),
+            'avg_run_ms': round(self.run_time / done * 1000, 2),
+            'max_run_ms': round(self.max_run_time * 1000, 2),
+        }
+
+
+class BlockingExecutor:
+    """阻塞调用调度器
+
+    处理器中的同步调用（链上查询、HTTP 请求、下单）放到有界线程池中执行，
+    事件循环在等待期间继续处理其他会话。每种调用类型有独立的并发上限，
+    一种调用变慢时不会占满线程池、拖住其他类型的调用。
+    """
+
+    def __init__(self, max_workers: int = 16, limits: Optional[Dict[str, int]] = None,
+                 default_limit: int = 4):
+        """
+        Args:
+            max_workers: 线程池大小
+            limits: 每种调用类型的并发上限
+            default_limit: 未配置的调用类型的并发上限
+        """
+        self.max_workers = max_workers
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.default_limit = default_limit
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking")
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, CallStats] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str):
+        stats = self._stats.get(kind)
+        if stats is None:
+            limit = self.limits.get(kind, self.default_limit)
+            # 信号量在事件循环中首次使用时创建
+            self._semaphores[kind] = asyncio.Semaphore(limit)
+            stats = self._stats[kind] = CallStats(limit)
+        return self._semaphores[kind], stats
+
+    async def run(self, kind: str, func: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行阻塞调用
+
+        Args:
+            kind: 调用类型，决定并发上限
+            func: 同步函数
+
+        Returns:
+            函数返回值（异常原样抛出）
+        """
+        semaphore, stats = self._get(kind)
+        submitted = time.perf_counter()
+        started_flag = []
+        with self._lock:
+            stats.waiting += 1
+
+        def call():
+            started = time.perf_counter()
+            with self._lock:
+                started_flag.append(True)
+                queued = started - submitted
+                stats.waiting -= 1
+                stats.running += 1
+                stats.queue_time += queued
+                stats.max_queue_time = max(stats.max_queue_time, queued)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    stats.running -= 1
+                    stats.calls += 1
+                    stats.run_time += elapsed
+                    stats.max_run_time = max(stats.max_run_time, elapsed)
+
+        loop = asyncio.get_event_loop()
+        try:
+            async with semaphore:
+                return await loop.run_in_executor(self._pool, call)
+        except asyncio.CancelledError:
+            # 在开始执行前被取消
+            with self._lock:
+                if not started_flag:
+                    stats.waiting -= 1
+            raise
+        except Exception:
+            with self._lock:
+                stats.errors += 1
+            raise
+
+    def wrap(self, kind: str, func: Callable) -> Callable:
+        """返回在线程池中执行 func 的协程函数"""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.run(kind, func, *args, **kwargs)
+        return wrapper
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """每种调用类型的排队/执行统计"""
+        with self._lock:
+            return {kind: stats.snapshot() for kind, stats in self._stats.items()}
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+_executor: Optional[BlockingExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> BlockingExecutor:
+    """获取本进程共享的阻塞调用调度器"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = BlockingExecutor()
+    return _executor
+
+
+async def run_blocking(kind: str, func: Callable, *args, **kwargs) -> Any:
+    """在共享线程池中执行阻塞调用"""
+    return await get_executor().run(kind, func, *args, **kwargs)
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from bot.executor import SHOP, run_blocking
+from payments.umpay import UMPay
+from store.member import MemberSystem, RechargeRecord
+from store.models import Order, PaymentStatus
+from store.shop import Shop
+from config import PAYMENT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """分层时间轮
+
+    第 k 层的每个槽位覆盖 slots**k 个 tick。添加、取消定时器都是 O(1)；
+    每前进一个 tick 处理第 0 层的一个槽位，低层转完一圈时把高层对应槽位
+    的定时器重新分配到低层，均摊到每个定时器上也是 O(1)。
+
+    定时器由线程池中的处理器添加、在事件循环中推进，所有操作在同一把锁内完成。
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4,
+                 now: Optional[float] = None):
+        """
+        Args:
+            tick: 每个 tick 的时长（秒）
+            slots: 每层的槽位数
+            levels: 层数，可覆盖 tick * slots**levels 秒
+            now: 起始时间戳，默认当前时间
+        """
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels: List[List[Dict[Hashable, Tuple[int, Any]]]] = [
+            [{} for _ in range(slots)] for _ in range(levels)
+        ]
+        self._locations: Dict[Hashable, Tuple[int, int]] = {}  # 键 -> (层, 槽位)
+        self._current = self._to_tick(time.time() if now is None else now)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._locations
+
+    def _to_tick(self, timestamp: float) -> int:
+        return int(math.ceil(timestamp / self.tick))
+
+    def _place(self, key: Hashable, expires_tick: int, value: Any):
+        delta = expires_tick - self._current
+        if delta <= 0:
+            # 已到期（如重启后登记的逾期订单）：当前槽位已处理过，放入下一个要处理的槽位
+            slot = (self._current + 1) % self.slots
+            self._wheels[0][slot][key] = (expires_tick, value)
+            self._locations[key] = (0, slot)
+            return
+        level = 0
+        span = self.slots
+        while delta >= span and level < self.levels - 1:
+            level += 1
+            span *= self.slots
+        slot = (expires_tick // (self.slots ** level)) % self.slots
+        self._wheels[level][slot][key] = (expires_tick, value)
+        self._locations[key] = (level, slot)
+
+    def schedule(self, key: Hashable, expires_at: float, value: Any = None) -> bool:
+        """添加定时器（同一个键重复添加时覆盖原定时器）
+
+        Returns:
+            是否为新的定时器（键原来不存在）
+        """
+        with self._lock:
+            existed = self._cancel(key)
+            self._place(key, self._to_tick(expires_at), value)
+        return not existed
+
+    def cancel(self, key: Hashable) -> bool:
+        """取消定时器"""
+        with self._lock:
+            return self._cancel(key)
+
+    def _cancel(self, key: Hashable) -> bool:
+        location = self._locations.pop(key, None)
+        if location is None:
+            return False
+        level, slot = location
+        self._wheels[level][slot].pop(key, None)
+        return True
+
+    def advance(self, now: Optional[float] = None) -> List[Tuple[Hashable, Any]]:
+        """推进时间轮到指定时间
+
+        Returns:
+            到期的 (键, 值) 列表
+        """
+        target = self._to_tick(time.time() if now is None else now)
+        expired = []
+        with self._lock:
+            self._advance(target, expired)
+        return expired
+
+    def _advance(self, target: int, expired: List):
+        while self._current < target:
+            self._current += 1
+            # 低层转完一圈时，从高层到低层依次重新分配
+            for level in range(self.levels - 1, 0, -1):
+                if self._current % (self.slots ** level) == 0:
+                    self._cascade(level, expired)
+            bucket = self._wheels[0][self._current % self.slots]
+            if bucket:
+                self._fire(bucket, expired)
+
+    def _cascade(self, level: int, expired: List):
+        slot = (self._current // (self.slots ** level)) % self.slots
+        bucket = self._wheels[level][slot]
+        if not bucket:
+            return
+        self._wheels[level][slot] = {}
+        for key, (expires_tick, value) in bucket.items():
+            del self._locations[key]
+            if expires_tick <= self._current:
+                expired.append((key, value))
+            else:
+                self._place(key, expires_tick, value)
+
+    def _fire(self, bucket: Dict, expired: List):
+        due = [key for key, (expires_tick, _) in bucket.items() if expires_tick <= self._current]
+        for key in due:
+            _, value = bucket.pop(key)
+            del self._locations[key]
+            expired.append((key, value))
+
+
+# 定时器类型
+RECHARGE = "recharge"
+PAYMENT = "payment"
+ORDER = "order"
+
+
+class ExpiryScheduler:
+    """到期调度器
+
+    在机器人进程中统一处理待支付充值记录、UMPay 支付订单和商城订单的过期：
+    创建时登记到时间轮，到期后触发释放逻辑（标记过期、归还库存等）。
+
+    登记回调在线程池中调用（阻塞的下单、充值调用触发）。过期处理会同步提交数据库
+    （见 Shop.fail_order），因此时间轮也在线程池中推进，与下单一样按 SHOP 类型逐个执行；
+    时间轮自带锁，队列深度统计另用一把锁。
+    """
+
+    def __init__(self, member_system: MemberSystem, shop: Shop, umpay: UMPay, tick: float = 1.0):
+        self.member_system = member_system
+        self.shop = shop
+        self.umpay = umpay
+        self.tick = tick
+        self.wheel = TimerWheel(tick=tick)
+        self._handlers: Dict[str, Callable[[str], bool]] = {
+            RECHARGE: self._expire_recharge,
+            PAYMENT: self.umpay.expire_order,
+            ORDER: self._expire_order,
+        }
+        self._depth: Dict[str, int] = {RECHARGE: 0, PAYMENT: 0, ORDER: 0}
+        self._depth_lock = threading.Lock()
+        self.fired: Dict[str, int] = {RECHARGE: 0, PAYMENT: 0, ORDER: 0}
+        self.max_lag = 0.0
+
+    def attach(self):
+        """注册创建回调，并登记已有的待支付记录"""
+        self.member_system.on_recharge_created = self.track_recharge
+        self.shop.on_order_created = self.track_order
+        self.umpay.on_order_created = self.track_payment
+
+        for record in self.member_system.recharge_records.values():
+            if record.status == "pending":
+                self.track_recharge(record)
+        for order in self.shop.orders.values():
+            if order.payment_status == PaymentStatus.PENDING:
+                self.track_order(order)
+        for payment in self.umpay.orders.values():
+            if payment['status'] == 'pending':
+                self.track_payment(payment)
+
+    def _schedule(self, kind: str, key: str, expires_at: float):
+        # 值记录应触发的时间，用于统计触发延迟（已过期的记录从登记时刻算起）
+        if self.wheel.schedule((kind, key), expires_at, max(expires_at, time.time())):
+            with self._depth_lock:
+                self._depth[kind] += 1
+
+    def track_recharge(self, record: RechargeRecord):
+        self._schedule(RECHARGE, record.id, record.expires_at.timestamp())
+
+    def track_payment(self, payment: Dict):
+        self._schedule(PAYMENT, payment['order_id'], payment['expires_at'])
+
+    def track_order(self, order: Order):
+        # 以库存预占的过期时间为准（BEpusdt 订单的支付时限与 UMPay 不同）
+        reservation = self.shop.inventory.get(order.id)
+        if reservation:
+            expires_at = reservation.expires_at
+        else:
+            expires_at = order.created_at.timestamp() + PAYMENT_TIMEOUT * 60
+        self._schedule(ORDER, order.id, expires_at)
+
+    def _expire_recharge(self, record_id: str) -> bool:
+        record = self.member_system.get_recharge_record(record_id)
+        return bool(record) and record.is_expired() and \
+            self.member_system.set_recharge_status(record_id, "expired")
+
+    def _expire_order(self, order_id: str) -> bool:
+        order = self.shop.get_order(order_id)
+        return bool(order) and self.shop.fail_order(order)
+
+    def run_once(self, now: Optional[float] = None) -> int:
+        """处理所有到期的定时器，返回实际过期的记录数"""
+        now = time.time() if now is None else now
+        count = 0
+        for (kind, key), expires_at in self.wheel.advance(now):
+            with self._depth_lock:
+                self._depth[kind] -= 1
+            self.max_lag = max(self.max_lag, now - expires_at)
+            try:
+                if self._handlers[kind](key):
+                    self.fired[kind] += 1
+                    count += 1
+            except Exception as e:
+                logger.error(f"处理过期 {kind}:{key} 失败: {e}")
+        return count
+
+    def metrics(self) -> Dict[str, Any]:
+        """队列深度和触发统计"""
+        with self._depth_lock:
+            depth = dict(self._depth)
+        return {
+            'depth': depth,
+            'total_depth': len(self.wheel),
+            'fired': dict(self.fired),
+            'max_lag': round(self.max_lag, 3),
+        }
+
+    async def run(self, report_interval: float = 60.0):
+        """周期性在线程池中推进时间轮"""
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await run_blocking(SHOP, self.run_once)
+            except Exception as e:
+                logger.error(f"推进时间轮失败: {e}")
+            if time.monotonic() - last_report >= report_interval:
+                last_report = time.monotonic()
+                logger.info(f"到期调度器状态: {self.metrics()}")
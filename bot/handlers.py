@@ -3,14 +3,16 @@ import datetime
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from payments.umpay import UMPay
-from store.shop import Shop
-from store.member import MemberSystem
+from store.state import get_state
+from bot.executor import run_blocking, CHAIN, SHOP
+from store.money import ZERO, Money
 
-# Initialize UMPay and Shop
-umpay = UMPay(network='mainnet')
-member_system = MemberSystem()
-shop = Shop(member_system)
+# Shared shop/member state; UMPay orders live on the shop's instance so the
+# expiry scheduler sees every payment order
+state = get_state()
+member_system = state.member_system
+shop = state.shop
+umpay = shop.umpay
 logger = logging.getLogger(__name__)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -39,7 +41,7 @@ async def pay(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
         
-        amount = float(context.args[0])
+        amount = Money(context.args[0])
         currency = context.args[1].upper()
         
         if currency not in ['USDT', 'TRX']:
@@ -49,7 +51,7 @@ async def pay(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
         
-        if amount <= 0:
+        if amount <= ZERO:
             await update.message.reply_text("❌ 金额必须大于0！")
             return
         
@@ -88,7 +90,8 @@ async def check_payment(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         order_id = context.args[0]
         
         # 检查支付状态
-        result = umpay.check_payment_status(order_id)
+        # 可能触发链上扫描，放到线程池中执行
+        result = await run_blocking(CHAIN, umpay.check_payment_status, order_id)
         
         if 'error' in result:
             await update.message.reply_text(f"❌ {result['error']}")
@@ -156,7 +159,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/shop - 浏览商品\n"
         "/buy <商品ID> <支付方式> - 购买商品\n"
         "/search <关键词> - 搜索商品\n"
-        "/myorders - 我的订单\n\n"
+        "/myorders [状态] - 我的订单\n\n"
         "💎 会员权益：\n"
         "• 青铜会员：基础服务\n"
         "• 白银会员：5%折扣 + 2%充值赠送\n"
@@ -216,17 +219,15 @@ async def shop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         keyboard = []
         
         for i, product in enumerate(products[:10], 1):  # 限制显示前10个商品
-            original_price = float(product.price)
-            
             shop_text += f"{i}. **{product.name}**\n"
             
-            # 显示价格和折扣
-            if discount_info['discount_rate'] > 0 and member:
-                discounted_price = original_price * (1 - discount_info['discount_rate'])
-                shop_text += f"   💰 原价：¥{original_price:.2f}\n"
-                shop_text += f"   🎁 会员价：¥{discounted_price:.2f}\n"
+            # 显示价格和折扣（与下单时的计算相同）
+            discount_amount, member_price = shop.quote(user.id, product)
+            if discount_amount:
+                shop_text += f"   💰 原价：¥{product.price:.2f}\n"
+                shop_text += f"   🎁 会员价：¥{member_price:.2f}\n"
             else:
-                shop_text += f"   💰 价格：¥{original_price:.2f}\n"
+                shop_text += f"   💰 价格：¥{product.price:.2f}\n"
             
             shop_text += f"   📝 {product.description}\n"
             shop_text += f"   📦 库存：{product.stock}\n\n"
@@ -306,7 +307,7 @@ async def buy_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         
         discount_info = shop.get_user_discount_info(user.id)
         
-        result = shop.create_order(user.id, product_id, payment_method)
+        result = await run_blocking(SHOP, shop.create_order, user.id, product_id, payment_method)
         
         if not result:
             if payment_method == 'balance':
@@ -330,8 +331,8 @@ async def buy_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 💰 原价：¥{product.price:.2f}"""
         
         # 显示会员折扣信息
-        if discount_info['discount_rate'] > 0:
-            discount_amount = float(product.price) * discount_info['discount_rate']
+        discount_amount = product.price - order.total_amount
+        if discount_amount:
             order_text += f"\n🎁 {discount_info['level_emoji']} {discount_info['level_name']}折扣：-¥{discount_amount:.2f}"
         
         order_text += f"\n💳 实付金额：¥{order.total_amount:.2f}"
@@ -362,9 +363,10 @@ async def buy_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
                 await update.message.reply_text(f"{order_text}\n❌ 获取支付链接失败", parse_mode='Markdown')
         else:
             # UMPay支付（USDT/TRX）
-            if payment_order.get('status') == 'success':
-                order_text += f"\n💰 支付金额：{payment_order.get('amount', 'N/A')} {payment_method.upper()}"
-                order_text += f"\n📍 收款地址：`{payment_order.get('address', 'N/A')}`"
+            if payment_order.get('status') == 'pending':
+                order_text += f"\n💰 支付金额：{payment_order['amount']} {payment_method.upper()}"
+                order_text += f"\n📍 收款地址：`{payment_order['receiving_address']}`"
+                order_text += "\n⚠️ 请按上述金额精确转账，金额用于识别您的订单"
                 order_text += f"\n⏰ 订单有效期：1小时"
                 
                 keyboard = [
@@ -394,7 +396,7 @@ async def check_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         payment_order_id = context.args[1]
         
         # 检查订单状态
-        result = shop.check_order_payment(order_id, payment_order_id)
+        result = await run_blocking(CHAIN, shop.check_order_payment, order_id, payment_order_id)
         
         if 'error' in result:
             await update.message.reply_text(f"❌ {result['error']}")
@@ -432,6 +434,7 @@ async def check_order(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             order_text += f"✅ **完成时间：** {completed_str}\n"
             order_text += f"🎉 **订单已完成，商品已发货！**\n"
         elif payment_status['status'] == 'pending':
+            order_text += f"💳 **应付金额：** {payment_status['amount']} {payment_status['currency']}\n"
             order_text += f"📍 **收款地址：** `{payment_status['receiving_address']}`\n"
             expires_time = payment_status.get('expires_at', 0)
             expires_str = datetime.datetime.fromtimestamp(expires_time).strftime('%Y-%m-%d %H:%M:%S')
@@ -487,7 +490,19 @@ async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show user's orders."""
     try:
         user_id = str(update.effective_user.id)
-        orders = shop.get_user_orders(user_id)
+        
+        # 可选的状态过滤：/myorders [pending|completed|failed]
+        status = None
+        if context.args:
+            status = context.args[0].lower()
+            if status not in ('pending', 'completed', 'failed'):
+                await update.message.reply_text(
+                    "❌ 用法错误！\n\n"
+                    "正确用法：/myorders [pending|completed|failed]"
+                )
+                return
+        
+        orders, _ = shop.list_user_orders(user_id, limit=10, status=status)
         
         if not orders:
             await update.message.reply_text(
@@ -498,11 +513,12 @@ async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         
         orders_text = "📋 **我的订单**\n\n"
         
-        for order in orders[-10:]:  # 显示最近10个订单
+        for order in orders:  # 显示最近10个订单
             status_emoji = {
                 'PENDING': '⏳',
                 'COMPLETED': '✅',
-                'FAILED': '❌'
+                'FAILED': '❌',
+                'REFUNDED': '↩️'
             }
             
             emoji = status_emoji.get(order.payment_status.name, '❓')
@@ -535,14 +551,14 @@ async def check_bepusdt_order(update: Update, context: ContextTypes.DEFAULT_TYPE
         order_id = context.args[0]
         
         # 检查BEpusdt订单状态
-        result = shop.check_bepusdt_payment(order_id)
+        result = await shop.check_bepusdt_payment_async(order_id)
         
         if 'error' in result:
             await update.message.reply_text(f"❌ {result['error']}")
             return
         
         # 获取本地订单信息
-        order = shop.orders.get(order_id)
+        order = shop.get_order(order_id)
         if not order:
             await update.message.reply_text("❌ 订单不存在！")
             return
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from telegram.ext import Application, CommandHandler
 from bot.handlers import start, pay, check_payment, help_command, shop, buy_product, check_order, search_products, my_orders, check_bepusdt_order
@@ -5,7 +6,15 @@ from bot.member_handlers import (
     register_member, member_info, recharge_menu, custom_recharge,
     recharge_callback_handler, create_recharge_handler, check_recharge_handler
 )
-from config import TELEGRAM_TOKEN
+from bot.executor import STATE, get_executor, run_blocking
+from bot.expiry import ExpiryScheduler
+from bot.updates import ChatOrderedProcessor
+from config import (
+    TELEGRAM_TOKEN, TELEGRAM_API_BASE, BOT_MODE, TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_SECRET,
+    WEBHOOK_HOST, WEBHOOK_PORT, BOT_CONCURRENT_UPDATES, BOT_MAX_UPDATES_PER_CHAT,
+    BOT_UPDATE_QUEUE_SIZE, STATE_SYNC_INTERVAL
+)
+from store.state import get_state
 
 # Configure logging
 logging.basicConfig(
@@ -14,8 +23,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main():
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+async def sync_state(interval: float = STATE_SYNC_INTERVAL) -> None:
+    """定期同步回调服务写入的数据
+
+    同步需要查询变更日志，并可能等待写入线程提交，因此放到线程池中执行，
+    不在事件循环中阻塞更新处理。
+    """
+    state = get_state()
+    while True:
+        try:
+            await run_blocking(STATE, state.sync)
+        except Exception as e:
+            logger.error(f"同步共享状态失败: {e}")
+        await asyncio.sleep(interval)
+
+async def start_background_tasks(application: Application) -> None:
+    """启动共享状态同步、到期调度器和链上支付监听器"""
+    state = get_state()
+    application.create_task(sync_state())
+
+    expiry = ExpiryScheduler(state.member_system, state.shop, state.shop.umpay)
+    expiry.attach()
+    application.bot_data['expiry'] = expiry
+    application.create_task(expiry.run())
+    logger.info(f"到期调度器已启动: {expiry.metrics()}")
+    
+    # 批量扫描区块，匹配所有待支付的 UMPay 订单
+    application.create_task(state.shop.umpay.watcher.run())
+    application.create_task(report_metrics(application))
+
+async def report_metrics(application: Application, interval: float = 60.0) -> None:
+    """定期记录更新队列和阻塞调用线程池的排队、执行统计"""
+    processor = application.update_processor
+    while True:
+        await asyncio.sleep(interval)
+        if isinstance(processor, ChatOrderedProcessor):
+            logger.info(f"更新处理统计: {processor.metrics()}")
+        metrics = get_executor().metrics()
+        if metrics:
+            logger.info(f"阻塞调用统计: {metrics}")
+
+async def close_clients(application: Application) -> None:
+    """关闭异步 HTTP 连接池和阻塞调用线程池"""
+    bepusdt = get_state().shop.bepusdt_async
+    if bepusdt:
+        await bepusdt.aclose()
+    get_executor().shutdown(wait=False)
+
+def build_application(update_queue=None, request=None) -> Application:
+    """构建机器人 Application 并注册处理器
+
+    Args:
+        update_queue: 自定义更新队列（webhook 模式使用有界队列）
+        request: 自定义 Bot API 请求实现（基准测试使用内存中的模拟接口）
+    """
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .base_url(f"{TELEGRAM_API_BASE}/bot")
+        .base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
+        .post_init(start_background_tasks)
+        .post_shutdown(close_clients)
+        # 阻塞调用已放到线程池中；同一会话的更新按顺序处理，不同会话并发处理
+        .concurrent_updates(ChatOrderedProcessor(
+            BOT_CONCURRENT_UPDATES, max_per_chat=BOT_MAX_UPDATES_PER_CHAT))
+    )
+    if update_queue is not None:
+        builder = builder.update_queue(update_queue)
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
 
     start_handler = CommandHandler('start', start)
     pay_handler = CommandHandler('pay', pay)
@@ -44,8 +121,30 @@ def main():
     application.add_handler(recharge_callback_handler)
     application.add_handler(create_recharge_handler)
     application.add_handler(check_recharge_handler)
+    return application
+
+def run_webhook():
+    """webhook 模式：由支付回调服务接收 Telegram 推送"""
+    from bot.webhook import WebhookBridge
+
+    # 未设置 secret token 时在启动回调服务之前失败
+    bridge = WebhookBridge(build_application, TELEGRAM_WEBHOOK_SECRET, queue_size=BOT_UPDATE_QUEUE_SIZE)
 
-    application.run_polling()
+    from webhooks.bepusdt_callback import app
+    from webhooks.telegram_webhook import init_telegram_webhook
+
+    bridge.start(TELEGRAM_WEBHOOK_URL)
+    init_telegram_webhook(app, bridge)
+    try:
+        app.run(host=WEBHOOK_HOST, port=WEBHOOK_PORT, threaded=True)
+    finally:
+        bridge.stop()
+
+def main():
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        build_application().run_polling()
 
 if __name__ == '__main__':
     main()
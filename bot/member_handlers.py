@@ -3,19 +3,22 @@ from datetime import datetime
 from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CallbackQueryHandler
-from store.member import MemberSystem, User, RechargeRecord
-from payments.umpay import UMPay
-from payments.bepusdt import BEpusdt
+from store.member import User, RechargeRecord
+from store.money import ZERO, Money
+from store.state import get_state
+from config import BEPUSDT_NOTIFY_URL
 import logging
 
 logger = logging.getLogger(__name__)
 
-# 全局会员系统实例
-member_system = MemberSystem()
+# 全局会员系统实例（与商城共享）
+member_system = get_state().member_system
 
-# 支付系统实例
-umpay = UMPay()
-bepusdt = BEpusdt()
+# 支付系统实例（与商城共享同一个 UMPay，便于统一处理订单过期）
+umpay = get_state().shop.umpay
+bepusdt = get_state().shop.bepusdt_async  # 异步客户端，未配置时为None
+
+MIN_RECHARGE = Money(50)  # 最低充值金额
 
 async def register_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """注册会员"""
@@ -214,7 +217,7 @@ async def handle_recharge_callback(update: Update, context: ContextTypes.DEFAULT
             return
         
         try:
-            amount = float(amount_str)
+            amount = Money(amount_str)
             await process_recharge(query, user.id, amount)
         except ValueError:
             await query.edit_message_text("❌ 无效的充值金额")
@@ -227,19 +230,18 @@ async def handle_recharge_callback(update: Update, context: ContextTypes.DEFAULT
             payment_method = parts[2]
             await process_payment(query, record_id, payment_method)
 
-async def process_recharge(query, user_id: int, amount: float):
+async def process_recharge(query, user_id: int, amount: Money):
     """处理充值请求"""
-    if amount < 50:
+    if amount < MIN_RECHARGE:
         await query.edit_message_text("❌ 最低充值金额为50元")
         return
     
-    # 获取适用活动
-    applicable_activities = member_system.get_user_applicable_activities(user_id, amount)
+    # 预览创建订单时将选用的活动（按名额和奖励选择）
+    best_activity = member_system.get_best_activity(user_id, amount)
     
     activity_info = ""
-    if applicable_activities:
-        best_activity = applicable_activities[0]
-        bonus = best_activity.calculate_bonus(amount)
+    if best_activity:
+        bonus = best_activity.bonus_for(amount)
         activity_info = f"\n🎁 活动奖励：+¥{bonus:.2f}\n💰 实际到账：¥{amount + bonus:.2f}"
     
     recharge_text = f"""💰 充值确认
@@ -279,7 +281,7 @@ async def handle_create_recharge(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     try:
-        amount = float(parts[0])
+        amount = Money(parts[0])
         payment_method = parts[1]
     except ValueError:
         await query.edit_message_text("❌ 无效的充值参数")
@@ -351,16 +353,21 @@ async def create_umpay_order(query, record: RechargeRecord, payment_method: str)
 async def create_bepusdt_order(query, record: RechargeRecord):
     """创建BEpusdt支付订单"""
     try:
-        # 创建支付订单
-        order_data = {
-            "order_id": record.id,
-            "amount": record.amount,
-            "notify_url": "https://your-domain.com/webhook/bepusdt"
-        }
+        if not bepusdt:
+            await query.edit_message_text("❌ BEpusdt支付未配置")
+            return
         
-        payment_info = bepusdt.create_order(order_data)
+        # 创建支付订单（异步请求网关，不阻塞其他会话）
+        result = await bepusdt.create_order(
+            order_id=record.id,
+            amount=record.amount,
+            notify_url=BEPUSDT_NOTIFY_URL,
+            timeout=3600
+        )
+        payment_info = result.get('data') or {}
         
-        if payment_info and payment_info.get("status") == "success":
+        if result.get('success'):
+            pay_url = payment_info.get('payment_url') or payment_info.get('pay_url', '')
             payment_text = f"""💰 充值订单已创建
 
 📋 订单信息：
@@ -371,13 +378,13 @@ async def create_bepusdt_order(query, record: RechargeRecord):
 • 支付方式：BEpusdt
 
 💳 支付信息：
-• 支付链接：{payment_info.get('pay_url', '')}
+• 支付链接：{pay_url}
 • 订单有效期：1小时
 
 ⚠️ 请在1小时内完成支付，逾期订单将自动取消"""
             
             keyboard = [
-                [InlineKeyboardButton("💳 去支付", url=payment_info.get('pay_url', ''))],
+                [InlineKeyboardButton("💳 去支付", url=pay_url)],
                 [InlineKeyboardButton("🔍 查询订单状态", callback_data=f"check_recharge_{record.id}")],
                 [InlineKeyboardButton("❌ 取消订单", callback_data=f"cancel_recharge_{record.id}")]
             ]
@@ -405,14 +412,14 @@ async def check_recharge_status(update: Update, context: ContextTypes.DEFAULT_TY
         return
     
     record_id = data.replace("check_recharge_", "")
-    record = member_system.recharge_records.get(record_id)
+    record = member_system.get_recharge_record(record_id)
     
     if not record:
         await query.edit_message_text("❌ 订单不存在")
         return
     
     if record.is_expired():
-        record.status = "expired"
+        member_system.set_recharge_status(record_id, "expired")
         await query.edit_message_text("❌ 订单已过期")
         return
     
@@ -465,7 +472,7 @@ async def show_transaction_history(update: Update, context: ContextTypes.DEFAULT
     else:
         history_text = "📊 最近交易记录\n\n"
         for t in transactions:
-            amount_str = f"+¥{t.amount:.2f}" if t.amount > 0 else f"-¥{abs(t.amount):.2f}"
+            amount_str = f"+¥{t.amount:.2f}" if t.amount > ZERO else f"-¥{abs(t.amount):.2f}"
             history_text += f"• {t.created_at.strftime('%m-%d %H:%M')} {amount_str} ({t.description})\n"
     
     keyboard = [[InlineKeyboardButton("⬅️ 返回", callback_data="member_info")]]
@@ -560,18 +567,17 @@ async def custom_recharge(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        amount = float(context.args[0])
-        if amount < 50:
+        amount = Money(context.args[0])
+        if amount < MIN_RECHARGE:
             await update.message.reply_text("❌ 最低充值金额为50元")
             return
         
-        # 获取适用活动
-        applicable_activities = member_system.get_user_applicable_activities(user.id, amount)
+        # 预览创建订单时将选用的活动（按名额和奖励选择）
+        best_activity = member_system.get_best_activity(user.id, amount)
         
         activity_info = ""
-        if applicable_activities:
-            best_activity = applicable_activities[0]
-            bonus = best_activity.calculate_bonus(amount)
+        if best_activity:
+            bonus = best_activity.bonus_for(amount)
             activity_info = f"\n🎁 活动奖励：+¥{bonus:.2f}\n💰 实际到账：¥{amount + bonus:.2f}"
         
         recharge_text = f"""💰 充值确认
@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, Hashable, Optional, Set
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """更新的串行化键：同一会话（没有会话时同一用户）的更新按顺序处理"""
+    if not isinstance(update, Update):
+        return None
+    chat = update.effective_chat
+    if chat is not None:
+        return chat.id
+    user = update.effective_user
+    if user is not None:
+        return ('user', user.id)
+    return None
+
+
+# 只查询状态、不修改数据的按钮：同一会话已有相同请求在排队时合并为一次
+REFRESH_PREFIXES = ('check_recharge_', 'check_order_')
+
+
+def refresh_data(update: object) -> Optional[str]:
+    """"刷新状态"按钮的回调数据，其他更新返回None"""
+    if not isinstance(update, Update) or update.callback_query is None:
+        return None
+    data = update.callback_query.data
+    if isinstance(data, str) and data.startswith(REFRESH_PREFIXES):
+        return data
+    return None
+
+
+class _ChatQueue:
+    """单个会话的等待队列"""
+
+    __slots__ = ('lock', 'size', 'refreshes')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.size = 0                   # 排队 + 处理中的更新数
+        self.refreshes: Set[str] = set()  # 正在排队（尚未开始处理）的刷新请求
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """会话内有序、会话间并发的更新处理器
+
+    Application 为每个更新创建一个任务。同一会话的更新依次获取该会话的锁
+    （asyncio.Lock 按先来先到唤醒），保证处理顺序与接收顺序一致；
+    不同会话的更新并发处理，同时运行的处理器数量不超过 max_concurrent_updates。
+
+    每个会话最多排队 max_per_chat 个更新，超出时丢弃新更新；
+    同一会话重复点击的"刷新状态"按钮在前一次尚未开始处理时直接合并。
+    被丢弃或合并的按钮点击会应答回调，结束客户端的加载状态。
+    """
+
+    def __init__(self, max_concurrent_updates: int = 64, max_pending: int = 1024,
+                 max_per_chat: int = 8):
+        """
+        Args:
+            max_concurrent_updates: 同时运行的处理器数量上限
+            max_pending: 已开始处理（含等待会话锁）的更新数量上限
+            max_per_chat: 单个会话排队 + 处理中的更新数量上限
+        """
+        # 基类的信号量限制已接收的更新数，等待会话锁的更新不占用运行名额
+        super().__init__(max(max_pending, max_concurrent_updates))
+        self.max_running = max_concurrent_updates
+        self.max_per_chat = max_per_chat
+        self._running: Optional[asyncio.Semaphore] = None
+        self._chains: Dict[Hashable, _ChatQueue] = {}
+
+        self.processed = 0
+        self.dropped = 0            # 会话队列已满而丢弃
+        self.coalesced = 0          # 与排队中的相同刷新请求合并
+        self.max_depth = 0          # 单个会话出现过的最大队列长度
+        self.wait_time = 0.0        # 累计等待时间（接收到开始处理）
+        self.max_wait_time = 0.0
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self.max_running)
+
+    async def shutdown(self) -> None:
+        self._chains.clear()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self._running is None:
+            await self.initialize()
+
+        key = update_key(update)
+        if key is None:
+            await self._run(coroutine, time.perf_counter())
+            return
+
+        chat = self._chains.get(key)
+        if chat is None:
+            chat = self._chains[key] = _ChatQueue()
+
+        refresh = refresh_data(update)
+        if refresh is not None and refresh in chat.refreshes:
+            self.coalesced += 1
+            await self._discard(update, coroutine, None)
+            return
+        if chat.size >= self.max_per_chat:
+            self.dropped += 1
+            await self._discard(update, coroutine, "⏳ 操作太频繁，请稍候再试")
+            return
+
+        received = time.perf_counter()
+        chat.size += 1
+        self.max_depth = max(self.max_depth, chat.size)
+        if refresh is not None:
+            chat.refreshes.add(refresh)
+        try:
+            async with chat.lock:
+                if refresh is not None:
+                    chat.refreshes.discard(refresh)
+                await self._run(coroutine, received)
+        finally:
+            chat.size -= 1
+            if refresh is not None:
+                chat.refreshes.discard(refresh)
+            if not chat.size:
+                del self._chains[key]
+
+    async def _run(self, coroutine: Awaitable[Any], received: float) -> None:
+        async with self._running:
+            waited = time.perf_counter() - received
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            self.processed += 1
+            await coroutine
+
+    @staticmethod
+    async def _discard(update: object, coroutine: Awaitable[Any], text: Optional[str]) -> None:
+        """丢弃更新：关闭未执行的处理协程，并应答按钮点击"""
+        coroutine.close()
+        query = update.callback_query if isinstance(update, Update) else None
+        if query is None:
+            return
+        try:
+            await query.answer(text)
+        except Exception as e:
+            logger.debug(f"应答被丢弃的回调失败: {e}")
+
+    def active_chats(self) -> int:
+        """有更新正在处理或等待处理的会话数"""
+        return len(self._chains)
+
+    def metrics(self) -> Dict[str, Any]:
+        """队列深度、等待时间及丢弃/合并统计"""
+        depths = [chat.size for chat in self._chains.values()]
+        done = max(self.processed, 1)
+        return {
+            'processed': self.processed,
+            'active_chats': len(depths),
+            'queued': sum(depths),
+            'deepest_chat': max(depths, default=0),
+            'max_depth': self.max_depth,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'avg_wait_ms': round(self.wait_time / done * 1000, 2),
+            'max_wait_ms': round(self.max_wait_time * 1000, 2),
+        }
+
+
+class BoundedUpdateQueue(asyncio.Queue):
+    """按未处理完的更新数限流的更新队列
+
+    Application 取出更新后立即创建处理任务，队列本身几乎不会堆积，
+    因此按"已放入但尚未 task_done"的数量（排队 + 处理中）判断是否已满。
+    """
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        self.outstanding = 0
+        self.rejected = 0
+
+    def offer(self, update: object) -> bool:
+        """放入更新，未处理完的更新已达上限时返回False"""
+        if self.outstanding >= self.limit:
+            self.rejected += 1
+            return False
+        self.outstanding += 1
+        self.put_nowait(update)
+        return True
+
+    def task_done(self) -> None:
+        super().task_done()
+        if self.outstanding:
+            self.outstanding -= 1
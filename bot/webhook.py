@@ -0,0 +1,159 @@
+import asyncio
+import hmac
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from bot.updates import BoundedUpdateQueue
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookBridge:
+    """Telegram webhook 接入
+
+    机器人 Application 在独立线程的事件循环中运行；Flask 回调服务收到
+    Telegram 推送后校验 secret token，把更新交给 submit 放入有界队列后
+    立即返回，不等待处理完成。队列已满时拒绝更新，Telegram 会稍后重试。
+    secret token 必须设置，否则任何知道地址的人都能伪造更新。
+    """
+
+    def __init__(self, build: Callable[[BoundedUpdateQueue], Application],
+                 secret_token: str, queue_size: int = 1000,
+                 submit_timeout: float = 5.0):
+        """
+        Args:
+            build: 根据更新队列构建 Application 的函数（在机器人线程中调用）
+            secret_token: 与 setWebhook 一致的 secret token（不能为空）
+            queue_size: 未处理完的更新数上限
+            submit_timeout: 等待机器人线程接收更新的最长时间（秒）
+        """
+        if not secret_token:
+            raise ValueError("webhook 模式必须设置 TELEGRAM_WEBHOOK_SECRET")
+        self.build = build
+        self.secret_token = secret_token
+        self._secret = secret_token.encode()
+        self.queue_size = queue_size
+        self.submit_timeout = submit_timeout
+
+        self.application: Optional[Application] = None
+        self.update_queue: Optional[BoundedUpdateQueue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+
+        self.accepted = 0
+        self.invalid = 0
+
+    def check_secret(self, token: Optional[str]) -> bool:
+        """校验 X-Telegram-Bot-Api-Secret-Token 请求头（缺少请求头时同样按常数时间比较）"""
+        if not hmac.compare_digest((token or '').encode(), self._secret):
+            self.invalid += 1
+            return False
+        return True
+
+    def start(self, webhook_url: Optional[str] = None, timeout: float = 30.0):
+        """启动机器人线程，并在提供 webhook_url 时向 Telegram 注册 webhook"""
+        self._thread = threading.Thread(target=self._run, args=(webhook_url,),
+                                        name="telegram-bot", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError("机器人启动超时")
+        if self._error:
+            raise RuntimeError(f"机器人启动失败: {self._error}")
+
+    def _run(self, webhook_url: Optional[str]):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._startup(webhook_url))
+        except BaseException as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            # 取消停止后仍未结束的任务（如超时未完成的处理器）
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.close()
+
+    async def _startup(self, webhook_url: Optional[str]):
+        self.update_queue = BoundedUpdateQueue(self.queue_size)
+        self.application = self.build(self.update_queue)
+        await self.application.initialize()
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+        if webhook_url:
+            await self.application.bot.set_webhook(
+                url=webhook_url,
+                secret_token=self.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Telegram webhook 已设置: {webhook_url}")
+        await self.application.start()
+
+    def submit(self, data: Dict) -> bool:
+        """接收 Telegram 推送的更新（在 Flask 线程中调用）
+
+        Returns:
+            是否已放入队列（队列已满或机器人未运行时返回False）
+        """
+        if not self._ready.is_set() or self._loop is None or self._error:
+            return False
+        future = asyncio.run_coroutine_threadsafe(self._offer(data), self._loop)
+        try:
+            accepted = future.result(self.submit_timeout)
+        except Exception as e:
+            logger.error(f"提交更新失败: {e}")
+            return False
+        if accepted:
+            self.accepted += 1
+        return accepted
+
+    async def _offer(self, data: Dict) -> bool:
+        update = Update.de_json(data, self.application.bot)
+        return self.update_queue.offer(update)
+
+    def metrics(self) -> Dict:
+        queue = self.update_queue
+        return {
+            'accepted': self.accepted,
+            'invalid_secret': self.invalid,
+            'rejected': queue.rejected if queue else 0,
+            'outstanding': queue.outstanding if queue else 0,
+        }
+
+    def stop(self, timeout: float = 30.0):
+        """停止机器人并等待正在处理的更新完成（最多 timeout 秒）"""
+        if self._loop is None or not self._loop.is_running():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(timeout), self._loop)
+        try:
+            future.result(timeout * 2)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if self._thread:
+                self._thread.join(timeout)
+
+    async def _shutdown(self, drain_timeout: float):
+        # 先让已接收的更新处理完，再停止 Application
+        try:
+            await asyncio.wait_for(self.update_queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"仍有 {self.update_queue.outstanding} 个更新未处理完，强制停止")
+        await self.application.stop()
+        if self.application.post_stop:
+            await self.application.post_stop(self.application)
+        await self.application.shutdown()
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
@@ -5,6 +5,20 @@ load_dotenv()
 
 # Telegram 配置
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org')  # 可指向本地模拟服务器
+
+# 机器人运行模式：polling（长轮询）或 webhook（由回调服务接收推送）
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')        # 公网地址，如 https://example.com/webhook/telegram
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')  # setWebhook 的 secret_token
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '5000'))
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '64'))  # 同时处理的更新数
+BOT_MAX_UPDATES_PER_CHAT = int(os.getenv('BOT_MAX_UPDATES_PER_CHAT', '8'))  # 单个会话排队的更新数上限
+BOT_UPDATE_QUEUE_SIZE = int(os.getenv('BOT_UPDATE_QUEUE_SIZE', '1000'))  # webhook 未处理完的更新数上限
+
+# 支付回调结算线程数
+SETTLEMENT_WORKERS = int(os.getenv('SETTLEMENT_WORKERS', '4'))
 
 # BEpusdt 配置
 BEPUSDT_API_URL = os.getenv('BEPUSDT_API_URL')
@@ -12,6 +26,9 @@ BEPUSDT_APP_ID = os.getenv('BEPUSDT_APP_ID')
 BEPUSDT_APP_SECRET = os.getenv('BEPUSDT_APP_SECRET')
 BEPUSDT_NOTIFY_URL = os.getenv('BEPUSDT_NOTIFY_URL')
 
+# UMPay 配置
+UMPAY_SECRET_KEY = os.getenv('UMPAY_SECRET')  # 回调签名密钥
+
 # Blockchain Network Configuration
 NETWORK_PROVIDER = os.getenv('NETWORK_PROVIDER', 'https://api.trongrid.io')
 
@@ -27,4 +44,5 @@ PAYMENT_TIMEOUT = 30  # minutes
 CONFIRMATION_BLOCKS = 12  # number of blocks to wait for confirmation
 
 # Database Configuration (if needed)
-DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///store.db')
\ No newline at end of file
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///store.db')
+STATE_SYNC_INTERVAL = float(os.getenv('STATE_SYNC_INTERVAL', '1.0'))  # 机器人同步回调服务写入的间隔（秒）
\ No newline at end of file
@@ -0,0 +1,106 @@
+# Unique payment amount allocator
+import threading
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from tronpy.keys import to_hex_address
+
+# TRX 和 USDT(TRC20) 都是 6 位小数
+DECIMALS = 6
+UNIT = 10 ** DECIMALS
+
+AmountKey = Tuple[str, str, int]  # (十六进制收款地址, 币种, 最小单位金额)
+
+
+def to_units(amount) -> int:
+    """金额转换为最小单位（sun / USDT 的 10^-6）"""
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int((amount * UNIT).to_integral_value())
+
+
+class AmountAllocator:
+    """唯一金额分配器
+
+    多个订单共用一个收款地址时，链上只能通过金额区分订单。分配器在订单
+    金额上加一个微小的偏移量（step 的整数倍），保证同一地址、同一币种上
+    所有未结算订单的应付金额互不相同；金额到订单的查找表是普通字典，
+    查找和释放都是 O(1)。订单支付或过期后释放金额，供后续订单复用。
+
+    收款地址统一保存为十六进制（与链上转账中的地址格式相同），支付监听器
+    直接用转账的地址和金额查找订单。每个基础金额的轮转位置只在该金额还有
+    未释放的订单时保留，金额种类再多也不会无限增长。
+    """
+
+    def __init__(self, step: Decimal = Decimal('0.0001'), max_offsets: int = 1000):
+        """
+        Args:
+            step: 偏移量步长
+            max_offsets: 每个基础金额最多可用的偏移量个数（含 0）
+        """
+        self.step_units = to_units(step)
+        self.max_offsets = max_offsets
+        self._orders: Dict[AmountKey, str] = {}     # 应付金额 -> 订单ID
+        self._keys: Dict[str, Tuple[AmountKey, AmountKey]] = {}  # 订单ID -> (应付金额, 基础金额)
+        self._next: Dict[AmountKey, int] = {}       # 基础金额 -> 下一个尝试的偏移量
+        self._live: Dict[AmountKey, int] = {}       # 基础金额 -> 未释放的订单数
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def allocate(self, order_id: str, address: str, currency: str, amount) -> Optional[Decimal]:
+        """为订单分配唯一的应付金额
+
+        Args:
+            order_id: 订单ID
+            address: 收款地址
+            currency: 币种
+            amount: 订单原始金额
+
+        Returns:
+            应付金额；该金额附近的偏移量全部被占用时返回None
+        """
+        address = to_hex_address(address).lower()
+        base = (address, currency, to_units(amount))
+        with self._lock:
+            if order_id in self._keys:
+                return Decimal(self._keys[order_id][0][2]) / UNIT
+
+            # 从上次分配的位置继续轮转，空闲偏移量通常一次命中
+            start = self._next.get(base, 0)
+            for i in range(self.max_offsets):
+                offset = (start + i) % self.max_offsets
+                key = (address, currency, base[2] + offset * self.step_units)
+                if key not in self._orders:
+                    self._orders[key] = order_id
+                    self._keys[order_id] = (key, base)
+                    self._next[base] = (offset + 1) % self.max_offsets
+                    self._live[base] = self._live.get(base, 0) + 1
+                    return Decimal(key[2]) / UNIT
+            return None
+
+    def release(self, order_id: str) -> bool:
+        """释放订单占用的金额（已支付、过期或取消）"""
+        with self._lock:
+            keys = self._keys.pop(order_id, None)
+            if keys is None:
+                return False
+            key, base = keys
+            del self._orders[key]
+            # 基础金额没有未释放的订单时丢弃轮转位置，下次从偏移量 0 开始
+            live = self._live[base] - 1
+            if live:
+                self._live[base] = live
+            else:
+                del self._live[base]
+                del self._next[base]
+            return True
+
+    def lookup(self, address: str, currency: str, amount) -> Optional[str]:
+        """根据收款地址（Base58 或十六进制）和实付金额查找订单"""
+        return self._orders.get((to_hex_address(address).lower(), currency, to_units(amount)))
+
+    def bases(self) -> int:
+        """保留轮转位置的基础金额数"""
+        return len(self._next)
@@ -1,199 +1,146 @@
+import asyncio
 import hashlib
 import hmac
 import json
+import random
 import time
 import uuid
 from typing import Dict, Optional, Any
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 import logging
+from payments.rates import RateCache
+from store.money import MoneyLike
 
 logger = logging.getLogger(__name__)
 
-class BEpusdt:
-    """BEpusdt 支付系统集成类"""
-    
-    def __init__(self, api_url: str, app_id: str, app_secret: str):
+# 请求超时（秒）：连接超时, 读取超时
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 15.0
+
+# 重试：最多重试次数和退避基数（秒），实际等待时间在 [0, 基数 * 2^n] 内随机
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.2
+
+# 网关返回这些状态码时可以重试
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def _backoff(attempt: int) -> float:
+    """带抖动的指数退避时间"""
+    return random.uniform(0, BACKOFF_BASE * (2 ** attempt))
+
+
+class BEpusdtBase:
+    """BEpusdt 签名、参数构造和响应解析（同步/异步客户端共用）"""
+
+    def __init__(self, api_url: str, app_id: str, app_secret: str,
+                 rate_cache: Optional[RateCache] = None):
         """
         初始化 BEpusdt 支付系统
-        
+
         Args:
             api_url: BEpusdt API 基础URL
             app_id: 应用ID
             app_secret: 应用密钥
+            rate_cache: 汇率缓存（可在多个客户端之间共享）
         """
         self.api_url = api_url.rstrip('/')
         self.app_id = app_id
         self.app_secret = app_secret
-        self.session = requests.Session()
-        self.session.timeout = 30
-        
+        self.rates = rate_cache or RateCache()
+
     def _generate_signature(self, params: Dict[str, Any]) -> str:
         """
         生成签名
-        
+
         Args:
             params: 参数字典
-            
+
         Returns:
             签名字符串
         """
         # 按键名排序
         sorted_params = sorted(params.items())
-        
+
         # 构建签名字符串
         sign_str = '&'.join([f"{k}={v}" for k, v in sorted_params if v is not None and v != ''])
         sign_str += f"&key={self.app_secret}"
-        
+
         # 生成MD5签名
         signature = hashlib.md5(sign_str.encode('utf-8')).hexdigest().upper()
-        
+
         logger.debug(f"签名字符串: {sign_str}")
         logger.debug(f"生成签名: {signature}")
-        
+
         return signature
-    
-    def create_order(self, order_id: str, amount: float, trade_type: str = "usdt.trc20", 
-                    notify_url: str = None, redirect_url: str = None, 
-                    timeout: int = 1800, address: str = None) -> Dict[str, Any]:
-        """
-        创建支付订单
-        
-        Args:
-            order_id: 商户订单号
-            amount: 支付金额（CNY）
-            trade_type: 支付类型 (usdt.trc20, tron.trx, usdt.polygon等)
-            notify_url: 回调通知地址
-            redirect_url: 支付成功跳转地址
-            timeout: 超时时间（秒）
-            address: 收款地址（可选）
-            
-        Returns:
-            创建订单的响应结果
-        """
-        try:
-            # 构建请求参数
-            params = {
-                'app_id': self.app_id,
-                'order_id': order_id,
-                'amount': amount,
-                'trade_type': trade_type,
-                'timeout': timeout
-            }
-            
-            # 添加可选参数
-            if notify_url:
-                params['notify_url'] = notify_url
-            if redirect_url:
-                params['redirect_url'] = redirect_url
-            if address:
-                params['address'] = address
-                
-            # 生成签名
-            params['signature'] = self._generate_signature(params)
-            
-            # 发送请求
-            url = f"{self.api_url}/api/order/create-order"
-            response = self.session.post(url, json=params)
-            
-            logger.info(f"创建订单请求: {url}")
-            logger.debug(f"请求参数: {params}")
-            logger.info(f"响应状态: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"创建订单成功: {result}")
-                return {
-                    'success': True,
-                    'data': result
-                }
-            else:
-                logger.error(f"创建订单失败: HTTP {response.status_code}")
-                return {
-                    'success': False,
-                    'error': f"HTTP错误: {response.status_code}",
-                    'message': response.text
-                }
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"创建订单网络错误: {e}")
-            return {
-                'success': False,
-                'error': '网络请求失败',
-                'message': str(e)
-            }
-        except Exception as e:
-            logger.error(f"创建订单异常: {e}")
-            return {
-                'success': False,
-                'error': '系统异常',
-                'message': str(e)
-            }
-    
-    def query_order(self, order_id: str) -> Dict[str, Any]:
-        """
-        查询订单状态
-        
-        Args:
-            order_id: 商户订单号
-            
-        Returns:
-            订单查询结果
-        """
-        try:
-            # 构建请求参数
-            params = {
-                'app_id': self.app_id,
-                'order_id': order_id
-            }
-            
-            # 生成签名
-            params['signature'] = self._generate_signature(params)
-            
-            # 发送请求
-            url = f"{self.api_url}/api/order/query-order"
-            response = self.session.post(url, json=params)
-            
-            logger.info(f"查询订单请求: {url}")
-            logger.debug(f"请求参数: {params}")
-            logger.info(f"响应状态: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"查询订单成功: {result}")
-                return {
-                    'success': True,
-                    'data': result
-                }
-            else:
-                logger.error(f"查询订单失败: HTTP {response.status_code}")
-                return {
-                    'success': False,
-                    'error': f"HTTP错误: {response.status_code}",
-                    'message': response.text
-                }
-                
-        except requests.exceptions.RequestException as e:
-            logger.error(f"查询订单网络错误: {e}")
-            return {
-                'success': False,
-                'error': '网络请求失败',
-                'message': str(e)
-            }
-        except Exception as e:
-            logger.error(f"查询订单异常: {e}")
+
+    def _signed(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """添加应用ID和签名"""
+        params = {'app_id': self.app_id, **params}
+        params['signature'] = self._generate_signature(params)
+        return params
+
+    def _order_params(self, order_id: str, amount: MoneyLike, trade_type: str,
+                      notify_url: Optional[str], redirect_url: Optional[str],
+                      timeout: int, address: Optional[str]) -> Dict[str, Any]:
+        """构建创建订单的请求参数"""
+        params = {
+            'order_id': order_id,
+            'amount': float(amount),  # 以元为单位的数字（Money 转换后与原来的浮点金额相同）
+            'trade_type': trade_type,
+            'timeout': timeout
+        }
+
+        # 添加可选参数
+        if notify_url:
+            params['notify_url'] = notify_url
+        if redirect_url:
+            params['redirect_url'] = redirect_url
+        if address:
+            params['address'] = address
+
+        return self._signed(params)
+
+    @staticmethod
+    def _result(action: str, status_code: int, body: Any, text: str) -> Dict[str, Any]:
+        """将HTTP响应转换为统一的结果字典"""
+        if status_code == 200:
+            logger.info(f"{action}成功: {body}")
             return {
-                'success': False,
-                'error': '系统异常',
-                'message': str(e)
+                'success': True,
+                'data': body
             }
-    
+        logger.error(f"{action}失败: HTTP {status_code}")
+        return {
+            'success': False,
+            'error': f"HTTP错误: {status_code}",
+            'message': text
+        }
+
+    @staticmethod
+    def _error(action: str, error: str, e: Exception) -> Dict[str, Any]:
+        logger.error(f"{action}{error}: {e}")
+        return {
+            'success': False,
+            'error': error,
+            'message': str(e)
+        }
+
+    @staticmethod
+    def _rate(status_code: int, body: Any) -> Optional[float]:
+        if status_code == 200 and body.get('success'):
+            return body.get('data', {}).get('rate')
+        return None
+
     def verify_callback(self, callback_data: Dict[str, Any]) -> bool:
         """
         验证回调签名
-        
+
         Args:
             callback_data: 回调数据
-            
+
         Returns:
             签名验证结果
         """
@@ -203,31 +150,31 @@ class BEpusdt:
             if not received_signature:
                 logger.error("回调数据中缺少签名")
                 return False
-            
+
             # 移除签名字段
             params = {k: v for k, v in callback_data.items() if k != 'signature'}
-            
+
             # 生成预期签名
             expected_signature = self._generate_signature(params)
-            
-            # 验证签名
-            is_valid = received_signature.upper() == expected_signature.upper()
-            
+
+            # 验证签名（常量时间比较）
+            is_valid = hmac.compare_digest(received_signature.upper(), expected_signature.upper())
+
             if is_valid:
                 logger.info("回调签名验证成功")
             else:
                 logger.error(f"回调签名验证失败: 接收到 {received_signature}, 期望 {expected_signature}")
-            
+
             return is_valid
-            
+
         except Exception as e:
             logger.error(f"验证回调签名异常: {e}")
             return False
-    
+
     def get_supported_currencies(self) -> list:
         """
         获取支持的币种列表
-        
+
         Returns:
             支持的币种列表
         """
@@ -241,52 +188,139 @@ class BEpusdt:
             'usdc.polygon', # USDC (Polygon)
             'usdc.erc20'   # USDC (ERC20)
         ]
-    
+
+
+class BEpusdt(BEpusdtBase):
+    """BEpusdt 支付系统集成类（同步客户端，供 Flask 回调服务等同步代码使用）"""
+
+    def __init__(self, api_url: str, app_id: str, app_secret: str, pool_size: int = 10,
+                 rate_cache: Optional[RateCache] = None):
+        """
+        初始化 BEpusdt 支付系统
+
+        Args:
+            api_url: BEpusdt API 基础URL
+            app_id: 应用ID
+            app_secret: 应用密钥
+            pool_size: 连接池大小
+            rate_cache: 汇率缓存（可在多个客户端之间共享）
+        """
+        super().__init__(api_url, app_id, app_secret, rate_cache)
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _post(self, path: str, params: Dict[str, Any], idempotent: bool = True) -> requests.Response:
+        """
+        发送请求，网络错误和网关临时错误时带抖动退避重试
+
+        Args:
+            path: 接口路径
+            params: 请求参数
+            idempotent: 是否可以安全重试；否则只在连接未建立时重试
+        """
+        url = f"{self.api_url}{path}"
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                response = self.session.post(url, json=params, timeout=self.timeout)
+                if not idempotent or response.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                    return response
+                logger.warning(f"请求 {path} 返回 HTTP {response.status_code}，准备重试")
+            except requests.exceptions.RequestException as e:
+                # 非幂等请求只在连接超时（请求尚未发出）时重试
+                retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if not retryable or attempt == MAX_RETRIES:
+                    raise
+                logger.warning(f"请求 {path} 失败: {e}，准备重试")
+            time.sleep(_backoff(attempt))
+
+    def create_order(self, order_id: str, amount: MoneyLike, trade_type: str = "usdt.trc20",
+                    notify_url: str = None, redirect_url: str = None,
+                    timeout: int = 1800, address: str = None) -> Dict[str, Any]:
+        """
+        创建支付订单
+
+        Args:
+            order_id: 商户订单号
+            amount: 支付金额（CNY，Money 或数字）
+            trade_type: 支付类型 (usdt.trc20, tron.trx, usdt.polygon等)
+            notify_url: 回调通知地址
+            redirect_url: 支付成功跳转地址
+            timeout: 超时时间（秒）
+            address: 收款地址（可选）
+
+        Returns:
+            创建订单的响应结果
+        """
+        try:
+            params = self._order_params(order_id, amount, trade_type, notify_url,
+                                        redirect_url, timeout, address)
+            response = self._post('/api/order/create-order', params, idempotent=False)
+            logger.debug(f"请求参数: {params}")
+            logger.info(f"创建订单响应状态: {response.status_code}")
+            body = response.json() if response.status_code == 200 else None
+            return self._result('创建订单', response.status_code, body, response.text)
+        except requests.exceptions.RequestException as e:
+            return self._error('创建订单', '网络请求失败', e)
+        except Exception as e:
+            return self._error('创建订单', '系统异常', e)
+
+    def query_order(self, order_id: str) -> Dict[str, Any]:
+        """
+        查询订单状态
+
+        Args:
+            order_id: 商户订单号
+
+        Returns:
+            订单查询结果
+        """
+        try:
+            params = self._signed({'order_id': order_id})
+            response = self._post('/api/order/query-order', params)
+            logger.info(f"查询订单响应状态: {response.status_code}")
+            body = response.json() if response.status_code == 200 else None
+            return self._result('查询订单', response.status_code, body, response.text)
+        except requests.exceptions.RequestException as e:
+            return self._error('查询订单', '网络请求失败', e)
+        except Exception as e:
+            return self._error('查询订单', '系统异常', e)
+
     def get_exchange_rate(self, from_currency: str = 'CNY', to_currency: str = 'USDT') -> Optional[float]:
         """
         获取汇率（如果BEpusdt支持）
-        
+
         Args:
             from_currency: 源币种
             to_currency: 目标币种
-            
+
         Returns:
-            汇率或None
+            汇率或None（网关不可用时返回最后已知汇率）
         """
+        return self.rates.get((from_currency, to_currency),
+                              lambda: self._fetch_exchange_rate(from_currency, to_currency))
+
+    def _fetch_exchange_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """请求网关获取汇率"""
         try:
-            # 构建请求参数
-            params = {
-                'app_id': self.app_id,
-                'from': from_currency,
-                'to': to_currency
-            }
-            
-            # 生成签名
-            params['signature'] = self._generate_signature(params)
-            
-            # 发送请求
-            url = f"{self.api_url}/api/exchange/rate"
-            response = self.session.post(url, json=params)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('success'):
-                    return result.get('data', {}).get('rate')
-            
-            return None
-            
+            params = self._signed({'from': from_currency, 'to': to_currency})
+            response = self._post('/api/exchange/rate', params)
+            body = response.json() if response.status_code == 200 else None
+            return self._rate(response.status_code, body)
         except Exception as e:
             logger.error(f"获取汇率异常: {e}")
             return None
-    
-    def format_amount_for_display(self, cny_amount: float, currency: str) -> str:
+
+    def format_amount_for_display(self, cny_amount: MoneyLike, currency: str) -> str:
         """
         格式化显示金额
-        
+
         Args:
             cny_amount: 人民币金额
             currency: 目标币种
-            
+
         Returns:
             格式化后的金额字符串
         """
@@ -294,7 +328,7 @@ class BEpusdt:
             # USDT相关币种，获取汇率转换
             rate = self.get_exchange_rate('CNY', 'USDT')
             if rate:
-                usdt_amount = cny_amount / rate
+                usdt_amount = float(cny_amount) / rate
                 return f"{usdt_amount:.2f} USDT"
             else:
                 return f"{cny_amount:.2f} CNY"
@@ -302,9 +336,128 @@ class BEpusdt:
             # TRX，获取汇率转换
             rate = self.get_exchange_rate('CNY', 'TRX')
             if rate:
-                trx_amount = cny_amount / rate
+                trx_amount = float(cny_amount) / rate
                 return f"{trx_amount:.2f} TRX"
             else:
                 return f"{cny_amount:.2f} CNY"
         else:
-            return f"{cny_amount:.2f} CNY"
\ No newline at end of file
+            return f"{cny_amount:.2f} CNY"
+
+
+class AsyncBEpusdt(BEpusdtBase):
+    """BEpusdt 异步客户端（供机器人处理器在事件循环中使用）
+
+    使用 httpx.AsyncClient 复用连接，请求等待网关时不阻塞事件循环；
+    信号量限制同时进行的请求数，超出的请求在本地排队。
+    """
+
+    def __init__(self, api_url: str, app_id: str, app_secret: str,
+                 max_connections: int = 20, max_concurrency: int = 10,
+                 rate_cache: Optional[RateCache] = None):
+        """
+        Args:
+            api_url: BEpusdt API 基础URL
+            app_id: 应用ID
+            app_secret: 应用密钥
+            max_connections: 连接池上限
+            max_concurrency: 同时进行的请求数上限
+            rate_cache: 汇率缓存（可在多个客户端之间共享）
+        """
+        super().__init__(api_url, app_id, app_secret, rate_cache)
+        self.max_concurrency = max_concurrency
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        # 客户端和信号量在首次请求时于事件循环中创建
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.api_url, limits=self.limits,
+                                             timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def aclose(self):
+        """关闭连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> 'AsyncBEpusdt':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _post(self, path: str, params: Dict[str, Any], idempotent: bool = True) -> httpx.Response:
+        """
+        发送请求，网络错误和网关临时错误时带抖动退避重试
+
+        Args:
+            path: 接口路径
+            params: 请求参数
+            idempotent: 是否可以安全重试；否则只在连接未建立时重试
+        """
+        client = self._get_client()
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                async with self._semaphore:
+                    response = await client.post(path, json=params)
+                if not idempotent or response.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                    return response
+                logger.warning(f"请求 {path} 返回 HTTP {response.status_code}，准备重试")
+            except httpx.TransportError as e:
+                # 非幂等请求只在请求尚未发出（连接失败、等待连接池超时）时重试
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout,
+                                                         httpx.PoolTimeout))
+                if not retryable or attempt == MAX_RETRIES:
+                    raise
+                logger.warning(f"请求 {path} 失败: {e}，准备重试")
+            await asyncio.sleep(_backoff(attempt))
+
+    async def create_order(self, order_id: str, amount: MoneyLike, trade_type: str = "usdt.trc20",
+                           notify_url: str = None, redirect_url: str = None,
+                           timeout: int = 1800, address: str = None) -> Dict[str, Any]:
+        """创建支付订单（参数和返回值同 BEpusdt.create_order）"""
+        try:
+            params = self._order_params(order_id, amount, trade_type, notify_url,
+                                        redirect_url, timeout, address)
+            response = await self._post('/api/order/create-order', params, idempotent=False)
+            logger.info(f"创建订单响应状态: {response.status_code}")
+            body = response.json() if response.status_code == 200 else None
+            return self._result('创建订单', response.status_code, body, response.text)
+        except httpx.HTTPError as e:
+            return self._error('创建订单', '网络请求失败', e)
+        except Exception as e:
+            return self._error('创建订单', '系统异常', e)
+
+    async def query_order(self, order_id: str) -> Dict[str, Any]:
+        """查询订单状态（返回值同 BEpusdt.query_order）"""
+        try:
+            params = self._signed({'order_id': order_id})
+            response = await self._post('/api/order/query-order', params)
+            logger.info(f"查询订单响应状态: {response.status_code}")
+            body = response.json() if response.status_code == 200 else None
+            return self._result('查询订单', response.status_code, body, response.text)
+        except httpx.HTTPError as e:
+            return self._error('查询订单', '网络请求失败', e)
+        except Exception as e:
+            return self._error('查询订单', '系统异常', e)
+
+    async def get_exchange_rate(self, from_currency: str = 'CNY', to_currency: str = 'USDT') -> Optional[float]:
+        """获取汇率（经过缓存），从未成功获取时返回None"""
+        return await self.rates.get_async((from_currency, to_currency),
+                                          lambda: self._fetch_exchange_rate(from_currency, to_currency))
+
+    async def _fetch_exchange_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """请求网关获取汇率"""
+        try:
+            params = self._signed({'from': from_currency, 'to': to_currency})
+            response = await self._post('/api/exchange/rate', params)
+            body = response.json() if response.status_code == 200 else None
+            return self._rate(response.status_code, body)
+        except Exception as e:
+            logger.error(f"获取汇率异常: {e}")
+            return None
@@ -0,0 +1,166 @@
+# Exchange rate cache
+import asyncio
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RateCache:
+    """汇率缓存
+
+    - 缓存时间 ttl 内直接返回（命中）
+    - 过期但在 stale_ttl 内：先返回旧值，同时在后台刷新（stale-while-revalidate）
+    - 没有可用缓存时同步获取；同一币种对同一时间只有一个刷新请求（single-flight），
+      并发的调用等待这一次请求的结果
+    - 网关不可用时返回最后一次成功获取的汇率
+
+    同步接口 get 供线程使用，异步接口 get_async 供事件循环使用，两者共享缓存数据。
+    """
+
+    def __init__(self, ttl: float = 60.0, stale_ttl: float = 600.0, wait_timeout: float = 20.0):
+        """
+        Args:
+            ttl: 缓存有效期（秒）
+            stale_ttl: 过期后仍可先返回旧值的时间（秒）
+            wait_timeout: 同步接口等待其他线程刷新结果的最长时间（秒）
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.wait_timeout = wait_timeout
+
+        self._rates: Dict[Hashable, Tuple[float, float]] = {}  # 币种对 -> (汇率, 获取时间)
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, threading.Event] = {}
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+        self.hits = 0           # 缓存有效
+        self.stale_hits = 0     # 返回旧值并后台刷新
+        self.misses = 0         # 需要等待获取
+        self.fallbacks = 0      # 获取失败，返回最后已知汇率
+        self.refreshes = 0      # 实际发出的请求数
+        self.errors = 0         # 失败的请求数
+
+    def _lookup(self, pair: Hashable) -> Tuple[Optional[float], Optional[str]]:
+        """返回 (缓存汇率, 状态)，状态为 fresh / stale / None"""
+        entry = self._rates.get(pair)
+        if entry is None:
+            return None, None
+        rate, fetched_at = entry
+        age = time.monotonic() - fetched_at
+        if age < self.ttl:
+            return rate, 'fresh'
+        if age < self.ttl + self.stale_ttl:
+            return rate, 'stale'
+        return rate, None
+
+    def _store(self, pair: Hashable, rate: Optional[float]):
+        self.refreshes += 1
+        if rate is None:
+            self.errors += 1
+        else:
+            self._rates[pair] = (rate, time.monotonic())
+
+    def _last_known(self, pair: Hashable) -> Optional[float]:
+        entry = self._rates.get(pair)
+        if entry is None:
+            return None
+        self.fallbacks += 1
+        return entry[0]
+
+    def get(self, pair: Hashable, fetch: Callable[[], Optional[float]]) -> Optional[float]:
+        """获取汇率（同步）
+
+        Args:
+            pair: 币种对，如 ('CNY', 'USDT')
+            fetch: 请求网关的函数，失败时返回None
+
+        Returns:
+            汇率；从未成功获取过时返回None
+        """
+        rate, state = self._lookup(pair)
+        if state == 'fresh':
+            self.hits += 1
+            return rate
+
+        with self._lock:
+            event = self._inflight.get(pair)
+            leader = event is None
+            if leader:
+                event = self._inflight[pair] = threading.Event()
+
+        if state == 'stale':
+            self.stale_hits += 1
+            if leader:
+                threading.Thread(target=self._refresh, args=(pair, fetch, event), daemon=True).start()
+            return rate
+
+        self.misses += 1
+        if leader:
+            self._refresh(pair, fetch, event)
+        else:
+            event.wait(self.wait_timeout)
+
+        rate, state = self._lookup(pair)
+        if state == 'fresh':
+            return rate
+        return self._last_known(pair)
+
+    def _refresh(self, pair: Hashable, fetch: Callable[[], Optional[float]], event: threading.Event):
+        try:
+            rate = fetch()
+        except Exception as e:
+            logger.error(f"刷新汇率 {pair} 失败: {e}")
+            rate = None
+        # 先写入缓存再结束刷新，避免其他调用在两者之间重复请求
+        self._store(pair, rate)
+        with self._lock:
+            self._inflight.pop(pair, None)
+        event.set()
+
+    async def get_async(self, pair: Hashable, fetch: Callable[[], Awaitable[Optional[float]]]) -> Optional[float]:
+        """获取汇率（异步），语义同 get"""
+        rate, state = self._lookup(pair)
+        if state == 'fresh':
+            self.hits += 1
+            return rate
+
+        task = self._tasks.get(pair)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh_async(pair, fetch))
+            self._tasks[pair] = task
+
+        if state == 'stale':
+            self.stale_hits += 1
+            return rate
+
+        self.misses += 1
+        # shield：调用方被取消时不影响其他等待同一次刷新的调用
+        await asyncio.shield(task)
+
+        rate, state = self._lookup(pair)
+        if state == 'fresh':
+            return rate
+        return self._last_known(pair)
+
+    async def _refresh_async(self, pair: Hashable, fetch: Callable[[], Awaitable[Optional[float]]]):
+        try:
+            rate = await fetch()
+        except Exception as e:
+            logger.error(f"刷新汇率 {pair} 失败: {e}")
+            rate = None
+        self._store(pair, rate)
+        self._tasks.pop(pair, None)
+
+    def stats(self) -> Dict[str, int]:
+        """缓存命中统计"""
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'fallbacks': self.fallbacks,
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+        }
@@ -2,10 +2,14 @@
 import hashlib
 import time
 import uuid
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, Optional
 from tronpy import Tron
 from tronpy.keys import PrivateKey
 import requests
+from payments.allocator import AmountAllocator
+from payments.watcher import PaymentWatcher, TronGridBlockSource, Transfer
+from config import PAYMENT_TIMEOUT
+from store.money import Money
 
 class UMPay:
     """UMPay支付系统 - 支持USDT和TRX支付"""
@@ -25,39 +29,76 @@ class UMPay:
         
         # 支付订单存储
         self.orders: Dict[str, Dict] = {}
+        
+        # 新支付订单回调（用于登记到期调度）
+        self.on_order_created: Optional[Callable[[Dict], None]] = None
+        
+        # 唯一金额分配：同一收款地址上的待支付订单金额互不相同
+        self.allocator = AmountAllocator()
+        
+        # 批量扫描区块的支付监听器，所有待支付订单共用
+        self.watcher = PaymentWatcher(TronGridBlockSource(self.tron), self.usdt_contract,
+                                      self.allocator, on_payment=self._on_payment)
     
-    def create_payment_order(self, amount: float, currency: str = 'USDT', 
+    def create_payment_order(self, amount: Money, currency: str = 'USDT', 
                            callback_url: Optional[str] = None) -> Dict:
         """
         创建支付订单
         
         Args:
-            amount: 支付金额
+            amount: 支付金额（两位小数的定点金额）
             currency: 货币类型 ('USDT' 或 'TRX')
             callback_url: 支付完成回调URL
             
         Returns:
-            包含订单信息的字典
+            包含订单信息的字典，amount 为需要实际支付的唯一金额
         """
         order_id = str(uuid.uuid4())
         
         # 生成收款地址 (这里应该是您的实际收款地址)
         receiving_address = self._get_receiving_address(currency)
         
+        # 在原始金额上加微小偏移，链上按金额区分共用地址的订单
+        pay_amount = self.allocator.allocate(order_id, receiving_address, currency, amount.to_decimal())
+        if pay_amount is None:
+            raise RuntimeError(f'收款地址待支付订单过多，请稍后重试: {amount} {currency}')
+        
         order = {
             'order_id': order_id,
-            'amount': amount,
+            'amount': float(pay_amount),
+            'base_amount': amount,
             'currency': currency,
             'receiving_address': receiving_address,
             'status': 'pending',
             'created_at': int(time.time()),
             'callback_url': callback_url,
-            'expires_at': int(time.time()) + 3600  # 1小时过期
+            'expires_at': int(time.time()) + PAYMENT_TIMEOUT * 60  # 与商城订单的库存预占使用同一支付时限
         }
         
         self.orders[order_id] = order
+        self.watcher.watch(order_id, receiving_address, order['created_at'])
+        if self.on_order_created:
+            self.on_order_created(order)
         return order
     
+    def expire_order(self, order_id: str) -> bool:
+        """
+        将已超时的待支付订单标记为过期
+        
+        Args:
+            order_id: 订单ID
+            
+        Returns:
+            是否发生了状态变更
+        """
+        order = self.orders.get(order_id)
+        if not order or order['status'] != 'pending' or int(time.time()) < order['expires_at']:
+            return False
+        
+        order['status'] = 'expired'
+        self._release(order_id)
+        return True
+    
     def check_payment_status(self, order_id: str) -> Dict:
         """
         检查支付状态
@@ -74,23 +115,25 @@ class UMPay:
         order = self.orders[order_id]
         
         # 检查是否过期
-        if int(time.time()) > order['expires_at']:
+        if order['status'] == 'pending' and int(time.time()) > order['expires_at']:
             order['status'] = 'expired'
+            self._release(order_id)
             return order
         
-        # 检查区块链上的交易
+        # 扫描新区块（一次扫描同时匹配所有待支付订单）
         if order['status'] == 'pending':
-            is_paid = self._check_blockchain_payment(order)
-            if is_paid:
-                order['status'] = 'completed'
-                order['completed_at'] = int(time.time())
-                
-                # 发送回调通知
-                if order.get('callback_url'):
-                    self._send_callback(order)
+            try:
+                self.watcher.poll()
+            except Exception as e:
+                print(f'扫描区块时出错: {e}')
         
         return order
     
+    def _release(self, order_id: str):
+        """停止监听订单并释放其占用的金额"""
+        self.watcher.unwatch(order_id)
+        self.allocator.release(order_id)
+    
     def _get_receiving_address(self, currency: str) -> str:
         """
         获取收款地址
@@ -110,84 +153,27 @@ class UMPay:
         else:
             raise ValueError(f'不支持的货币类型: {currency}')
     
-    def _check_blockchain_payment(self, order: Dict) -> bool:
+    def _on_payment(self, order_id: str, transfer: Transfer):
         """
-        检查区块链上的支付情况
+        监听器匹配到链上转账时完成订单
         
         Args:
-            order: 订单信息
-            
-        Returns:
-            是否已支付
-        """
-        try:
-            address = order['receiving_address']
-            amount = order['amount']
-            currency = order['currency']
-            created_at = order['created_at']
-            
-            if currency == 'TRX':
-                # 检查TRX转账
-                return self._check_trx_payment(address, amount, created_at)
-            elif currency == 'USDT':
-                # 检查USDT转账
-                return self._check_usdt_payment(address, amount, created_at)
-            
-        except Exception as e:
-            print(f'检查支付状态时出错: {e}')
-            return False
-        
-        return False
-    
-    def _check_trx_payment(self, address: str, amount: float, since: int) -> bool:
+            order_id: 订单ID
+            transfer: 匹配的链上转账
         """
-        检查TRX支付
+        order = self.orders.get(order_id)
+        if not order or order['status'] != 'pending':
+            return
         
-        Args:
-            address: 收款地址
-            amount: 期望金额
-            since: 订单创建时间戳
-            
-        Returns:
-            是否收到足够的TRX
-        """
-        try:
-            # 获取地址的交易记录
-            account = self.tron.get_account(address)
-            
-            # 这里需要实现具体的交易检查逻辑
-            # 由于API限制，这里只是示例代码
-            
-            return False  # 暂时返回False，需要实际实现
-            
-        except Exception as e:
-            print(f'检查TRX支付时出错: {e}')
-            return False
-    
-    def _check_usdt_payment(self, address: str, amount: float, since: int) -> bool:
-        """
-        检查USDT支付
+        order['status'] = 'completed'
+        order['completed_at'] = int(time.time())
+        order['txid'] = transfer.txid
+        order['block'] = transfer.block
+        self.allocator.release(order_id)
         
-        Args:
-            address: 收款地址
-            amount: 期望金额
-            since: 订单创建时间戳
-            
-        Returns:
-            是否收到足够的USDT
-        """
-        try:
-            # 获取USDT合约实例
-            contract = self.tron.get_contract(self.usdt_contract)
-            
-            # 这里需要实现具体的USDT转账检查逻辑
-            # 由于API限制，这里只是示例代码
-            
-            return False  # 暂时返回False，需要实际实现
-            
-        except Exception as e:
-            print(f'检查USDT支付时出错: {e}')
-            return False
+        # 发送回调通知
+        if order.get('callback_url'):
+            self._send_callback(order)
     
     def _send_callback(self, order: Dict):
         """
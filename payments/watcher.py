@@ -0,0 +1,323 @@
+# TronGrid payment watcher
+import asyncio
+import json
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tronpy import Tron
+from tronpy.keys import to_hex_address
+
+from config import CONFIRMATION_BLOCKS
+from payments.allocator import UNIT, AmountAllocator
+
+logger = logging.getLogger(__name__)
+
+# TRC20 transfer(address,uint256) 方法选择器
+TRANSFER_SELECTOR = 'a9059cbb'
+
+# TronGrid wallet/getblockbylimitnext 单次最多返回 100 个区块
+MAX_BATCH_BLOCKS = 100
+
+# 出块间隔（秒），按订单创建时间估算其所在区块
+BLOCK_SECONDS = 3
+# 估算订单创建区块时额外向前多扫的区块数（本机时钟与链上时间的偏差），应小于确认区块数
+START_MARGIN_BLOCKS = 10
+
+
+@dataclass
+class Transfer:
+    """链上转账"""
+    txid: str
+    block: int
+    timestamp: int          # 区块时间（秒）
+    currency: str           # TRX / USDT
+    to_address: str         # 十六进制地址（41 开头）
+    amount: int             # 最小单位
+
+
+class BlockSource:
+    """区块数据来源"""
+
+    def latest_block(self) -> int:
+        raise NotImplementedError
+
+    def get_blocks(self, start: int, end: int) -> List[Dict]:
+        """获取 [start, end) 范围内的区块（TronGrid JSON 格式）"""
+        raise NotImplementedError
+
+
+class TronGridBlockSource(BlockSource):
+    """通过 TronGrid 批量拉取区块"""
+
+    def __init__(self, tron: Tron):
+        self.tron = tron
+
+    def latest_block(self) -> int:
+        return self.tron.get_latest_block_number()
+
+    def get_blocks(self, start: int, end: int) -> List[Dict]:
+        result = self.tron.provider.make_request(
+            'wallet/getblockbylimitnext', {'startNum': start, 'endNum': end}
+        )
+        return result.get('block', [])
+
+
+class RecordedBlockSource(BlockSource):
+    """回放录制的区块（测试和基准测试使用，不访问网络）"""
+
+    def __init__(self, blocks: List[Dict]):
+        self.blocks = {block_number(block): block for block in blocks}
+
+    @classmethod
+    def from_file(cls, path: str) -> 'RecordedBlockSource':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def latest_block(self) -> int:
+        return max(self.blocks) if self.blocks else 0
+
+    def get_blocks(self, start: int, end: int) -> List[Dict]:
+        return [self.blocks[n] for n in range(start, end) if n in self.blocks]
+
+
+def block_number(block: Dict) -> int:
+    return block['block_header']['raw_data']['number']
+
+
+def parse_transfers(block: Dict, usdt_contract: str, watched: Optional[set] = None) -> List[Transfer]:
+    """解析区块中的 TRX 转账和 USDT transfer 调用
+
+    Args:
+        block: 区块 JSON
+        usdt_contract: USDT 合约十六进制地址
+        watched: 只保留转入这些十六进制地址的转账，None 表示全部保留
+    """
+    header = block['block_header']['raw_data']
+    number = header['number']
+    timestamp = header.get('timestamp', 0) // 1000
+    transfers = []
+
+    for tx in block.get('transactions', []):
+        ret = tx.get('ret')
+        if ret and ret[0].get('contractRet', 'SUCCESS') != 'SUCCESS':
+            continue
+        contracts = tx.get('raw_data', {}).get('contract', [])
+        if not contracts:
+            continue
+        contract = contracts[0]
+        value = contract.get('parameter', {}).get('value', {})
+        kind = contract.get('type')
+
+        if kind == 'TransferContract':
+            to_address = value.get('to_address', '').lower()
+            if watched is None or to_address in watched:
+                transfers.append(Transfer(tx['txID'], number, timestamp, 'TRX',
+                                          to_address, value.get('amount', 0)))
+
+        elif kind == 'TriggerSmartContract':
+            data = value.get('data', '')
+            if not data.startswith(TRANSFER_SELECTOR) or \
+                    value.get('contract_address', '').lower() != usdt_contract:
+                continue
+            # 参数：32 字节地址（低 20 字节）+ 32 字节金额
+            to_address = '41' + data[32:72].lower()
+            if watched is None or to_address in watched:
+                transfers.append(Transfer(tx['txID'], number, timestamp, 'USDT',
+                                          to_address, int(data[72:136], 16)))
+    return transfers
+
+
+class PaymentWatcher:
+    """批量扫描区块匹配待支付订单
+
+    每次扫描从游标之后的已确认区块开始，按批（每批最多 100 个区块）拉取，
+    只解析转入收款地址的转账，并通过金额分配器按 (地址, 币种, 金额) 直接定位订单。
+    一次扫描的链上请求数只与区块数有关，与待支付订单数量无关。
+
+    新登记的订单早于游标时（如重启后首次扫描、恢复较早创建的订单），游标退回到
+    按创建时间估算的区块，不会跳过订单创建后、登记前到账的转账；早于订单创建时间的
+    转账不会匹配，多扫的区块只增加请求数。没有待支付订单时游标直接前移。
+    """
+
+    def __init__(self, source: BlockSource, usdt_contract: str, allocator: AmountAllocator,
+                 on_payment: Optional[Callable[[str, Transfer], None]] = None,
+                 confirmations: int = CONFIRMATION_BLOCKS,
+                 batch_blocks: int = MAX_BATCH_BLOCKS,
+                 start_block: Optional[int] = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            source: 区块数据来源
+            usdt_contract: USDT 合约地址
+            allocator: 金额分配器，订单的应付金额由它分配，转账金额也由它查找订单
+            on_payment: 匹配到支付时的回调 (订单ID, 转账)
+            confirmations: 需要的确认区块数
+            batch_blocks: 每批拉取的区块数
+            start_block: 起始游标（最后一个已扫描区块），默认从最早的待支付订单创建时的区块开始
+            clock: 当前时间（秒），与最新区块对应，用于估算订单创建时的区块
+        """
+        self.source = source
+        self.allocator = allocator
+        self.usdt_contract = to_hex_address(usdt_contract).lower()
+        self.on_payment = on_payment
+        self.confirmations = confirmations
+        self.batch_blocks = min(batch_blocks, MAX_BATCH_BLOCKS)
+        self.cursor = start_block
+        self.clock = clock
+
+        self._orders: Dict[str, Tuple[str, int]] = {}  # 订单ID -> (十六进制收款地址, 创建时间)
+        self._addresses: Dict[str, int] = {}  # 十六进制地址 -> 待支付订单数
+        self._unscanned: Optional[int] = None  # 上次扫描后登记的订单中最早的创建时间
+        self._retry: Dict[str, Transfer] = {}  # 支付回调失败、待重试的订单 -> 匹配的转账
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+
+        self.blocks_scanned = 0
+        self.requests = 0
+        self.matched = 0
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def watch(self, order_id: str, address: str, created_at: int = 0):
+        """登记待支付订单（应付金额须已通过金额分配器分配）
+
+        Args:
+            order_id: 订单ID
+            address: 收款地址
+            created_at: 订单创建时间，早于该时间的转账不匹配；游标已越过创建时的区块时从该区块重新扫描
+        """
+        address = to_hex_address(address).lower()
+        with self._lock:
+            if order_id in self._orders:
+                return
+            self._orders[order_id] = (address, created_at)
+            self._addresses[address] = self._addresses.get(address, 0) + 1
+            # 没有创建时间的订单不退回游标
+            if created_at and (self._unscanned is None or created_at < self._unscanned):
+                self._unscanned = created_at
+
+    def unwatch(self, order_id: str) -> bool:
+        """移除订单（已支付、过期或取消）"""
+        with self._lock:
+            self._retry.pop(order_id, None)
+            entry = self._orders.pop(order_id, None)
+            if entry is None:
+                return False
+            address = entry[0]
+            self._addresses[address] -= 1
+            if not self._addresses[address]:
+                del self._addresses[address]
+            return True
+
+    def _match(self, transfer: Transfer) -> Optional[str]:
+        # 分配器保证同一地址、币种上未结算订单的应付金额唯一
+        order_id = self.allocator.lookup(transfer.to_address, transfer.currency,
+                                         Decimal(transfer.amount) / UNIT)
+        if order_id is None:
+            return None
+        with self._lock:
+            entry = self._orders.get(order_id)
+            if entry is None or entry[1] > transfer.timestamp or order_id in self._retry:
+                return None
+        return order_id
+
+    def _settle(self, order_id: str, transfer: Transfer) -> bool:
+        """调用支付回调，成功后移除订单
+
+        回调失败时订单保持登记，转账记入重试表，下次扫描时先重试，
+        游标照常前移，不会因为一个订单的回调失败阻塞其他订单。
+        """
+        if self.on_payment:
+            try:
+                self.on_payment(order_id, transfer)
+            except Exception as e:
+                logger.error(f"处理订单 {order_id} 支付失败，下次扫描时重试: {e}")
+                with self._lock:
+                    if order_id in self._orders:
+                        self._retry[order_id] = transfer
+                return False
+        self.unwatch(order_id)
+        return True
+
+    def poll(self) -> int:
+        """扫描游标之后的已确认区块
+
+        Returns:
+            本次匹配的订单数量
+        """
+        with self._scan_lock:
+            head = self.source.latest_block()
+            safe = head - self.confirmations
+            self.requests += 1
+            with self._lock:
+                created_at, self._unscanned = self._unscanned, None
+                idle = not self._addresses
+            # 没有待支付订单时直接前移游标，不拉取区块：之后创建的订单只会在更新的区块中到账
+            if idle:
+                self.cursor = max(self.cursor or 0, safe)
+                return 0
+            # 新登记的订单早于游标（或尚未扫描过）时，从订单创建时的区块开始扫描
+            if created_at is not None:
+                start = self._block_at(head, created_at)
+                if self.cursor is None or start <= self.cursor:
+                    self.cursor = start - 1
+            elif self.cursor is None:
+                self.cursor = safe
+
+            # 先重试上次回调失败的订单
+            matched = 0
+            with self._lock:
+                retry, self._retry = self._retry, {}
+            for order_id, transfer in retry.items():
+                if self._settle(order_id, transfer):
+                    matched += 1
+
+            while self.cursor < safe:
+                start = self.cursor + 1
+                end = min(start + self.batch_blocks, safe + 1)
+                blocks = self.source.get_blocks(start, end)
+                self.requests += 1
+
+                watched = set(self._addresses)
+                for block in blocks:
+                    for transfer in parse_transfers(block, self.usdt_contract, watched):
+                        order_id = self._match(transfer)
+                        if order_id is not None and self._settle(order_id, transfer):
+                            matched += 1
+                self.blocks_scanned += end - start
+                self.cursor = end - 1
+
+            self.matched += matched
+            return matched
+
+    def _block_at(self, head: int, timestamp: float) -> int:
+        """估算 timestamp 时的区块号（偏早：漏块使实际区块数少于按时间估算的区块数）"""
+        elapsed = max(0, math.ceil((self.clock() - timestamp) / BLOCK_SECONDS))
+        return max(0, head - elapsed - START_MARGIN_BLOCKS)
+
+    def metrics(self) -> Dict:
+        return {
+            'pending': len(self._orders),
+            'retrying': len(self._retry),
+            'addresses': len(self._addresses),
+            'cursor': self.cursor,
+            'blocks_scanned': self.blocks_scanned,
+            'requests': self.requests,
+            'matched': self.matched,
+        }
+
+    async def run(self, interval: float = 3.0):
+        """在事件循环中周期性扫描（区块查询在线程池中执行）"""
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.poll)
+            except Exception as e:
+                logger.error(f"扫描区块失败: {e}")
+            await asyncio.sleep(interval)
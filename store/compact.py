@@ -0,0 +1,156 @@
+import sys
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+# 本地时间纪元：datetime 与微秒整数互相转换时不经过时区，可无损还原
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+CompactId = Union[int, str]
+
+
+def to_micros(value: Optional[datetime]) -> Optional[int]:
+    """datetime（本地时间）-> 自 1970-01-01 起的微秒数"""
+    if value is None:
+        return None
+    return (value - EPOCH) // MICROSECOND
+
+
+def from_micros(value: Optional[int]) -> Optional[datetime]:
+    """微秒数 -> datetime（本地时间）"""
+    if value is None:
+        return None
+    return EPOCH + MICROSECOND * value
+
+
+def now_micros() -> int:
+    return to_micros(datetime.now())
+
+
+def new_id() -> int:
+    """新的紧凑ID（uuid4 的 128 位整数）"""
+    return uuid.uuid4().int
+
+
+def pack_id(value: Any) -> Any:
+    """标准格式的 UUID 字符串压缩为 128 位整数，其他值原样返回
+
+    只压缩能还原为相同字符串的ID，其他格式的ID（网关订单号、交易哈希等）保持字符串。
+    """
+    if type(value) is not str or len(value) != 36:
+        return value
+    try:
+        packed = int(value.replace('-', ''), 16)
+    except ValueError:
+        return value
+    return packed if unpack_id(packed) == value else value
+
+
+def unpack_id(value: Any) -> Any:
+    """紧凑ID还原为 UUID 字符串"""
+    if type(value) is not int:
+        return value
+    h = '%032x' % value
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def micros_property(slot: str, doc: Optional[str] = None) -> property:
+    """以微秒整数保存在 slot 中、读写为 datetime 的属性"""
+    def fget(self):
+        return from_micros(getattr(self, slot))
+
+    def fset(self, value):
+        setattr(self, slot, to_micros(value))
+    return property(fget, fset, doc=doc)
+
+
+def id_property(slot: str, doc: Optional[str] = None) -> property:
+    """以紧凑ID保存在 slot 中、读写为字符串的属性"""
+    def fget(self):
+        return unpack_id(getattr(self, slot))
+
+    def fset(self, value):
+        setattr(self, slot, pack_id(value))
+    return property(fget, fset, doc=doc)
+
+
+def intern(value: Optional[str]) -> Optional[str]:
+    """驻留取值有限的字符串（类型、状态、支付方式），所有记录共用同一对象"""
+    return sys.intern(value) if type(value) is str else value
+
+
+class SlottedRecord:
+    """紧凑记录基类
+
+    子类用 __slots__ 保存字段（没有实例 __dict__），类中的注解声明对外字段，
+    与原 dataclass 的字段、类型和构造参数相同；ID 和时间在内部以整数保存，
+    通过属性读写为字符串和 datetime。
+    """
+
+    __slots__ = ()
+    FIELDS: Tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELDS = tuple(cls.__dict__.get('__annotations__', {}))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """对外字段的字典（用于序列化）"""
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def copy_from(self, other: 'SlottedRecord'):
+        """用另一条记录的内容覆盖本记录（保持索引中的对象引用有效）"""
+        for slot in self.__slots__:
+            setattr(self, slot, getattr(other, slot))
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+
+class IdMap(dict):
+    """以紧凑ID为键的字典
+
+    按字符串ID读写（与 Dict[str, ...] 用法相同），内部以 128 位整数为键，
+    不再为每条记录保存一份 36 字符的ID字符串。
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return dict.__getitem__(self, pack_id(key))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, pack_id(key), value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, pack_id(key))
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, pack_id(key))
+
+    def get(self, key, default=None):
+        return dict.get(self, pack_id(key), default)
+
+    def pop(self, key, *default):
+        return dict.pop(self, pack_id(key), *default)
+
+    def setdefault(self, key, default=None):
+        return dict.setdefault(self, pack_id(key), default)
+
+    def __iter__(self) -> Iterator[CompactId]:
+        return (unpack_id(key) for key in dict.__iter__(self))
+
+    def keys(self):
+        return [unpack_id(key) for key in dict.keys(self)]
+
+    def items(self):
+        return [(unpack_id(key), value) for key, value in dict.items(self)]
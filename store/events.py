@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CallbackKey = Tuple[str, str, str]
+
+# 结算状态
+QUEUED = 'queued'            # 已持久化，等待结算
+SETTLING = 'settling'        # 已被某个进程认领，正在结算
+SETTLED = 'settled'          # 已结算
+FAILED = 'failed'            # 多次重试后放弃
+
+# claim 的结果
+NEW = 'new'                  # 首次收到，需要处理
+DUPLICATE = 'duplicate'      # 已处理过，直接确认
+IN_PROGRESS = 'in_progress'  # 相同回调正在处理中
+
+
+class CallbackEventLog:
+    """支付回调事件日志
+
+    每个通过验证的回调以 (网关, 订单ID, 交易哈希) 为键追加到数据库中的
+    只追加日志（提交后即可确认回调），同时放入内存中的已记录集合。网关重试的
+    重复回调在集合中 O(1) 命中，直接确认而不再修改订单/余额。日志中的回调
+    由结算线程异步应用，并可按序号重放，用于在状态丢失后重新应用回调。
+
+    没有交易哈希的回调（如过期、失败通知）以状态代替哈希，
+    使同一订单的"已支付"和"已过期"通知互不影响。
+    """
+
+    def __init__(self, storage, retention: float = 30 * 24 * 3600):
+        """
+        Args:
+            storage: SQLiteStorage 实例
+            retention: 启动时加载多长时间内（秒）的回调键
+        """
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._seen: Set[CallbackKey] = set(storage.load_callback_keys(time.time() - retention))
+        self._processing: Set[CallbackKey] = set()
+
+        self.accepted = 0
+        self.duplicates = 0
+        self.in_progress = 0
+        self.released = 0
+
+    @staticmethod
+    def key(gateway: str, data: Dict[str, Any]) -> CallbackKey:
+        """回调的幂等键"""
+        tx_hash = data.get('tx_hash') or data.get('payment_order_id') or data.get('status') or ''
+        return gateway, str(data.get('order_id', '')), str(tx_hash)
+
+    def claim(self, key: CallbackKey) -> str:
+        """开始处理一个回调
+
+        Returns:
+            NEW（调用方写入日志时调用 record，出错时调用 release）、DUPLICATE 或 IN_PROGRESS
+        """
+        with self._lock:
+            if key in self._seen:
+                self.duplicates += 1
+                return DUPLICATE
+            if key in self._processing:
+                self.in_progress += 1
+                return IN_PROGRESS
+            self._processing.add(key)
+            self.accepted += 1
+            return NEW
+
+    def record(self, key: CallbackKey, status: Optional[str], payload: Dict[str, Any]):
+        """把回调写入日志（待结算），之后相同键的回调视为重复"""
+        gateway, order_id, tx_hash = key
+        self.storage.append_callback_event(gateway, order_id, tx_hash, status, payload)
+        with self._lock:
+            self._processing.discard(key)
+            self._seen.add(key)
+
+    def settle(self, key: CallbackKey, attempts: int, outcome: str):
+        """标记回调已结算"""
+        self.storage.update_callback_event(*key, SETTLED, attempts, time.time(), outcome)
+
+    def retry(self, key: CallbackKey, attempts: int, next_attempt: float, error: str):
+        """结算失败，next_attempt 之后重试"""
+        self.storage.update_callback_event(*key, QUEUED, attempts, next_attempt, error)
+
+    def fail(self, key: CallbackKey, attempts: int, error: str):
+        """放弃结算"""
+        self.storage.update_callback_event(*key, FAILED, attempts, time.time(), error)
+
+    def release(self, key: CallbackKey):
+        """写入日志出错（含提交失败），放弃该键，网关重试时重新处理"""
+        with self._lock:
+            self._processing.discard(key)
+            self._seen.discard(key)
+            self.released += 1
+
+    def seen(self, key: CallbackKey) -> bool:
+        return key in self._seen
+
+    def events(self, since_seq: int = 0, gateway: Optional[str] = None,
+               batch_size: int = 1000) -> Iterator[Tuple]:
+        """按序号遍历日志中的回调事件"""
+        while True:
+            rows = self.storage.load_callback_events(since_seq, gateway, batch_size)
+            if not rows:
+                return
+            yield from rows
+            since_seq = rows[-1][0]
+
+    def replay(self, handlers: Dict[str, Callable[[Dict[str, Any]], Any]], since_seq: int = 0,
+               gateway: Optional[str] = None) -> int:
+        """重放日志中的回调
+
+        处理函数应与收到回调时调用的相同；订单/充值状态检查保证重复应用不会重复入账。
+
+        Args:
+            handlers: 网关 -> 处理函数（参数为回调数据）
+            since_seq: 从该序号之后开始重放
+            gateway: 只重放指定网关的回调
+
+        Returns:
+            重放的事件数
+        """
+        count = 0
+        for seq, event_gateway, order_id, _, _, _, payload, _ in self.events(since_seq, gateway):
+            handler = handlers.get(event_gateway)
+            if handler is None:
+                continue
+            try:
+                handler(dict(payload))
+                count += 1
+            except Exception as e:
+                logger.error(f"重放回调 {seq} ({event_gateway}:{order_id}) 失败: {e}")
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'seen': len(self._seen),
+            'processing': len(self._processing),
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'in_progress': self.in_progress,
+            'released': self.released,
+        }
@@ -0,0 +1,87 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class TimeOrderedIndex:
+    """按键分组、按时间排序的二级索引
+
+    每个键（如用户ID）维护一个按时间升序排列的列表，追加写入为 O(1)，
+    查询"最近N条"只需从尾部切片，与全局记录总数无关。
+    游标为上一页最后一条记录的ID，用于向更早的记录翻页。
+
+    排序键直接引用记录自身的时间戳对象，不为每条记录额外分配元组或序号；
+    同一时间戳的记录按写入顺序排列。
+    """
+
+    def __init__(self, time_attr: str = 'created_at', id_attr: str = 'id'):
+        self.time_attr = time_attr
+        self.id_attr = id_attr
+        self._items: Dict[Hashable, List[Any]] = {}
+        self._times: Dict[Hashable, List[Any]] = {}
+        self._item_times: Dict[Any, Any] = {}  # 记录ID -> 时间戳
+
+    def add(self, key: Hashable, item: Any):
+        """添加记录（同一时间戳按写入顺序排列）"""
+        timestamp = getattr(item, self.time_attr)
+        items = self._items.setdefault(key, [])
+        times = self._times.setdefault(key, [])
+
+        if not times or timestamp >= times[-1]:
+            items.append(item)
+            times.append(timestamp)
+        else:
+            # bisect_right 插入到相同时间戳之后，保持写入顺序
+            pos = bisect_right(times, timestamp)
+            items.insert(pos, item)
+            times.insert(pos, timestamp)
+
+        self._item_times[getattr(item, self.id_attr)] = timestamp
+
+    def count(self, key: Hashable) -> int:
+        """获取某个键下的记录数"""
+        return len(self._items.get(key, ()))
+
+    def all(self, key: Hashable) -> List[Any]:
+        """按时间升序返回某个键下的全部记录"""
+        return list(self._items.get(key, ()))
+
+    def latest(self, key: Hashable, limit: int, cursor: Optional[Any] = None,
+               predicate: Optional[Callable[[Any], bool]] = None) -> Tuple[List[Any], Optional[Any]]:
+        """按时间倒序分页查询
+
+        Args:
+            key: 分组键
+            limit: 每页条数
+            cursor: 上一页返回的游标（记录ID），None 表示从最新开始
+            predicate: 可选过滤条件
+
+        Returns:
+            (记录列表, 下一页游标)，没有更多记录时游标为 None
+        """
+        items = self._items.get(key)
+        if not items or limit <= 0:
+            return [], None
+
+        end = len(items)
+        if cursor is not None:
+            cursor_time = self._item_times.get(cursor)
+            if cursor_time is None:
+                return [], None
+            times = self._times[key]
+            end = bisect_left(times, cursor_time)
+            # 跳过与游标时间相同、写入更早的记录，定位到游标记录本身
+            while end < len(items) and times[end] == cursor_time and getattr(items[end], self.id_attr) != cursor:
+                end += 1
+
+        results = []
+        i = end - 1
+        while i >= 0 and len(results) < limit:
+            item = items[i]
+            if predicate is None or predicate(item):
+                results.append(item)
+            i -= 1
+
+        next_cursor = None
+        if i >= 0 and results:
+            next_cursor = getattr(results[-1], self.id_attr)
+        return results, next_cursor
@@ -0,0 +1,202 @@
+import heapq
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import PAYMENT_TIMEOUT
+
+# 预占状态
+RESERVED = "reserved"
+COMMITTED = "committed"
+RELEASED = "released"
+
+
+@dataclass
+class Reservation:
+    """库存预占记录"""
+    order_id: str
+    product_id: str
+    quantity: int
+    expires_at: float               # 过期时间戳（time.time）
+    status: str = RESERVED
+
+
+class StockReservations:
+    """库存预占引擎
+
+    - reserve：在商品锁内检查并扣减可用库存，不会超卖
+    - commit：支付完成，预占转为实际售出
+    - release：订单取消/过期，归还库存
+    - 超时未提交的预占自动释放（最小堆按过期时间排序），设置了 on_expire 时由它释放
+
+    可用库存保存在普通字典中，读取无需加锁；写操作按商品分别加锁，
+    不同商品之间互不阻塞。
+    """
+
+    def __init__(self, default_ttl: float = PAYMENT_TIMEOUT * 60,
+                 on_change: Optional[Callable[[str, int, Optional[int]], None]] = None,
+                 on_expire: Optional[Callable[[Reservation], bool]] = None):
+        """
+        Args:
+            default_ttl: 默认预占时长（秒）
+            on_change: 可用库存变化回调 (商品ID, 可用库存, 增减量)，在商品锁内调用；
+                直接设置库存时增减量为 None
+            on_expire: 预占超时时的回调，由它释放预占并返回是否已释放；未设置时直接释放
+        """
+        self.default_ttl = default_ttl
+        self.on_change = on_change
+        self.on_expire = on_expire
+
+        self._available: Dict[str, int] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._reservations: Dict[str, Reservation] = {}
+        self._expiry: List[Tuple[float, str]] = []
+        self._expiry_lock = threading.Lock()
+
+    def _lock(self, product_id: str) -> threading.Lock:
+        lock = self._locks.get(product_id)
+        if lock is None:
+            with self._locks_guard:
+                lock = self._locks.setdefault(product_id, threading.Lock())
+        return lock
+
+    def _changed(self, product_id: str, delta: Optional[int]):
+        if self.on_change:
+            self.on_change(product_id, self._available[product_id], delta)
+
+    def available(self, product_id: str) -> int:
+        """获取可用库存（无锁读取）"""
+        return self._available.get(product_id, 0)
+
+    def get(self, order_id: str) -> Optional[Reservation]:
+        """获取订单的预占记录"""
+        return self._reservations.get(order_id)
+
+    def set_stock(self, product_id: str, stock: int, notify: bool = True):
+        """设置可用库存（上架、盘点或同步其他进程的库存）"""
+        with self._lock(product_id):
+            self._available[product_id] = stock
+            if notify:
+                self._changed(product_id, None)
+
+    def adjust(self, product_id: str, delta: int) -> int:
+        """增减可用库存（补货等），返回调整后的库存"""
+        with self._lock(product_id):
+            self._available[product_id] = self._available.get(product_id, 0) + delta
+            self._changed(product_id, delta)
+            return self._available[product_id]
+
+    def remove(self, product_id: str):
+        """商品下架"""
+        with self._lock(product_id):
+            self._available.pop(product_id, None)
+
+    def reserve(self, order_id: str, product_id: str, quantity: int = 1,
+                ttl: Optional[float] = None) -> bool:
+        """原子地检查并预占库存
+
+        Returns:
+            是否预占成功（库存不足或订单已有预占时返回False）
+        """
+        self.release_expired()
+
+        if order_id in self._reservations:
+            return False
+
+        with self._lock(product_id):
+            if self._available.get(product_id, 0) < quantity:
+                return False
+            self._available[product_id] -= quantity
+            self._changed(product_id, -quantity)
+
+        expires_at = time.time() + (self.default_ttl if ttl is None else ttl)
+        self._track(Reservation(order_id, product_id, quantity, expires_at))
+        return True
+
+    def restore(self, order_id: str, product_id: str, quantity: int, expires_at: float):
+        """恢复重启前的预占（库存已在持久化数据中扣减，不再重复扣减）"""
+        if order_id not in self._reservations:
+            self._track(Reservation(order_id, product_id, quantity, expires_at))
+
+    def _track(self, reservation: Reservation):
+        self._reservations[reservation.order_id] = reservation
+        with self._expiry_lock:
+            heapq.heappush(self._expiry, (reservation.expires_at, reservation.order_id))
+
+    def reschedule(self, order_id: str, expires_at: float) -> bool:
+        """把预占的过期时间调整为 expires_at（与支付订单的过期时间对齐）"""
+        reservation = self._reservations.get(order_id)
+        if not reservation or reservation.status != RESERVED:
+            return False
+        reservation.expires_at = expires_at
+        with self._expiry_lock:
+            heapq.heappush(self._expiry, (expires_at, order_id))
+        return True
+
+    def commit(self, order_id: str) -> bool:
+        """支付完成，预占转为售出"""
+        reservation = self._reservations.get(order_id)
+        if not reservation:
+            return False
+        with self._lock(reservation.product_id):
+            if reservation.status != RESERVED:
+                return False
+            reservation.status = COMMITTED
+        self._reservations.pop(order_id, None)
+        return True
+
+    def release(self, order_id: str, notify: bool = True) -> bool:
+        """释放预占并归还库存
+
+        Args:
+            notify: 是否触发 on_change；库存已在别处持久化（见 Shop.fail_order）时为 False
+        """
+        reservation = self._reservations.get(order_id)
+        if not reservation:
+            return False
+        with self._lock(reservation.product_id):
+            if reservation.status != RESERVED:
+                return False
+            reservation.status = RELEASED
+            self._available[reservation.product_id] = \
+                self._available.get(reservation.product_id, 0) + reservation.quantity
+            if notify:
+                self._changed(reservation.product_id, reservation.quantity)
+        self._reservations.pop(order_id, None)
+        return True
+
+    def forget(self, order_id: str):
+        """丢弃预占但不改动库存（订单已由其他进程结算）"""
+        self._reservations.pop(order_id, None)
+
+    def release_expired(self, now: Optional[float] = None) -> List[Reservation]:
+        """释放所有已过期的预占
+
+        Returns:
+            本次释放的预占列表
+        """
+        now = time.time() if now is None else now
+        if not self._expiry or self._expiry[0][0] > now:
+            return []
+
+        due = []
+        with self._expiry_lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, order_id = heapq.heappop(self._expiry)
+                due.append(order_id)
+
+        released = []
+        for order_id in due:
+            reservation = self._reservations.get(order_id)
+            # 过期时间已被延长的预占在堆中留有旧的条目，跳过
+            if not reservation or reservation.expires_at > now or reservation.status != RESERVED:
+                continue
+            if self.on_expire(reservation) if self.on_expire else self.release(order_id):
+                released.append(reservation)
+        return released
+
+    def pending_count(self) -> int:
+        """未结算的预占数量"""
+        return len(self._reservations)
@@ -0,0 +1,195 @@
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from store.compact import now_micros
+
+# 账户锁的分片数
+LOCK_SHARDS = 64
+# 每追加多少条分录保存一次余额快照
+SNAPSHOT_INTERVAL = 10000
+# 同步其他进程分录时每次读取的条数
+SYNC_BATCH = 10000
+# 期初余额（账本启用前已有的余额）对应的系统账户
+OPENING = 'opening'
+
+
+class LedgerEntry(NamedTuple):
+    """余额分录：从系统账户 contra 向用户账户 account 转入 amount 分（负数为转出）"""
+    seq: int
+    account: int
+    contra: str
+    amount: int
+    created_us: int
+    memo: str
+    ref: Optional[str]
+
+
+class Statement(NamedTuple):
+    """账户对账单"""
+    account: int
+    opening: int                    # 期初余额（分）
+    closing: int                    # 期末余额（分）
+    entries: List[LedgerEntry]
+
+
+class _Shard:
+    """一组账户的余额（一个锁分片）"""
+
+    __slots__ = ('lock', 'accounts', 'system')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accounts: Dict[int, int] = {}  # 用户账户 -> 余额（分）
+        self.system: Dict[str, int] = {}    # 系统账户 -> 本分片贡献的余额（分）
+
+
+class Ledger:
+    """只追加的余额账本（复式记账）
+
+    - 每条分录在一个用户账户和一个系统账户（按变动类型，如 recharge、purchase、referral）
+      之间转移整数金额（分），一方增加多少另一方就减少多少，所有账户余额之和始终为 0
+    - 内存中只保存各账户余额，分录经持久化存储分组提交写入 SQLite，不在内存中累积
+    - 每追加 snapshot_interval 条分录保存一次余额快照，重启时从快照加之后的分录恢复余额
+    - 账户按用户ID分片加锁，余额检查与扣减在同一把锁内完成，不同分片互不阻塞
+    - 其他进程追加的分录由 sync 按序号读取（与变更日志相同）
+    """
+
+    def __init__(self, storage=None, snapshot_interval: int = SNAPSHOT_INTERVAL, shards: int = LOCK_SHARDS):
+        """
+        Args:
+            storage: 可选的持久化存储，未提供时分录保存在内存中
+            snapshot_interval: 每追加多少条分录保存一次余额快照
+            shards: 账户锁的分片数
+        """
+        self.storage = storage
+        self.snapshot_interval = snapshot_interval
+        self._shards = [_Shard() for _ in range(shards)]
+        self._journal: List[LedgerEntry] = []  # 无持久化存储时（测试、基准测试）分录保存在内存中
+        self._last_seq = 0                     # 已应用的其他进程分录序号
+        self._sync_lock = threading.Lock()
+        self._since_snapshot = 0
+        self._unflushed = False                # 本进程有尚未确认提交的分录
+        self.appends = 0
+
+    def _shard(self, account: int) -> _Shard:
+        return self._shards[account % len(self._shards)]
+
+    def load(self):
+        """从持久化存储恢复余额（最近的快照 + 之后的分录）"""
+        if not self.storage:
+            return
+        accounts, system, last_seq = self.storage.load_ledger_balances()
+        shards = [_Shard() for _ in self._shards]
+        for account, balance in accounts.items():
+            shards[account % len(shards)].accounts[account] = balance
+        shards[0].system.update(system)
+        self._shards = shards
+        self._last_seq = last_seq
+
+    def has_account(self, account: int) -> bool:
+        return account in self._shard(account).accounts
+
+    def accounts(self) -> Iterable[int]:
+        """有分录的用户账户"""
+        for shard in self._shards:
+            yield from list(shard.accounts)
+
+    def balance(self, account: int) -> int:
+        """用户账户余额（分）"""
+        return self._shard(account).accounts.get(account, 0)
+
+    def system_balance(self, name: str) -> int:
+        """系统账户余额（分）"""
+        return sum(shard.system.get(name, 0) for shard in self._shards)
+
+    def trial_balance(self) -> int:
+        """所有账户余额之和（正常情况下为 0）"""
+        return sum(sum(shard.accounts.values()) + sum(shard.system.values()) for shard in self._shards)
+
+    def post(self, account: int, amount: int, contra: str, memo: str = "", ref: Optional[str] = None,
+             floor: Optional[int] = None) -> Optional[int]:
+        """追加一条分录
+
+        Args:
+            account: 用户账户（用户ID）
+            amount: 转入用户账户的金额（分），负数为转出
+            contra: 对方系统账户
+            memo: 摘要
+            ref: 关联单号
+            floor: 余额下限，记账后余额低于该值时拒绝（如扣款时传 0）
+
+        Returns:
+            记账后的余额（分），被拒绝时返回 None
+        """
+        created_us = now_micros()
+        shard = self._shard(account)
+        with shard.lock:
+            balance = shard.accounts.get(account, 0) + amount
+            if floor is not None and balance < floor:
+                return None
+            shard.accounts[account] = balance
+            shard.system[contra] = shard.system.get(contra, 0) - amount
+            # 在账户锁内写入，同一账户的分录顺序与记账顺序一致
+            if self.storage:
+                self.storage.append_ledger(account, contra, amount, created_us, memo, ref)
+            else:
+                self._journal.append(LedgerEntry(len(self._journal) + 1, account, contra, amount,
+                                                 created_us, memo, ref))
+
+        self.appends += 1
+        self._unflushed = True
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_interval:
+            self.snapshot()
+        return balance
+
+    def snapshot(self):
+        """保存余额快照"""
+        self._since_snapshot = 0
+        if self.storage:
+            self.storage.snapshot_ledger()
+
+    def sync(self) -> List[int]:
+        """应用其他进程追加的分录
+
+        Returns:
+            余额有变化的用户账户
+        """
+        if not self.storage:
+            return []
+        changed = []
+        with self._sync_lock:
+            # 先读最新序号：本进程的分录不会出现在结果中，游标也要越过它们
+            latest = self.storage.last_ledger_seq()
+            while True:
+                rows = self.storage.load_ledger_since(self._last_seq, SYNC_BATCH)
+                for seq, account, contra, amount in rows:
+                    shard = self._shard(account)
+                    with shard.lock:
+                        shard.accounts[account] = shard.accounts.get(account, 0) + amount
+                        shard.system[contra] = shard.system.get(contra, 0) - amount
+                    changed.append(account)
+                    self._last_seq = seq
+                if len(rows) < SYNC_BATCH:
+                    break
+            self._last_seq = max(self._last_seq, latest)
+        return list(dict.fromkeys(changed))
+
+    def statement(self, account: int, start_us: int, end_us: int, limit: int = 1000) -> Statement:
+        """账户在 [start_us, end_us) 内的对账单（按时间范围读取分录）
+
+        分录超过 limit 条时只返回前 limit 条，期末余额为期初余额加上返回的分录。
+        """
+        if self.storage:
+            # 读取前提交本进程尚未写入的分录
+            if self._unflushed:
+                self._unflushed = False
+                self.storage.flush()
+            opening = self.storage.ledger_balance_before(account, start_us)
+            entries = [LedgerEntry(*row) for row in self.storage.load_ledger_range(account, start_us, end_us, limit)]
+        else:
+            opening = sum(entry.amount for entry in self._journal
+                          if entry.account == account and entry.created_us < start_us)
+            entries = [entry for entry in self._journal
+                       if entry.account == account and start_us <= entry.created_us < end_us][:limit]
+        return Statement(account, opening, opening + sum(entry.amount for entry in entries), entries)
@@ -1,18 +1,23 @@
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 from enum import Enum
 import uuid
 import json
+from bisect import bisect_right
+from store.compact import (IdMap, SlottedRecord, id_property, intern, micros_property, new_id,
+                           now_micros, pack_id, to_micros, unpack_id)
+from store.indexes import TimeOrderedIndex
+from store.ledger import Ledger
+from store.money import ZERO, Money, MoneyLike, basis_points, cents_of, money_property
+from store.quotas import ActivityQuotas
+from store.tiers import LevelBenefits, MemberLevel, TierTable, activate_tiers, active_tiers
 
-class MemberLevel(Enum):
-    """会员等级"""
-    BRONZE = "bronze"      # 青铜会员
-    SILVER = "silver"      # 白银会员
-    GOLD = "gold"          # 黄金会员
-    PLATINUM = "platinum"  # 铂金会员
-    DIAMOND = "diamond"    # 钻石会员
-    SUPREME = "supreme"    # 至尊会员
+# 会员等级表在持久化存储中的配置键
+TIERS_SETTING = 'member_tiers'
+
+# 充值订单有效期（微秒）
+RECHARGE_TTL_US = 3600 * 10 ** 6
 
 class RechargeActivityType(Enum):
     """充值活动类型"""
@@ -21,98 +26,110 @@ class RechargeActivityType(Enum):
     FIRST_TIME = "first_time"  # 首充优惠
     LEVEL_UP = "level_up"  # 升级奖励
 
-@dataclass
-class User:
+class User(SlottedRecord):
     """用户信息"""
+    __slots__ = ('user_id', 'username', 'first_name', 'last_name', 'balance_cents', 'level', 'recharged_cents',
+                 'spent_cents', 'created_us', 'last_active_us', 'is_active', 'referrer_id', 'referral_code')
     user_id: int                    # Telegram用户ID
     username: str                   # 用户名
     first_name: str                 # 名字
-    last_name: Optional[str] = None # 姓氏
-    balance: float = 0.0            # 账户余额（CNY）
-    level: MemberLevel = MemberLevel.BRONZE  # 会员等级
-    total_recharged: float = 0.0    # 累计充值金额
-    total_spent: float = 0.0        # 累计消费金额
-    created_at: datetime = field(default_factory=datetime.now)
-    last_active: datetime = field(default_factory=datetime.now)
-    is_active: bool = True          # 账户状态
-    referrer_id: Optional[int] = None  # 推荐人ID
-    referral_code: str = field(default_factory=lambda: str(uuid.uuid4())[:8])  # 推荐码
-    
-    def get_level_benefits(self) -> Dict:
-        """获取会员等级权益"""
-        benefits = {
-            MemberLevel.BRONZE: {
-                "discount": 0.0,
-                "recharge_bonus": 0.0,
-                "name": "青铜会员",
-                "emoji": "🥉"
-            },
-            MemberLevel.SILVER: {
-                "discount": 0.05,
-                "recharge_bonus": 0.02,
-                "name": "白银会员",
-                "emoji": "🥈"
-            },
-            MemberLevel.GOLD: {
-                "discount": 0.10,
-                "recharge_bonus": 0.05,
-                "name": "黄金会员",
-                "emoji": "🥇"
-            },
-            MemberLevel.PLATINUM: {
-                "discount": 0.15,
-                "recharge_bonus": 0.08,
-                "name": "铂金会员",
-                "emoji": "💎"
-            },
-            MemberLevel.DIAMOND: {
-                "discount": 0.20,
-                "recharge_bonus": 0.10,
-                "name": "钻石会员",
-                "emoji": "💍"
-            },
-            MemberLevel.SUPREME: {
-                "discount": 0.25,
-                "recharge_bonus": 0.15,
-                "name": "至尊会员",
-                "emoji": "👑"
-            }
-        }
-        return benefits.get(self.level, benefits[MemberLevel.BRONZE])
+    last_name: Optional[str]        # 姓氏
+    balance: Money                  # 账户余额（CNY）
+    level: MemberLevel              # 会员等级
+    total_recharged: Money          # 累计充值金额
+    total_spent: Money              # 累计消费金额
+    created_at: datetime
+    last_active: datetime
+    is_active: bool                 # 账户状态
+    referrer_id: Optional[int]      # 推荐人ID
+    referral_code: str              # 推荐码
+    
+    def __init__(self, user_id: int, username: str, first_name: str, last_name: Optional[str] = None,
+                 balance: MoneyLike = ZERO, level: MemberLevel = MemberLevel.BRONZE,
+                 total_recharged: MoneyLike = ZERO, total_spent: MoneyLike = ZERO, created_at: Optional[datetime] = None,
+                 last_active: Optional[datetime] = None, is_active: bool = True,
+                 referrer_id: Optional[int] = None, referral_code: Optional[str] = None):
+        now = now_micros()
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.balance_cents = cents_of(balance)
+        self.level = level
+        self.recharged_cents = cents_of(total_recharged)
+        self.spent_cents = cents_of(total_spent)
+        self.created_us = now if created_at is None else to_micros(created_at)
+        self.last_active_us = now if last_active is None else to_micros(last_active)
+        self.is_active = is_active
+        self.referrer_id = referrer_id
+        self.referral_code = str(uuid.uuid4())[:8] if referral_code is None else referral_code
+    
+    balance = money_property('balance_cents', "账户余额")
+    total_recharged = money_property('recharged_cents', "累计充值金额")
+    total_spent = money_property('spent_cents', "累计消费金额")
+    created_at = micros_property('created_us', "注册时间")
+    last_active = micros_property('last_active_us', "最后活跃时间")
+    
+    def get_level_benefits(self) -> LevelBenefits:
+        """获取会员等级权益（当前等级表中预先构建的只读对象）"""
+        return active_tiers().benefits(self.level)
     
     def update_level(self):
         """根据累计充值金额更新会员等级"""
-        if self.total_recharged >= 30000:
-            self.level = MemberLevel.SUPREME
-        elif self.total_recharged >= 10000:
-            self.level = MemberLevel.DIAMOND
-        elif self.total_recharged >= 5000:
-            self.level = MemberLevel.PLATINUM
-        elif self.total_recharged >= 2000:
-            self.level = MemberLevel.GOLD
-        elif self.total_recharged >= 500:
-            self.level = MemberLevel.SILVER
-        else:
-            self.level = MemberLevel.BRONZE
+        self.level = active_tiers().level_for(self.total_recharged)
 
-@dataclass
-class RechargeRecord:
+class RechargeRecord(SlottedRecord):
     """充值记录"""
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: int = 0
-    amount: float = 0.0             # 充值金额（CNY）
-    bonus_amount: float = 0.0       # 赠送金额
-    payment_method: str = ""        # 支付方式
-    payment_order_id: str = ""      # 支付订单ID
-    status: str = "pending"         # pending, paid, failed, expired
-    activity_id: Optional[str] = None  # 参与的活动ID
-    created_at: datetime = field(default_factory=datetime.now)
-    paid_at: Optional[datetime] = None
-    expires_at: datetime = field(default_factory=lambda: datetime.now() + timedelta(hours=1))
+    __slots__ = ('key', 'user_id', 'amount_cents', 'bonus_cents', 'payment_method', '_payment_order', '_status',
+                 'activity_id', 'created_us', 'paid_us', 'expires_us')
+    id: str
+    user_id: int
+    amount: Money                   # 充值金额（CNY）
+    bonus_amount: Money             # 赠送金额
+    payment_method: str             # 支付方式
+    payment_order_id: str           # 支付订单ID
+    status: str                     # pending, paid, failed, expired
+    activity_id: Optional[str]      # 参与的活动ID
+    created_at: datetime
+    paid_at: Optional[datetime]
+    expires_at: datetime
+    
+    def __init__(self, id: Optional[str] = None, user_id: int = 0, amount: MoneyLike = ZERO,
+                 bonus_amount: MoneyLike = ZERO, payment_method: str = "", payment_order_id: str = "",
+                 status: str = "pending", activity_id: Optional[str] = None,
+                 created_at: Optional[datetime] = None, paid_at: Optional[datetime] = None,
+                 expires_at: Optional[datetime] = None):
+        self.key = new_id() if id is None else pack_id(id)
+        self.user_id = user_id
+        self.amount_cents = cents_of(amount)
+        self.bonus_cents = cents_of(bonus_amount)
+        self.payment_method = intern(payment_method)
+        self._payment_order = pack_id(payment_order_id)
+        self._status = intern(status)
+        self.activity_id = intern(activity_id)
+        self.created_us = now_micros() if created_at is None else to_micros(created_at)
+        self.paid_us = to_micros(paid_at)
+        self.expires_us = self.created_us + RECHARGE_TTL_US if expires_at is None else to_micros(expires_at)
+    
+    id = id_property('key', "充值记录ID")
+    amount = money_property('amount_cents', "充值金额")
+    bonus_amount = money_property('bonus_cents', "赠送金额")
+    payment_order_id = id_property('_payment_order', "支付订单ID")
+    created_at = micros_property('created_us', "创建时间")
+    paid_at = micros_property('paid_us', "支付时间")
+    expires_at = micros_property('expires_us', "过期时间")
+    
+    @property
+    def status(self) -> str:
+        return self._status
+    
+    @status.setter
+    def status(self, value: str):
+        self._status = intern(value)
     
     def is_expired(self) -> bool:
         """检查是否过期"""
-        return datetime.now() > self.expires_at and self.status == "pending"
+        return self._status == "pending" and now_micros() > self.expires_us
 
 @dataclass
 class RechargeActivity:
@@ -121,68 +138,226 @@ class RechargeActivity:
     name: str = ""                  # 活动名称
     description: str = ""           # 活动描述
     activity_type: RechargeActivityType = RechargeActivityType.BONUS
-    min_amount: float = 0.0         # 最低充值金额
-    max_amount: Optional[float] = None  # 最高充值金额
+    min_amount: Money = ZERO        # 最低充值金额
+    max_amount: Optional[Money] = None  # 最高充值金额
     bonus_rate: float = 0.0         # 赠送比例（如0.1表示10%）
     discount_rate: float = 0.0      # 折扣比例（如0.1表示9折）
-    fixed_bonus: float = 0.0        # 固定赠送金额
+    fixed_bonus: Money = ZERO       # 固定赠送金额
     start_time: datetime = field(default_factory=datetime.now)
     end_time: datetime = field(default_factory=lambda: datetime.now() + timedelta(days=7))
     is_active: bool = True          # 活动状态
-    max_participants: Optional[int] = None  # 最大参与人数
-    current_participants: int = 0   # 当前参与人数
+    max_participants: Optional[int] = None  # 最大参与人数（参与人数由 ActivityQuotas 按充值记录统计）
     user_limit: int = 1             # 每用户参与次数限制
     level_requirement: Optional[MemberLevel] = None  # 会员等级要求
     
-    def is_valid(self) -> bool:
-        """检查活动是否有效"""
-        now = datetime.now()
-        return (self.is_active and 
-                self.start_time <= now <= self.end_time and
-                (self.max_participants is None or self.current_participants < self.max_participants))
+    def __post_init__(self):
+        # 金额也可以按元给出（数字或字符串）
+        self.min_amount = Money.of(self.min_amount)
+        if self.max_amount is not None:
+            self.max_amount = Money.of(self.max_amount)
+        self.fixed_bonus = Money.of(self.fixed_bonus)
     
-    def calculate_bonus(self, amount: float) -> float:
-        """计算充值奖励"""
-        if not self.is_valid() or amount < self.min_amount:
-            return 0.0
+    def is_valid(self, now: Optional[datetime] = None) -> bool:
+        """检查活动是否已启用且在活动时间内（名额由 ActivityQuotas 检查）
         
+        Args:
+            now: 当前时间，不传时读取系统时间
+        """
+        if now is None:
+            now = datetime.now()
+        return self.is_active and self.start_time <= now <= self.end_time
+    
+    def bonus_for(self, amount: Money) -> Money:
+        """按活动规则计算奖励（调用方已确认活动有效且金额达到最低要求），四舍五入到分"""
         if self.max_amount and amount > self.max_amount:
             amount = self.max_amount
         
         if self.activity_type == RechargeActivityType.BONUS:
-            return amount * self.bonus_rate + self.fixed_bonus
+            return amount.at_rate(basis_points(self.bonus_rate)) + self.fixed_bonus
         elif self.activity_type == RechargeActivityType.DISCOUNT:
-            return amount * self.discount_rate
+            return amount.at_rate(basis_points(self.discount_rate))
         elif self.activity_type == RechargeActivityType.FIRST_TIME:
-            return amount * self.bonus_rate + self.fixed_bonus
+            return amount.at_rate(basis_points(self.bonus_rate)) + self.fixed_bonus
         
-        return 0.0
+        return ZERO
 
-@dataclass
-class BalanceTransaction:
+class ActivityIndex:
+    """充值活动索引
+    
+    所有活动的开始时间和结束时间把时间轴切分为若干时间段，同一时间段内进行中的
+    活动集合不变。只缓存当前时间段的候选活动，当前时间越过下一个边界时重新计算。
+    时间段内的活动按 (会员等级序号, 是否可参加首充活动) 分桶，桶内按最低充值金额（分）
+    排序，匹配一笔充值时二分定位金额达到要求的活动，不再逐个检查全部活动。
+    
+    活动的时间、金额、类型或等级要求变化后需要调用 rebuild；启用状态、参与人数
+    在匹配时检查，变化后不需要重建。
+    """
+    
+    def __init__(self):
+        self._windows: List[Tuple[int, int, int, RechargeActivity]] = []  # (开始, 结束, 加入顺序, 活动)
+        self._boundaries: List[int] = []
+        # 当前时间段：(起点, 终点, 等级表, 进行中的活动, 分桶)，整体替换，读取时无需加锁
+        self._segment: Optional[Tuple] = None
+    
+    def rebuild(self, activities):
+        """按活动列表（按加入顺序）重建索引"""
+        windows = [(to_micros(activity.start_time), to_micros(activity.end_time), position, activity)
+                   for position, activity in enumerate(activities)]
+        # 结束时间当时仍然有效，结束后的下一微秒才是边界
+        boundaries = {start for start, _, _, _ in windows} | {end + 1 for _, end, _, _ in windows}
+        self._windows = windows
+        self._boundaries = sorted(boundaries)
+        self._segment = None
+    
+    def _current(self, now: int) -> Tuple:
+        segment = self._segment
+        tiers = active_tiers()
+        if segment is not None and segment[0] <= now < segment[1] and segment[2] is tiers:
+            return segment
+        
+        index = bisect_right(self._boundaries, now)
+        lower = self._boundaries[index - 1] if index > 0 else -1
+        upper = self._boundaries[index] if index < len(self._boundaries) else float('inf')
+        live = [(position, activity) for start, end, position, activity in self._windows if start <= now <= end]
+        
+        buckets = {}
+        for rank in range(len(tiers.levels)):
+            for first_time in (False, True):
+                entries = sorted(
+                    ((activity.min_amount.cents, position, activity) for position, activity in live
+                     if tiers.rank(activity.level_requirement) <= rank
+                     and (first_time or activity.activity_type != RechargeActivityType.FIRST_TIME)),
+                    key=lambda entry: entry[:2]
+                )
+                buckets[(rank, first_time)] = ([entry[0] for entry in entries],
+                                               [entry[1:] for entry in entries])
+        
+        segment = (lower, upper, tiers, live, buckets)
+        self._segment = segment
+        return segment
+    
+    def live(self, now: int) -> List[Tuple[int, RechargeActivity]]:
+        """时间窗口包含 now（微秒）的活动 (加入顺序, 活动)"""
+        return self._current(now)[3]
+    
+    def candidates(self, now: int, level: MemberLevel, first_time: bool,
+                   amount: Money) -> List[Tuple[int, RechargeActivity]]:
+        """时间、会员等级、首充条件和最低金额都满足的活动 (加入顺序, 活动)
+        
+        Args:
+            now: 当前时间（微秒）
+            level: 用户的会员等级
+            first_time: 用户是否可参加首充活动
+            amount: 充值金额
+        """
+        segment = self._current(now)
+        minimums, entries = segment[4][(segment[2].rank(level), first_time)]
+        return entries[:bisect_right(minimums, amount.cents)]
+
+class BalanceTransaction(SlottedRecord):
     """余额变动记录"""
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: int = 0
-    amount: float = 0.0             # 变动金额（正数为增加，负数为减少）
-    balance_before: float = 0.0     # 变动前余额
-    balance_after: float = 0.0      # 变动后余额
-    transaction_type: str = ""      # recharge, purchase, refund, bonus, admin
-    description: str = ""           # 变动描述
-    related_order_id: Optional[str] = None  # 关联订单ID
-    created_at: datetime = field(default_factory=datetime.now)
+    __slots__ = ('key', 'user_id', 'amount_cents', 'before_cents', 'after_cents', 'transaction_type',
+                 'description', '_related_order', 'created_us')
+    id: str
+    user_id: int
+    amount: Money                   # 变动金额（正数为增加，负数为减少）
+    balance_before: Money           # 变动前余额
+    balance_after: Money            # 变动后余额
+    transaction_type: str           # recharge, purchase, refund, bonus, admin
+    description: str                # 变动描述
+    related_order_id: Optional[str] # 关联订单ID
+    created_at: datetime
+    
+    def __init__(self, id: Optional[str] = None, user_id: int = 0, amount: MoneyLike = ZERO,
+                 balance_before: MoneyLike = ZERO, balance_after: MoneyLike = ZERO, transaction_type: str = "",
+                 description: str = "", related_order_id: Optional[str] = None,
+                 created_at: Optional[datetime] = None):
+        self.key = new_id() if id is None else pack_id(id)
+        self.user_id = user_id
+        self.amount_cents = cents_of(amount)
+        self.before_cents = cents_of(balance_before)
+        self.after_cents = cents_of(balance_after)
+        self.transaction_type = intern(transaction_type)
+        self.description = description
+        self._related_order = pack_id(related_order_id)
+        self.created_us = now_micros() if created_at is None else to_micros(created_at)
+    
+    id = id_property('key', "余额变动记录ID")
+    amount = money_property('amount_cents', "变动金额")
+    balance_before = money_property('before_cents', "变动前余额")
+    balance_after = money_property('after_cents', "变动后余额")
+    related_order_id = id_property('_related_order', "关联订单ID")
+    created_at = micros_property('created_us', "变动时间")
 
 class MemberSystem:
     """会员系统管理类"""
     
-    def __init__(self):
+    def __init__(self, storage=None):
+        """
+        Args:
+            storage: 可选的持久化存储（如 SQLiteStorage），提供时从中热启动
+        """
+        self.storage = storage
         self.users: Dict[int, User] = {}  # 用户数据
-        self.recharge_records: Dict[str, RechargeRecord] = {}  # 充值记录
+        self.recharge_records: Dict[str, RechargeRecord] = IdMap()  # 充值记录
         self.activities: Dict[str, RechargeActivity] = {}  # 充值活动
-        self.transactions: Dict[str, BalanceTransaction] = {}  # 余额变动记录
-        self.user_activity_count: Dict[tuple, int] = {}  # 用户参与活动次数统计
+        self.transactions: Dict[str, BalanceTransaction] = IdMap()  # 余额变动记录
+        self.activity_index = ActivityIndex()  # 按时间段、等级、首充条件和最低金额索引的活动
+        self.quotas = ActivityQuotas()  # 活动名额（待支付和已完成的充值占用）
+        self.ledger = Ledger(storage)  # 余额账本（余额以账本为准）
+        # 索引按紧凑的时间戳和ID排序、定位，不为每条记录创建 datetime 和ID字符串
+        self.user_transactions = TimeOrderedIndex('created_us', 'key')  # 用户ID -> 余额变动记录（按时间排序）
+        self.user_recharges = TimeOrderedIndex('created_us', 'key')  # 用户ID -> 充值记录（按时间排序）
+        self.on_recharge_created: Optional[Callable[[RechargeRecord], None]] = None  # 新充值记录回调
         
         # 初始化默认活动
         self._init_default_activities()
+        self.activity_index.rebuild(self.activities.values())
+        
+        if self.storage:
+            self._warm_start()
+    
+    def _warm_start(self):
+        """从持久化存储恢复会员数据"""
+        activities = list(self.storage.load_activities())
+        if activities:
+            self.activities = {activity.id: activity for activity in activities}
+        else:
+            for activity in self.activities.values():
+                self.storage.save_activity(activity)
+        
+        self.ledger.load()
+        for user in self.storage.load_users():
+            self.users[user.user_id] = user
+            self._apply_ledger_balance(user)
+        
+        for transaction in self.storage.load_transactions():
+            self.transactions[transaction.key] = transaction
+            self.user_transactions.add(transaction.user_id, transaction)
+        
+        for record in self.storage.load_recharge_records():
+            self.recharge_records[record.key] = record
+            self.user_recharges.add(record.user_id, record)
+        
+        self.activity_index.rebuild(self.activities.values())
+        self.quotas.rebuild((record.activity_id, record.user_id, record.status)
+                            for record in self.recharge_records.values())
+        self._load_tiers()
+    
+    def _load_tiers(self):
+        """启用存储中保存的会员等级表（没有保存时使用默认等级表）"""
+        config = self.storage.load_setting(TIERS_SETTING)
+        activate_tiers(TierTable.from_config(config) if config else None)
+    
+    def set_member_tiers(self, table: Optional[TierTable]):
+        """修改会员等级表（None 恢复默认），立即生效并保存
+        
+        共享同一数据库的其他进程在下次同步时启用新等级表。用户的等级在下次充值时
+        按新门槛重新计算；权益（折扣、赠送比例、名称）对所有用户立即生效。
+        """
+        activate_tiers(table)
+        if self.storage:
+            self.storage.save_setting(TIERS_SETTING, table.to_config() if table else None)
     
     def _init_default_activities(self):
         """初始化默认充值活动"""
@@ -191,8 +366,8 @@ class MemberSystem:
             name="首充双倍",
             description="首次充值享受100%赠送，充100送100！",
             activity_type=RechargeActivityType.FIRST_TIME,
-            min_amount=50.0,
-            max_amount=500.0,
+            min_amount=Money(50),
+            max_amount=Money(500),
             bonus_rate=1.0,
             end_time=datetime.now() + timedelta(days=365),
             user_limit=1
@@ -204,7 +379,7 @@ class MemberSystem:
             name="充值赠送",
             description="充值满100元赠送10%，多充多送！",
             activity_type=RechargeActivityType.BONUS,
-            min_amount=100.0,
+            min_amount=Money(100),
             bonus_rate=0.1,
             end_time=datetime.now() + timedelta(days=30),
             user_limit=10
@@ -216,7 +391,7 @@ class MemberSystem:
             name="VIP充值优惠",
             description="黄金及以上会员充值享受5%折扣！",
             activity_type=RechargeActivityType.DISCOUNT,
-            min_amount=200.0,
+            min_amount=Money(200),
             discount_rate=0.05,
             level_requirement=MemberLevel.GOLD,
             end_time=datetime.now() + timedelta(days=60)
@@ -226,8 +401,9 @@ class MemberSystem:
     def register_user(self, user_id: int, username: str, first_name: str, 
                      last_name: Optional[str] = None, referrer_id: Optional[int] = None) -> User:
         """注册新用户"""
-        if user_id in self.users:
-            return self.users[user_id]
+        existing = self.get_user(user_id)
+        if existing:
+            return existing
         
         user = User(
             user_id=user_id,
@@ -238,143 +414,200 @@ class MemberSystem:
         )
         
         self.users[user_id] = user
+        if self.storage:
+            self.storage.save_user(user)
         
         # 推荐奖励
-        if referrer_id and referrer_id in self.users:
+        if referrer_id and self.get_user(referrer_id):
             self._add_referral_bonus(referrer_id, user_id)
         
         return user
     
     def get_user(self, user_id: int) -> Optional[User]:
-        """获取用户信息"""
-        return self.users.get(user_id)
+        """获取用户信息（缓存未命中时从持久化存储读取）"""
+        user = self.users.get(user_id)
+        if user is None and self.storage:
+            user = self.storage.load_user(user_id)
+            if user:
+                self._apply_ledger_balance(user)
+                self.users[user_id] = user
+        return user
+    
+    def _apply_ledger_balance(self, user: User):
+        """以账本余额为准设置用户余额（账本启用前的余额已由存储记为期初余额分录）"""
+        if self.ledger.has_account(user.user_id):
+            user.balance_cents = self.ledger.balance(user.user_id)
+    
+    def sync_balances(self) -> int:
+        """应用其他进程追加的余额分录，刷新缓存中的用户余额
+        
+        Returns:
+            余额有变化的用户数
+        """
+        changed = self.ledger.sync()
+        for user_id in changed:
+            user = self.users.get(user_id)
+            if user:
+                user.balance_cents = self.ledger.balance(user_id)
+        return len(changed)
     
     def _add_referral_bonus(self, referrer_id: int, new_user_id: int):
         """添加推荐奖励"""
-        referrer = self.users.get(referrer_id)
+        referrer = self.get_user(referrer_id)
         if referrer:
-            bonus_amount = 10.0  # 推荐奖励10元
+            bonus_amount = Money(10)  # 推荐奖励10元
             self.add_balance(referrer_id, bonus_amount, "referral", 
                            f"推荐用户 {new_user_id} 注册奖励")
     
-    def add_balance(self, user_id: int, amount: float, transaction_type: str, 
+    def add_balance(self, user_id: int, amount: MoneyLike, transaction_type: str, 
                    description: str, related_order_id: Optional[str] = None) -> bool:
         """增加用户余额"""
-        user = self.users.get(user_id)
+        user = self.get_user(user_id)
         if not user:
             return False
         
-        balance_before = user.balance
-        user.balance += amount
-        balance_after = user.balance
+        amount = Money.of(amount)
+        balance = self.ledger.post(user_id, amount.cents, transaction_type, description, related_order_id)
+        user.balance_cents = balance
         
         # 记录余额变动
         transaction = BalanceTransaction(
             user_id=user_id,
             amount=amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
+            balance_before=Money.from_cents(balance - amount.cents),
+            balance_after=Money.from_cents(balance),
             transaction_type=transaction_type,
             description=description,
             related_order_id=related_order_id
         )
         
-        self.transactions[transaction.id] = transaction
+        self.transactions[transaction.key] = transaction
+        self.user_transactions.add(user_id, transaction)
+        if self.storage:
+            self.storage.save_user(user)
+            self.storage.save_transaction(transaction)
         return True
     
-    def deduct_balance(self, user_id: int, amount: float, transaction_type: str, 
+    def deduct_balance(self, user_id: int, amount: MoneyLike, transaction_type: str, 
                       description: str, related_order_id: Optional[str] = None) -> bool:
         """扣除用户余额"""
-        user = self.users.get(user_id)
-        if not user or user.balance < amount:
+        user = self.get_user(user_id)
+        if not user:
             return False
         
-        balance_before = user.balance
-        user.balance -= amount
-        user.total_spent += amount
-        balance_after = user.balance
+        # 余额检查和扣减在账户锁内完成
+        amount = Money.of(amount)
+        balance = self.ledger.post(user_id, -amount.cents, transaction_type, description, related_order_id, floor=0)
+        if balance is None:
+            return False
+        user.balance_cents = balance
+        user.spent_cents += amount.cents
         
         # 记录余额变动
         transaction = BalanceTransaction(
             user_id=user_id,
             amount=-amount,
-            balance_before=balance_before,
-            balance_after=balance_after,
+            balance_before=Money.from_cents(balance + amount.cents),
+            balance_after=Money.from_cents(balance),
             transaction_type=transaction_type,
             description=description,
             related_order_id=related_order_id
         )
         
-        self.transactions[transaction.id] = transaction
+        self.transactions[transaction.key] = transaction
+        self.user_transactions.add(user_id, transaction)
+        if self.storage:
+            self.storage.save_user(user)
+            self.storage.add_user_totals(user_id, spent=amount.cents)
+            self.storage.save_transaction(transaction)
         return True
     
-    def create_recharge_order(self, user_id: int, amount: float, payment_method: str) -> Optional[RechargeRecord]:
+    def create_recharge_order(self, user_id: int, amount: MoneyLike, payment_method: str) -> Optional[RechargeRecord]:
         """创建充值订单"""
-        user = self.users.get(user_id)
+        user = self.get_user(user_id)
         if not user:
             return None
         
-        # 查找适用的活动
-        best_activity = self._find_best_activity(user_id, amount)
-        bonus_amount = 0.0
-        activity_id = None
-        
-        if best_activity:
-            bonus_amount = best_activity.calculate_bonus(amount)
-            activity_id = best_activity.id
+        # 占用最优活动的名额（有名额时充值记录已随名额一起写入存储）
+        amount = Money.of(amount)
+        record = self._reserve_best_activity(user, amount, payment_method)
+        if record is None:
+            record = RechargeRecord(user_id=user_id, amount=amount, payment_method=payment_method)
+            if self.storage:
+                self.storage.save_recharge_record(record)
         
-        # 创建充值记录
-        record = RechargeRecord(
-            user_id=user_id,
-            amount=amount,
-            bonus_amount=bonus_amount,
-            payment_method=payment_method,
-            activity_id=activity_id
-        )
-        
-        self.recharge_records[record.id] = record
+        self.recharge_records[record.key] = record
+        self.user_recharges.add(user_id, record)
+        if self.on_recharge_created:
+            self.on_recharge_created(record)
         return record
     
-    def _find_best_activity(self, user_id: int, amount: float) -> Optional[RechargeActivity]:
-        """找到最优充值活动"""
-        user = self.users.get(user_id)
+    def get_best_activity(self, user_id: int, amount: MoneyLike) -> Optional[RechargeActivity]:
+        """用户本次充值奖励最高、仍有名额的活动（只预览，不占用名额；创建订单时按同样规则选择）"""
+        return self._find_best_activity(user_id, amount)
+    
+    def _find_best_activity(self, user_id: int, amount: MoneyLike) -> Optional[RechargeActivity]:
+        """找到最优充值活动（奖励相同时取先加入的活动）"""
+        user = self.get_user(user_id)
         if not user:
             return None
         
+        amount = Money.of(amount)
         best_activity = None
-        best_bonus = 0.0
+        best_bonus = ZERO
+        best_position = 0
         
-        for activity in self.activities.values():
-            if not activity.is_valid():
-                continue
-            
-            # 检查会员等级要求
-            if activity.level_requirement and user.level.value < activity.level_requirement.value:
-                continue
-            
-            # 检查用户参与次数限制
-            user_count = self.user_activity_count.get((user_id, activity.id), 0)
-            if user_count >= activity.user_limit:
-                continue
-            
-            # 检查首充活动
-            if activity.activity_type == RechargeActivityType.FIRST_TIME and user.total_recharged > 0:
-                continue
-            
-            bonus = activity.calculate_bonus(amount)
-            if bonus > best_bonus:
+        for position, activity in self._match_activities(user, amount):
+            bonus = activity.bonus_for(amount)
+            if bonus > best_bonus or (best_activity and bonus == best_bonus and position < best_position):
                 best_bonus = bonus
                 best_activity = activity
+                best_position = position
         
         return best_activity
     
+    def _reserve_best_activity(self, user: User, amount: Money, payment_method: str) -> Optional[RechargeRecord]:
+        """按奖励从高到低尝试占用活动名额，返回占用了名额的充值记录
+        
+        候选活动的名额检查不加锁，并发创建订单时可能已被占满，此时改用次优活动。
+        本地名额只是缓存（其他进程的充值同步前不可见）：有存储时以数据库中的条件写入为准，
+        写入失败说明名额已被其他进程占满，归还本地名额后改用次优活动。
+        """
+        ranked = []
+        for position, activity in self._match_activities(user, amount):
+            bonus = activity.bonus_for(amount).cents
+            if bonus > 0:
+                ranked.append((-bonus, position, activity))
+        ranked.sort(key=lambda entry: entry[:2])
+        for _, _, activity in ranked:
+            if not self.quotas.reserve(activity, user.user_id):
+                continue
+            record = RechargeRecord(user_id=user.user_id, amount=amount, bonus_amount=activity.bonus_for(amount),
+                                    payment_method=payment_method, activity_id=activity.id)
+            if not self.storage or self.storage.reserve_recharge(record, activity):
+                return record
+            self.quotas.release(activity.id, user.user_id)
+        return None
+    
+    def _match_activities(self, user: User, amount: Money) -> List[Tuple[int, RechargeActivity]]:
+        """用户本次充值可参加的活动 (加入顺序, 活动)
+        
+        从活动索引取出时间、等级、首充条件和最低金额都满足的候选活动，
+        再检查启用状态和名额（活动总名额、用户参与次数，均包含待支付的充值）；
+        整个匹配只读取一次时间。
+        """
+        candidates = self.activity_index.candidates(now_micros(), user.level, user.recharged_cents <= 0, amount)
+        user_id = user.user_id
+        return [(position, activity) for position, activity in candidates
+                if activity.is_active and self.quotas.has_room(activity, user_id)]
+    
     def complete_recharge(self, record_id: str, payment_order_id: str) -> bool:
         """完成充值"""
         record = self.recharge_records.get(record_id)
         if not record or record.status != "pending":
             return False
         
-        user = self.users.get(record.user_id)
+        user = self.get_user(record.user_id)
         if not user:
             return False
         
@@ -389,60 +622,136 @@ class MemberSystem:
                         f"充值 {record.amount} 元，赠送 {record.bonus_amount} 元")
         
         # 更新用户统计
-        user.total_recharged += record.amount
+        user.recharged_cents += record.amount_cents
         user.update_level()
         
-        # 更新活动参与统计
-        if record.activity_id:
-            activity = self.activities.get(record.activity_id)
-            if activity:
-                activity.current_participants += 1
-                key = (record.user_id, record.activity_id)
-                self.user_activity_count[key] = self.user_activity_count.get(key, 0) + 1
+        # 活动名额在创建充值订单时已占用（ActivityQuotas），完成充值时不再变化
+        
+        if self.storage:
+            self.storage.save_recharge_record(record)
+            # 累计充值按增量写入，等级按数据库中累加后的金额计算（缓存中的累计充值可能不是最新的）
+            self.storage.add_user_totals(record.user_id, recharged=record.amount_cents, tiers=active_tiers())
+        
+        return True
+    
+    def get_recharge_record(self, record_id: str) -> Optional[RechargeRecord]:
+        """获取充值记录"""
+        return self.recharge_records.get(record_id)
+    
+    def invalidate(self, entity: str, key: str):
+        """应用其他进程写入的变更
+        
+        用户直接从缓存中移除，下次访问时从存储读取；充值记录、余额变动和活动
+        在原对象上刷新（保持索引中的引用有效），新记录加入缓存和索引。
+        
+        Args:
+            entity: 变更实体类型
+            key: 实体主键
+        """
+        if not self.storage:
+            return
         
+        if entity == 'user':
+            self.users.pop(int(key), None)
+        
+        elif entity == 'transaction':
+            if key not in self.transactions:
+                transaction = self.storage.load_transaction(key)
+                if transaction:
+                    self.transactions[key] = transaction
+                    self.user_transactions.add(transaction.user_id, transaction)
+        
+        elif entity == 'recharge_record':
+            record = self.storage.load_recharge_record(key)
+            if not record:
+                return
+            cached = self.recharge_records.get(key)
+            previous = cached.status if cached else None
+            if cached:
+                cached.copy_from(record)
+            else:
+                self.recharge_records[key] = record
+                self.user_recharges.add(record.user_id, record)
+            self.quotas.update(record.activity_id, record.user_id, previous, record.status)
+        
+        elif entity == 'activity':
+            activity = self.storage.load_activity(key)
+            if not activity:
+                return
+            cached = self.activities.get(key)
+            if cached:
+                vars(cached).update(vars(activity))
+            else:
+                self.activities[key] = activity
+            self.activity_index.rebuild(self.activities.values())
+        
+        elif entity == 'setting':
+            if key == TIERS_SETTING:
+                self._load_tiers()
+    
+    def set_recharge_status(self, record_id: str, status: str) -> bool:
+        """更新待支付充值记录的状态（failed / expired）"""
+        record = self.recharge_records.get(record_id)
+        if not record or record.status != "pending":
+            return False
+        
+        record.status = status
+        if record.activity_id:
+            self.quotas.release(record.activity_id, record.user_id)
+        if self.storage:
+            self.storage.save_recharge_record(record)
         return True
     
     def get_user_recharge_history(self, user_id: int, limit: int = 10) -> List[RechargeRecord]:
         """获取用户充值历史"""
-        records = [r for r in self.recharge_records.values() if r.user_id == user_id]
-        records.sort(key=lambda x: x.created_at, reverse=True)
-        return records[:limit]
+        records, _ = self.user_recharges.latest(user_id, limit)
+        return records
+    
+    def get_user_recharge_page(self, user_id: int, limit: int = 10,
+                               cursor: Optional[str] = None) -> Tuple[List[RechargeRecord], Optional[str]]:
+        """分页获取用户充值历史（按时间倒序）
+        
+        Args:
+            user_id: 用户ID
+            limit: 每页条数
+            cursor: 上一页返回的游标
+            
+        Returns:
+            (充值记录列表, 下一页游标)
+        """
+        records, cursor = self.user_recharges.latest(user_id, limit, pack_id(cursor))
+        return records, unpack_id(cursor)
     
     def get_user_transactions(self, user_id: int, limit: int = 20) -> List[BalanceTransaction]:
         """获取用户余额变动记录"""
-        transactions = [t for t in self.transactions.values() if t.user_id == user_id]
-        transactions.sort(key=lambda x: x.created_at, reverse=True)
-        return transactions[:limit]
+        transactions, _ = self.user_transactions.latest(user_id, limit)
+        return transactions
+    
+    def get_user_transaction_page(self, user_id: int, limit: int = 20,
+                                  cursor: Optional[str] = None) -> Tuple[List[BalanceTransaction], Optional[str]]:
+        """分页获取用户余额变动记录（按时间倒序）
+        
+        Args:
+            user_id: 用户ID
+            limit: 每页条数
+            cursor: 上一页返回的游标
+            
+        Returns:
+            (余额变动记录列表, 下一页游标)
+        """
+        transactions, cursor = self.user_transactions.latest(user_id, limit, pack_id(cursor))
+        return transactions, unpack_id(cursor)
     
     def get_active_activities(self) -> List[RechargeActivity]:
         """获取当前有效的充值活动"""
-        return [a for a in self.activities.values() if a.is_valid()]
+        return [activity for _, activity in self.activity_index.live(now_micros())
+                if activity.is_active and not self.quotas.is_full(activity)]
     
-    def get_user_applicable_activities(self, user_id: int, amount: float) -> List[RechargeActivity]:
-        """获取用户可参与的充值活动"""
-        user = self.users.get(user_id)
+    def get_user_applicable_activities(self, user_id: int, amount: MoneyLike) -> List[RechargeActivity]:
+        """获取用户可参与的充值活动（按活动加入顺序）"""
+        user = self.get_user(user_id)
         if not user:
             return []
         
-        applicable = []
-        for activity in self.get_active_activities():
-            # 检查金额要求
-            if amount < activity.min_amount:
-                continue
-            
-            # 检查会员等级要求
-            if activity.level_requirement and user.level.value < activity.level_requirement.value:
-                continue
-            
-            # 检查用户参与次数限制
-            user_count = self.user_activity_count.get((user_id, activity.id), 0)
-            if user_count >= activity.user_limit:
-                continue
-            
-            # 检查首充活动
-            if activity.activity_type == RechargeActivityType.FIRST_TIME and user.total_recharged > 0:
-                continue
-            
-            applicable.append(activity)
-        
-        return applicable
\ No newline at end of file
+        return [activity for _, activity in sorted(self._match_activities(user, Money.of(amount)),
+                                                   key=lambda entry: entry[0])]
\ No newline at end of file
@@ -1,13 +1,15 @@
-from dataclasses import dataclass
-from decimal import Decimal
+from dataclasses import dataclass, field
 from enum import Enum
 from typing import List, Optional
 from datetime import datetime
 
+from .money import Money
+
 class PaymentStatus(Enum):
     PENDING = "pending"
     COMPLETED = "completed"
     FAILED = "failed"
+    REFUNDED = "refunded"  # 超时失败后才收到支付、商品已售完，已退款到余额
 
 class PaymentMethod(Enum):
     USDT = "usdt"
@@ -18,22 +20,29 @@ class Product:
     id: str
     name: str
     description: str
-    price: Decimal
+    price: Money
     image_url: Optional[str] = None
     stock: int = 0
 
+    def __post_init__(self):
+        # 价格也可以按元给出（字符串、Decimal 或数字）
+        self.price = Money.of(self.price)
+
 @dataclass
 class Order:
     id: str
     user_id: str
     products: List[Product]
-    total_amount: Decimal
+    total_amount: Money
     payment_method: PaymentMethod
     payment_status: PaymentStatus
-    created_at: datetime = datetime.now()
+    created_at: datetime = field(default_factory=datetime.now)
     completed_at: Optional[datetime] = None
     transaction_hash: Optional[str] = None
 
+    def __post_init__(self):
+        self.total_amount = Money.of(self.total_amount)
+
     @property
     def is_completed(self) -> bool:
         return self.payment_status == PaymentStatus.COMPLETED
\ No newline at end of file
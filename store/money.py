@@ -0,0 +1,203 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from operator import attrgetter
+from typing import Optional, Union
+
+# 金额最小单位：1 元 = 100 分
+MINOR_UNITS = 100
+# 比例的精度：1 = 10000 个基点（万分之一）
+BASIS_POINTS = 10000
+
+_HALF_POINT = BASIS_POINTS // 2
+_CENT = Decimal('0.01')
+# 绝对值小于该值（分）时，cents / 100 的浮点数按两位小数格式化结果精确
+_FLOAT_EXACT = 2 ** 52
+
+
+def _parse_cents(value) -> int:
+    """元（整数、浮点数、十进制字符串或 Decimal）-> 分，四舍五入"""
+    if value.__class__ is Money:
+        return value._cents
+    if isinstance(value, bool):
+        raise TypeError("金额不能是布尔值")
+    if isinstance(value, int):
+        return value * MINOR_UNITS
+    if isinstance(value, float):
+        if value != value or value in (float('inf'), float('-inf')):
+            raise ValueError(f"无效的金额: {value}")
+        return int(round(value * MINOR_UNITS))
+    if isinstance(value, str):
+        try:
+            value = Decimal(value.strip())
+        except InvalidOperation:
+            raise ValueError(f"无效的金额: {value!r}") from None
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            raise ValueError(f"无效的金额: {value}")
+        return int(value.quantize(_CENT, rounding=ROUND_HALF_UP).scaleb(2))
+    raise TypeError(f"无法转换为金额: {type(value).__name__}")
+
+
+_new = object.__new__
+
+
+def _from_cents(cents: int) -> 'Money':
+    """由整数分构造金额（不做解析）"""
+    money = _new(Money)
+    money._cents = cents
+    return money
+
+
+class Money:
+    """金额（人民币，定点数，以整数分保存）
+
+    - Money('15.99')、Money(10)、Money(9.9) 按元构造（与 Decimal 用法相同），
+      字符串和 Decimal 只在构造时解析一次；Money.from_cents 由整数分直接构造
+    - 加减、比较、乘以数量都是整数运算，结果精确；按比例计算（折扣、赠送）
+      用 at_rate，比例以整数基点表示，结果四舍五入到分
+    - 只能与 Money 相加减和比较大小，与浮点数或整数混用时抛出 TypeError，
+      避免元与分混淆；sum() 可直接对金额求和
+    - 格式化与原来的浮点金额相同（f"{amount:.2f}"），float(amount) 得到以元为单位的浮点数
+
+    创建后不可修改（cents 只读），可作为字典键和 dataclass 的默认值。
+    """
+
+    __slots__ = ('_cents',)
+
+    def __init__(self, value: 'MoneyLike' = 0):
+        self._cents = _parse_cents(value)
+
+    cents = property(attrgetter('_cents'), doc="整数分")
+
+    from_cents = staticmethod(_from_cents)
+
+    @staticmethod
+    def of(value: 'MoneyLike') -> 'Money':
+        """转换为金额，已经是金额时原样返回"""
+        return value if value.__class__ is Money else Money(value)
+
+    def __reduce__(self):
+        return _from_cents, (self._cents,)
+
+    def at_rate(self, basis_points: int) -> 'Money':
+        """金额的 basis_points / 10000（如折扣、赠送），四舍五入到分"""
+        product = self._cents * basis_points
+        if product >= 0:
+            return _from_cents((product + _HALF_POINT) // BASIS_POINTS)
+        return _from_cents(-((_HALF_POINT - product) // BASIS_POINTS))
+
+    def to_decimal(self) -> Decimal:
+        """以元为单位的 Decimal（两位小数）"""
+        return Decimal(self._cents).scaleb(-2)
+
+    def __float__(self) -> float:
+        return self._cents / MINOR_UNITS
+
+    def __bool__(self) -> bool:
+        return self._cents != 0
+
+    def __hash__(self) -> int:
+        return hash(self._cents)
+
+    def __eq__(self, other):
+        if other.__class__ is Money:
+            return self._cents == other._cents
+        return NotImplemented
+
+    def __ne__(self, other):
+        if other.__class__ is Money:
+            return self._cents != other._cents
+        return NotImplemented
+
+    def __lt__(self, other):
+        if other.__class__ is Money:
+            return self._cents < other._cents
+        return NotImplemented
+
+    def __le__(self, other):
+        if other.__class__ is Money:
+            return self._cents <= other._cents
+        return NotImplemented
+
+    def __gt__(self, other):
+        if other.__class__ is Money:
+            return self._cents > other._cents
+        return NotImplemented
+
+    def __ge__(self, other):
+        if other.__class__ is Money:
+            return self._cents >= other._cents
+        return NotImplemented
+
+    def __add__(self, other):
+        if other.__class__ is Money:
+            return _from_cents(self._cents + other._cents)
+        return NotImplemented
+
+    def __radd__(self, other):
+        # sum() 从整数 0 开始累加
+        if other.__class__ is int and other == 0:
+            return self
+        return NotImplemented
+
+    def __sub__(self, other):
+        if other.__class__ is Money:
+            return _from_cents(self._cents - other._cents)
+        return NotImplemented
+
+    def __mul__(self, other):
+        # 只能乘以整数（数量）；按比例计算请用 at_rate
+        if other.__class__ is int:
+            return _from_cents(self._cents * other)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __neg__(self) -> 'Money':
+        return _from_cents(-self._cents)
+
+    def __pos__(self) -> 'Money':
+        return self
+
+    def __abs__(self) -> 'Money':
+        return self if self._cents >= 0 else _from_cents(-self._cents)
+
+    def __str__(self) -> str:
+        cents = self._cents
+        if -_FLOAT_EXACT < cents < _FLOAT_EXACT:
+            return '%.2f' % (cents / MINOR_UNITS)
+        return format(self.to_decimal(), 'f')
+
+    def __repr__(self) -> str:
+        return f"Money('{self}')"
+
+    def __format__(self, spec: str) -> str:
+        if not spec or spec == '.2f':
+            cents = self._cents
+            if -_FLOAT_EXACT < cents < _FLOAT_EXACT:
+                return '%.2f' % (cents / MINOR_UNITS)
+        return format(self.to_decimal(), spec or '.2f')
+
+
+MoneyLike = Union[Money, int, float, str, Decimal]
+
+ZERO = Money.from_cents(0)
+
+
+def cents_of(value: MoneyLike) -> int:
+    """金额的整数分（value 可以是 Money 或按元表示的数值、字符串）"""
+    return value._cents if value.__class__ is Money else _parse_cents(value)
+
+
+def basis_points(rate: float) -> int:
+    """比例（如 0.05）-> 整数基点（如 500）"""
+    return int(round(rate * BASIS_POINTS))
+
+
+def money_property(slot: str, doc: Optional[str] = None) -> property:
+    """以整数分保存在 slot 中、读写为 Money 的属性"""
+    def fget(self):
+        return _from_cents(getattr(self, slot))
+
+    def fset(self, value):
+        setattr(self, slot, cents_of(value))
+    return property(fget, fset, doc=doc)
@@ -0,0 +1,140 @@
+import threading
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+# 占用活动名额的充值状态：待支付的充值预占名额，完成后转为正式参与（名额数不变）
+HOLDING_STATUSES = ('pending', 'paid')
+
+
+class _ActivityQuota:
+    """单个活动的名额计数（一个分片）"""
+
+    __slots__ = ('lock', 'taken', 'users')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.taken = 0                   # 已占用名额（待支付 + 已完成）
+        self.users: Dict[Hashable, int] = {}  # 用户 -> 已占用次数
+
+
+class ActivityQuotas:
+    """充值活动名额引擎
+
+    - reserve：创建充值订单时，在活动锁内同时检查活动总名额（max_participants）
+      和用户参与次数（user_limit）并占用名额，本进程内并发创建订单也不会超出限制
+    - release：充值失败或过期，归还名额
+    - 充值完成时名额已被占用，不再变化
+
+    按活动分片：每个活动一把锁和一份计数，不同活动之间互不阻塞。
+    名额由充值记录的状态决定（待支付和已完成的充值占用名额），不单独持久化；
+    重启后由 rebuild 从充值记录恢复，其他进程修改的充值记录通过 update 同步。
+    多个进程共享数据库时这里的计数只是缓存，名额以写入充值记录时数据库中的条件检查为准
+    （见 SQLiteStorage.reserve_recharge）。
+    """
+
+    def __init__(self):
+        self._shards: Dict[str, _ActivityQuota] = {}
+        self._shards_guard = threading.Lock()
+
+    def _shard(self, activity_id: str) -> _ActivityQuota:
+        shard = self._shards.get(activity_id)
+        if shard is None:
+            with self._shards_guard:
+                shard = self._shards.setdefault(activity_id, _ActivityQuota())
+        return shard
+
+    def participants(self, activity_id: str) -> int:
+        """活动已占用的名额（无锁读取）"""
+        shard = self._shards.get(activity_id)
+        return shard.taken if shard else 0
+
+    def user_count(self, activity_id: str, user_id: Hashable) -> int:
+        """用户在活动中已占用的次数（无锁读取）"""
+        shard = self._shards.get(activity_id)
+        return shard.users.get(user_id, 0) if shard else 0
+
+    def is_full(self, activity) -> bool:
+        """活动总名额是否已满（无锁读取）"""
+        return activity.max_participants is not None and self.participants(activity.id) >= activity.max_participants
+
+    def has_room(self, activity, user_id: Hashable) -> bool:
+        """活动和用户是否都还有名额（无锁读取，预占时在锁内重新检查）"""
+        shard = self._shards.get(activity.id)
+        if shard is None:
+            return activity.user_limit > 0 and (activity.max_participants is None or activity.max_participants > 0)
+        return ((activity.max_participants is None or shard.taken < activity.max_participants)
+                and shard.users.get(user_id, 0) < activity.user_limit)
+
+    def reserve(self, activity, user_id: Hashable) -> bool:
+        """原子地检查并占用一个名额
+
+        Args:
+            activity: 充值活动（读取 id、max_participants、user_limit）
+            user_id: 用户ID
+
+        Returns:
+            是否占用成功（活动满员或用户已达参与次数上限时返回False）
+        """
+        shard = self._shard(activity.id)
+        with shard.lock:
+            if activity.max_participants is not None and shard.taken >= activity.max_participants:
+                return False
+            count = shard.users.get(user_id, 0)
+            if count >= activity.user_limit:
+                return False
+            shard.taken += 1
+            shard.users[user_id] = count + 1
+            return True
+
+    def add(self, activity_id: str, user_id: Hashable):
+        """不检查上限地占用一个名额（恢复已存在的充值记录）"""
+        shard = self._shard(activity_id)
+        with shard.lock:
+            shard.taken += 1
+            shard.users[user_id] = shard.users.get(user_id, 0) + 1
+
+    def release(self, activity_id: str, user_id: Hashable) -> bool:
+        """归还一个名额"""
+        shard = self._shards.get(activity_id)
+        if shard is None:
+            return False
+        with shard.lock:
+            count = shard.users.get(user_id, 0)
+            if count <= 0:
+                return False
+            shard.taken -= 1
+            if count == 1:
+                del shard.users[user_id]
+            else:
+                shard.users[user_id] = count - 1
+            return True
+
+    def update(self, activity_id: Optional[str], user_id: Hashable, previous: Optional[str], status: str):
+        """按充值记录的状态变化调整名额（用于同步其他进程修改的充值记录）
+
+        Args:
+            activity_id: 充值记录参与的活动
+            user_id: 用户ID
+            previous: 本进程已知的原状态，新记录为 None
+            status: 新状态
+        """
+        if not activity_id:
+            return
+        was_holding = previous in HOLDING_STATUSES
+        holding = status in HOLDING_STATUSES
+        if holding and not was_holding:
+            self.add(activity_id, user_id)
+        elif was_holding and not holding:
+            self.release(activity_id, user_id)
+
+    def rebuild(self, records: Iterable[Tuple[Optional[str], Hashable, str]]):
+        """由充值记录 (活动ID, 用户ID, 状态) 重新计算全部名额"""
+        shards: Dict[str, _ActivityQuota] = {}
+        for activity_id, user_id, status in records:
+            if activity_id and status in HOLDING_STATUSES:
+                shard = shards.get(activity_id)
+                if shard is None:
+                    shard = shards[activity_id] = _ActivityQuota()
+                shard.taken += 1
+                shard.users[user_id] = shard.users.get(user_id, 0) + 1
+        with self._shards_guard:
+            self._shards = shards
@@ -0,0 +1,160 @@
+import heapq
+import math
+import unicodedata
+from typing import Dict, Iterable, List, Set
+
+from .models import Product
+
+# 字段权重：商品名称命中比描述命中更重要
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+# 归一化时去除的不可见字符（emoji 变体选择符、零宽连接符等）
+_IGNORED_CHARS = {'\ufe0f', '\ufe0e', '\u200d'}
+
+
+def normalize(text: str) -> str:
+    """归一化文本：全角转半角、转小写、去除不可见字符"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return ''.join(ch for ch in text if ch not in _IGNORED_CHARS)
+
+
+def _segments(text: str) -> List[str]:
+    """按空白和标点切分为连续片段"""
+    segments = []
+    current = []
+    for ch in normalize(text):
+        category = unicodedata.category(ch)
+        if ch.isspace() or category.startswith('P'):
+            if current:
+                segments.append(''.join(current))
+                current = []
+        else:
+            current.append(ch)
+    if current:
+        segments.append(''.join(current))
+    return segments
+
+
+def text_grams(text: str) -> Set[str]:
+    """生成索引用的字符 n-gram（单字 + 相邻双字）
+
+    中文和 emoji 没有天然的分词边界，使用字符 n-gram 即可支持任意子串查询。
+    """
+    grams = set()
+    for segment in _segments(text):
+        grams.update(segment)
+        grams.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+
+def query_grams(keyword: str) -> Set[str]:
+    """生成查询用的 n-gram：单字片段用单字，其余只用双字"""
+    grams = set()
+    for segment in _segments(keyword):
+        if len(segment) == 1:
+            grams.add(segment)
+        else:
+            grams.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+
+class ProductSearchIndex:
+    """商品倒排索引
+
+    以字符 n-gram 为词项，记录每个商品在名称/描述中的命中权重。
+    查询时只访问查询词项对应的倒排表，从最短的倒排表开始求交集，
+    再按 IDF 加权得分排序取前 k 个，不遍历整个商品目录。
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}  # n-gram -> {商品ID: 字段权重}
+        self._doc_grams: Dict[str, Set[str]] = {}  # 商品ID -> n-gram 集合
+        self._names: Dict[str, str] = {}  # 商品ID -> 归一化名称
+        self._in_stock: Dict[str, bool] = {}  # 商品ID -> 是否有库存
+
+    def __len__(self) -> int:
+        return len(self._doc_grams)
+
+    def add(self, product: Product):
+        """添加或重建单个商品的索引"""
+        if product.id in self._doc_grams:
+            self.remove(product.id)
+
+        weights: Dict[str, int] = {}
+        for gram in text_grams(product.name):
+            weights[gram] = weights.get(gram, 0) + NAME_WEIGHT
+        for gram in text_grams(product.description):
+            weights[gram] = weights.get(gram, 0) + DESCRIPTION_WEIGHT
+
+        for gram, weight in weights.items():
+            self._postings.setdefault(gram, {})[product.id] = weight
+
+        self._doc_grams[product.id] = set(weights)
+        self._names[product.id] = normalize(product.name)
+        self._in_stock[product.id] = product.stock > 0
+
+    def add_many(self, products: Iterable[Product]):
+        """批量添加商品"""
+        for product in products:
+            self.add(product)
+
+    def remove(self, product_id: str):
+        """删除商品索引"""
+        for gram in self._doc_grams.pop(product_id, ()):
+            posting = self._postings.get(gram)
+            if posting is None:
+                continue
+            posting.pop(product_id, None)
+            if not posting:
+                del self._postings[gram]
+        self._names.pop(product_id, None)
+        self._in_stock.pop(product_id, None)
+
+    def update_stock(self, product_id: str, stock: int):
+        """库存变化只更新有无库存标记，不重建词项"""
+        if product_id in self._in_stock:
+            self._in_stock[product_id] = stock > 0
+
+    def search(self, keyword: str, limit: int = 20) -> List[str]:
+        """搜索商品
+
+        Args:
+            keyword: 搜索关键词
+            limit: 返回的最大结果数
+
+        Returns:
+            按相关度排序的商品ID列表
+        """
+        grams = query_grams(keyword)
+        if not grams or limit <= 0:
+            return []
+
+        postings = []
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if not posting:
+                return []
+            postings.append((gram, posting))
+        postings.sort(key=lambda item: len(item[1]))
+
+        # 从最短的倒排表开始求交集
+        candidates = set(postings[0][1])
+        for _, posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+
+        total = len(self._doc_grams)
+        idf = {gram: math.log(1 + total / len(posting)) for gram, posting in postings}
+        phrase = ''.join(_segments(keyword))
+
+        def score(product_id: str) -> float:
+            value = sum(idf[gram] * posting[product_id] for gram, posting in postings)
+            if phrase and phrase in self._names.get(product_id, ''):
+                value *= 2  # 名称包含完整关键词
+            if not self._in_stock.get(product_id):
+                value *= 0.1  # 无库存商品排在后面
+            return value
+
+        return heapq.nlargest(limit, candidates, key=score)
@@ -1,30 +1,67 @@
-from typing import Dict, List, Optional
-from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import uuid
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 from .models import Product, Order, PaymentMethod, PaymentStatus
 from payments.umpay import UMPay
-from payments.bepusdt import BEpusdt
-from config import BEPUSDT_API_URL, BEPUSDT_APP_ID, BEPUSDT_APP_SECRET, BEPUSDT_NOTIFY_URL
+from payments.bepusdt import BEpusdt, AsyncBEpusdt
+from payments.rates import RateCache
+from config import BEPUSDT_API_URL, BEPUSDT_APP_ID, BEPUSDT_APP_SECRET, BEPUSDT_NOTIFY_URL, PAYMENT_TIMEOUT
 from store.member import MemberSystem
+from store.money import ZERO, Money, MoneyLike
+from store.indexes import TimeOrderedIndex
+from store.search import ProductSearchIndex
+from store.inventory import StockReservations, Reservation
 
 class Shop:
     """商城管理系统"""
     
-    def __init__(self, member_system: Optional[MemberSystem] = None):
+    def __init__(self, member_system: Optional[MemberSystem] = None, storage=None):
+        self.storage = storage
         self.products: Dict[str, Product] = {}
         self.orders: Dict[str, Order] = {}
-        self.member_system = member_system or MemberSystem()
+        self.user_orders = TimeOrderedIndex()  # 用户ID -> 订单（按创建时间排序）
+        self.search_index = ProductSearchIndex()  # 商品搜索倒排索引
+        self.inventory = StockReservations(on_change=self._on_stock_change,
+                                           on_expire=self._on_reservation_expired)  # 库存预占
+        self.member_system = member_system or MemberSystem(storage)
         self.umpay = UMPay(network='mainnet')
+        self.on_order_created: Optional[Callable[[Order], None]] = None  # 新的待支付订单回调
         
         # 初始化BEpusdt（如果配置了）
+        # （同步客户端供回调服务使用，异步客户端供机器人处理器使用）
         if BEPUSDT_API_URL and BEPUSDT_APP_ID and BEPUSDT_APP_SECRET:
-            self.bepusdt = BEpusdt(BEPUSDT_API_URL, BEPUSDT_APP_ID, BEPUSDT_APP_SECRET)
+            self.rates = RateCache()  # 两个客户端共享汇率缓存
+            self.bepusdt = BEpusdt(BEPUSDT_API_URL, BEPUSDT_APP_ID, BEPUSDT_APP_SECRET,
+                                   rate_cache=self.rates)
+            self.bepusdt_async = AsyncBEpusdt(BEPUSDT_API_URL, BEPUSDT_APP_ID, BEPUSDT_APP_SECRET,
+                                              rate_cache=self.rates)
         else:
+            self.rates = None
             self.bepusdt = None
+            self.bepusdt_async = None
             
-        # 初始化一些示例商品
-        self._init_sample_products()
+        # 优先从持久化存储热启动，没有商品时初始化一些示例商品
+        if self.storage:
+            self._warm_start()
+        if not self.products:
+            self._init_sample_products()
+    
+    def _warm_start(self):
+        """从持久化存储恢复商品和订单"""
+        for product in self.storage.load_products():
+            self.products[product.id] = product
+            self.search_index.add(product)
+            self.inventory.set_stock(product.id, product.stock, notify=False)
+        
+        for order in self.storage.load_orders():
+            self.orders[order.id] = order
+            self.user_orders.add(str(order.user_id), order)
+            # 恢复待支付订单的库存预占（库存已在持久化数据中扣减）
+            if order.payment_status == PaymentStatus.PENDING:
+                expires_at = order.created_at + timedelta(minutes=PAYMENT_TIMEOUT)
+                for product in order.products:
+                    self.inventory.restore(order.id, product.id, 1, expires_at.timestamp())
     
     def _init_sample_products(self):
         """初始化示例商品"""
@@ -33,41 +70,127 @@ class Shop:
                 id="prod_001",
                 name="🎮 Steam游戏激活码",
                 description="热门游戏激活码，支持全球激活",
-                price=Decimal('15.99'),
+                price=Money('15.99'),
                 stock=50
             ),
             Product(
                 id="prod_002",
                 name="📱 手机充值卡",
                 description="支持移动、联通、电信充值",
-                price=Decimal('10.00'),
+                price=Money('10.00'),
                 stock=100
             ),
             Product(
                 id="prod_003",
                 name="🎵 音乐会员月卡",
                 description="QQ音乐/网易云音乐会员",
-                price=Decimal('8.00'),
+                price=Money('8.00'),
                 stock=30
             ),
             Product(
                 id="prod_004",
                 name="📺 视频会员季卡",
                 description="爱奇艺/腾讯视频/优酷会员",
-                price=Decimal('25.00'),
+                price=Money('25.00'),
                 stock=20
             ),
             Product(
                 id="prod_005",
                 name="☁️ 云存储空间",
                 description="100GB云存储空间，1年有效期",
-                price=Decimal('12.00'),
+                price=Money('12.00'),
                 stock=80
             )
         ]
         
         for product in sample_products:
-            self.products[product.id] = product
+            self.add_product(product)
+    
+    def add_product(self, product: Product):
+        """添加商品（已存在则覆盖）"""
+        self.products[product.id] = product
+        self.search_index.add(product)
+        if self.storage:
+            self.storage.save_product(product)
+        self.inventory.set_stock(product.id, product.stock)
+    
+    def update_product(self, product_id: str, **fields) -> Optional[Product]:
+        """修改商品信息
+        
+        Args:
+            product_id: 商品ID
+            **fields: 要修改的字段，如 name、description、price、stock
+            
+        Returns:
+            修改后的商品或None（如果商品不存在）
+        """
+        product = self.products.get(product_id)
+        if not product:
+            return None
+        
+        for name, value in fields.items():
+            if not hasattr(product, name):
+                raise AttributeError(f"商品没有字段: {name}")
+            if name == 'price':
+                value = Money.of(value)
+            if name != 'stock':
+                setattr(product, name, value)
+        
+        if 'name' in fields or 'description' in fields:
+            self.search_index.add(product)
+        if 'stock' in fields:
+            # 库存统一经由预占引擎修改
+            self.inventory.set_stock(product_id, fields['stock'])
+        elif self.storage:
+            self.storage.save_product(product)
+        return product
+    
+    def remove_product(self, product_id: str) -> bool:
+        """下架商品"""
+        if self.products.pop(product_id, None) is None:
+            return False
+        self.search_index.remove(product_id)
+        self.inventory.remove(product_id)
+        if self.storage:
+            self.storage.delete_product(product_id)
+        return True
+    
+    def adjust_stock(self, product_id: str, delta: int):
+        """调整库存（补货、盘点等）"""
+        if product_id in self.products:
+            self.inventory.adjust(product_id, delta)
+    
+    def _on_stock_change(self, product_id: str, available: int, delta: Optional[int]):
+        """可用库存变化时同步商品库存、搜索索引和持久化存储
+        
+        预占、释放和补货只向数据库提交增减量：本进程缓存的库存可能还没有包含其他进程的修改，
+        写入绝对值会覆盖对方的扣减或归还。
+        """
+        if self._show_stock(product_id, available) and self.storage:
+            if delta is None:
+                self.storage.set_product_stock(product_id, available)
+            else:
+                self.storage.adjust_product_stock(product_id, delta)
+    
+    def _show_stock(self, product_id: str, available: int) -> bool:
+        """更新商品缓存中的库存和搜索索引，商品不存在时返回False"""
+        product = self.products.get(product_id)
+        if not product:
+            return False
+        product.stock = available
+        self.search_index.update_stock(product_id, available)
+        return True
+    
+    def _on_reservation_expired(self, reservation: Reservation) -> bool:
+        """预占超时：通过 fail_order 将订单标记为失败并归还库存
+        
+        Returns:
+            预占是否已释放
+        """
+        order = self.orders.get(reservation.order_id)
+        if order is None:
+            return self.inventory.release(reservation.order_id)
+        return self.fail_order(order)
     
     def get_all_products(self) -> List[Product]:
         """获取所有商品"""
@@ -96,27 +219,15 @@ class Shop:
         if not product:
             return None
         
-        if product.stock <= 0:
+        if self.inventory.available(product.id) <= 0:
             return None
         
-        # 计算原价
-        original_amount = product.price
-        total_amount = original_amount
-        
-        # 应用会员折扣
-        discount_amount = Decimal('0.0')
-        if self.member_system:
-            user = self.member_system.get_user(int(user_id))
-            if user:
-                benefits = user.get_level_benefits()
-                discount_rate = benefits.get('discount', 0.0)
-                if discount_rate > 0:
-                    discount_amount = original_amount * Decimal(str(discount_rate))
-                    total_amount = original_amount - discount_amount
+        # 计算会员折扣后的实付金额
+        discount_amount, total_amount = self.quote(user_id, product)
         
         # 如果是余额支付，检查余额是否充足
         if payment_method.lower() == 'balance':
-            if not self.can_use_balance_payment(int(user_id), float(total_amount)):
+            if not self.can_use_balance_payment(int(user_id), total_amount):
                 return None
         
         # 创建订单
@@ -140,14 +251,18 @@ class Shop:
         )
         
         # 添加折扣信息到订单备注
-        if discount_amount > 0:
+        if discount_amount:
             order.notes = f"会员折扣：-¥{discount_amount:.2f}"
         
+        # 原子预占库存，并发下单不会超卖
+        if not self.inventory.reserve(order_id, product.id):
+            return None
+        
         # 如果是余额支付，直接完成支付
         if payment_method.lower() == 'balance':
             success = self.member_system.deduct_balance(
                 int(user_id),
-                float(total_amount),
+                total_amount,
                 "purchase",
                 f"购买商品：{product.name}",
                 order_id
@@ -155,10 +270,10 @@ class Shop:
             if success:
                 order.payment_status = PaymentStatus.COMPLETED
                 order.completed_at = datetime.now()
-                # 减少库存
-                product.stock -= 1
+                # 预占转为售出
+                self.inventory.commit(order_id)
                 # 存储订单
-                self.orders[order_id] = order
+                self._save_order(order)
                 # 处理发货
                 self._process_order_fulfillment(order)
                 return {
@@ -166,28 +281,172 @@ class Shop:
                     'payment_order': {'status': 'completed', 'method': 'balance'}
                 }
             else:
+                self.inventory.release(order_id)
                 return None
         
         # 创建支付订单
-        payment_order = self.umpay.create_payment_order(
-            amount=float(total_amount),
-            currency=payment_method.upper()
-        )
+        try:
+            payment_order = self.umpay.create_payment_order(
+                amount=total_amount,
+                currency=payment_method.upper()
+            )
+        except Exception:
+            self.inventory.release(order_id)
+            raise
         
-        # 存储订单
-        self.orders[order_id] = order
+        # 预占与支付订单同时过期：支付有效期内到账的订单一定还有库存
+        self.inventory.reschedule(order_id, payment_order['expires_at'])
         
-        # 减少库存
-        product.stock -= 1
+        # 存储订单（库存保持预占，直到支付完成、失败或超时）
+        self._save_order(order)
         
         return {
             'order': order,
             'payment_order': payment_order
         }
     
+    def _save_order(self, order: Order):
+        """保存新订单并写入用户订单索引"""
+        self.orders[order.id] = order
+        self.user_orders.add(str(order.user_id), order)
+        if self.storage:
+            self.storage.save_order(order)
+        if self.on_order_created and order.payment_status == PaymentStatus.PENDING:
+            self.on_order_created(order)
+    
+    def save_order(self, order: Order):
+        """持久化已有订单的状态变更"""
+        if self.storage:
+            self.storage.save_order(order)
+    
+    def complete_order(self, order: Order) -> bool:
+        """将待支付订单标记为已完成
+        
+        订单已因超时失败后才收到支付时，重新预占库存完成订单，
+        商品已售完则把实付金额退到用户余额（见 _complete_late_payment）。
+        
+        Returns:
+            订单是否完成、需要发货（重复通知或已退款时返回False）
+        """
+        if order.payment_status == PaymentStatus.FAILED:
+            return self._complete_late_payment(order)
+        if order.payment_status != PaymentStatus.PENDING:
+            return False
+        
+        order.payment_status = PaymentStatus.COMPLETED
+        order.completed_at = datetime.now()
+        self.inventory.commit(order.id)
+        self.save_order(order)
+        return True
+    
+    def _complete_late_payment(self, order: Order) -> bool:
+        """处理订单失败（预占已释放）后才到账的支付
+        
+        Returns:
+            是否重新预占到库存并完成订单；否则订单标记为已退款
+        """
+        product = order.products[0] if order.products else None
+        if product is not None and self.inventory.reserve(order.id, product.id):
+            self.inventory.commit(order.id)
+            order.payment_status = PaymentStatus.COMPLETED
+            order.completed_at = datetime.now()
+            self.save_order(order)
+            return True
+        
+        order.payment_status = PaymentStatus.REFUNDED
+        self.save_order(order)
+        if not self.member_system.add_balance(int(order.user_id), order.total_amount, "refund",
+                                              "订单超时后支付，商品已售完，退款到余额", order.id):
+            print(f"订单 {order.id} 退款失败：用户 {order.user_id} 不存在")
+        return False
+    
+    def fail_order(self, order: Order) -> bool:
+        """将待支付订单标记为失败并恢复库存
+        
+        有持久化存储时，状态转换和归还库存在数据库中作为一次条件写入提交：
+        订单已被其他进程结算或标记失败（本进程还没有同步到）时不归还库存，只刷新本地订单。
+        
+        Returns:
+            是否发生了状态变更（重复通知时返回False）
+        """
+        if order.payment_status != PaymentStatus.PENDING:
+            return False
+        
+        restock = Counter(product.id for product in order.products)
+        order.payment_status = PaymentStatus.FAILED
+        if not self.storage:
+            if not self.inventory.release(order.id):
+                for product_id, quantity in restock.items():
+                    self.adjust_stock(product_id, quantity)
+            return True
+        
+        if not self.storage.fail_order(order, restock):
+            # 其他进程已改变订单状态（可能已归还库存）：刷新本地订单和库存
+            order.payment_status = PaymentStatus.PENDING
+            self.invalidate('order', order.id)
+            for product_id in restock:
+                self.invalidate('product', product_id)
+            return False
+        # 库存已在数据库中归还：本地只释放预占、刷新缓存，不再提交增减量
+        if self.inventory.release(order.id, notify=False):
+            for product_id in restock:
+                self._show_stock(product_id, self.inventory.available(product_id))
+        else:
+            # 预占不在本进程（如由其他进程创建），从数据库读取归还后的库存
+            for product_id in restock:
+                self.invalidate('product', product_id)
+        return True
+    
     def get_order(self, order_id: str) -> Optional[Order]:
-        """获取订单"""
-        return self.orders.get(order_id)
+        """获取订单（缓存未命中时从持久化存储读取）"""
+        order = self.orders.get(order_id)
+        if order is None and self.storage:
+            order = self.storage.load_order(order_id)
+            if order:
+                self.orders[order.id] = order
+                self.user_orders.add(str(order.user_id), order)
+        return order
+    
+    def invalidate(self, entity: str, key: str):
+        """应用其他进程写入的商品和订单变更
+        
+        已缓存的对象在原对象上刷新（保持索引中的引用有效），新对象加入缓存和索引。
+        
+        Args:
+            entity: 变更实体类型（product / order）
+            key: 实体主键
+        """
+        if not self.storage:
+            return
+        
+        if entity == 'product':
+            product = self.storage.load_product(key)
+            if not product:
+                if self.products.pop(key, None) is not None:
+                    self.search_index.remove(key)
+                return
+            cached = self.products.get(key)
+            if cached:
+                vars(cached).update(vars(product))
+                product = cached
+            else:
+                self.products[key] = product
+            self.search_index.add(product)
+            self.inventory.set_stock(key, product.stock, notify=False)
+        
+        elif entity == 'order':
+            order = self.storage.load_order(key)
+            if not order:
+                return
+            cached = self.orders.get(key)
+            if cached:
+                vars(cached).update(vars(order))
+            else:
+                self.orders[key] = order
+                self.user_orders.add(str(order.user_id), order)
+            # 订单已由其他进程结算，本地预占不再需要释放
+            if order.payment_status != PaymentStatus.PENDING:
+                self.inventory.forget(key)
     
     def check_order_payment(self, order_id: str, payment_order_id: str) -> Dict:
         """检查订单支付状态
@@ -210,19 +469,14 @@ class Shop:
             return payment_result
         
         # 更新订单状态
-        if payment_result['status'] == 'completed' and order.payment_status == PaymentStatus.PENDING:
-            order.payment_status = PaymentStatus.COMPLETED
-            order.completed_at = datetime.now()
-            
-            # 这里可以添加发货逻辑
-            self._process_order_fulfillment(order)
+        if payment_result['status'] == 'completed':
+            if self.complete_order(order):
+                # 这里可以添加发货逻辑
+                self._process_order_fulfillment(order)
         
         elif payment_result['status'] == 'expired':
-            order.payment_status = PaymentStatus.FAILED
-            # 恢复库存
-            for product in order.products:
-                if product.id in self.products:
-                    self.products[product.id].stock += 1
+            # 标记失败并恢复库存
+            self.fail_order(order)
         
         return {
             'order': order,
@@ -274,16 +528,52 @@ class Shop:
         return ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
     
     def get_user_orders(self, user_id: str) -> List[Order]:
-        """获取用户的所有订单"""
-        return [order for order in self.orders.values() if order.user_id == user_id]
+        """获取用户的所有订单（按创建时间升序）"""
+        return self.user_orders.all(str(user_id))
+    
+    def list_user_orders(self, user_id: str, limit: int = 10, cursor: Optional[str] = None,
+                         status: Optional[Union[PaymentStatus, str]] = None) -> Tuple[List[Order], Optional[str]]:
+        """分页获取用户订单（按创建时间倒序）
+        
+        Args:
+            user_id: 用户ID
+            limit: 每页条数
+            cursor: 上一页返回的游标（订单ID）
+            status: 可选的支付状态过滤
+            
+        Returns:
+            (订单列表, 下一页游标)
+        """
+        predicate = None
+        if status is not None:
+            if not isinstance(status, PaymentStatus):
+                status = PaymentStatus(status.lower())
+            predicate = lambda order: order.payment_status == status
+        return self.user_orders.latest(str(user_id), limit, cursor, predicate)
+    
+    def quote(self, user_id: Union[int, str], product: Product) -> Tuple[Money, Money]:
+        """按用户的会员折扣计算商品价格
+        
+        Returns:
+            (折扣金额, 实付金额)，非会员的折扣金额为 0
+        """
+        price = product.price
+        if self.member_system:
+            user = self.member_system.get_user(int(user_id))
+            if user:
+                discount_bp = user.get_level_benefits().discount_bp
+                if discount_bp:
+                    discount = price.at_rate(discount_bp)
+                    return discount, price - discount
+        return ZERO, price
     
-    def can_use_balance_payment(self, user_id: int, amount: float) -> bool:
+    def can_use_balance_payment(self, user_id: int, amount: MoneyLike) -> bool:
         """检查用户是否可以使用余额支付"""
         if not self.member_system:
             return False
         
         user = self.member_system.get_user(user_id)
-        return user is not None and user.balance >= amount
+        return user is not None and user.balance_cents >= Money.of(amount).cents
     
     def get_user_discount_info(self, user_id: int) -> Dict:
         """获取用户折扣信息"""
@@ -301,24 +591,19 @@ class Shop:
             "level_emoji": benefits.get('emoji', '')
         }
     
-    def search_products(self, keyword: str) -> List[Product]:
+    def search_products(self, keyword: str, limit: int = 20) -> List[Product]:
         """搜索商品
         
         Args:
             keyword: 搜索关键词
+            limit: 返回的最大结果数
             
         Returns:
-            匹配的商品列表
+            按相关度排序的商品列表
         """
-        keyword = keyword.lower()
-        results = []
-        
-        for product in self.products.values():
-            if (keyword in product.name.lower() or 
-                keyword in product.description.lower()):
-                results.append(product)
-        
-        return results
+        return [self.products[product_id]
+                for product_id in self.search_index.search(keyword, limit)
+                if product_id in self.products]
     
     def create_bepusdt_order(self, user_id: str, product_id: str, payment_method: str) -> Optional[Dict]:
         """
@@ -335,15 +620,17 @@ class Shop:
         if not self.bepusdt:
             return None
             
+        # 获取商品信息
+        product = self.get_product(product_id)
+        if not product:
+            return None
+        
+        # 创建订单ID并预占库存
+        order_id = str(uuid.uuid4())
+        if not self.inventory.reserve(order_id, product.id, ttl=PAYMENT_TIMEOUT * 60):
+            return None
+        
         try:
-            # 获取商品信息
-            product = self.get_product(product_id)
-            if not product or product.stock <= 0:
-                return None
-            
-            # 创建订单ID
-            order_id = str(uuid.uuid4())
-            
             # 映射支付方式
             trade_type_mapping = {
                 'USDT_TRC20': 'usdt.trc20',
@@ -361,10 +648,11 @@ class Shop:
                 amount=product.price,  # 假设价格是CNY
                 trade_type=trade_type,
                 notify_url=BEPUSDT_NOTIFY_URL,
-                timeout=1800  # 30分钟
+                timeout=PAYMENT_TIMEOUT * 60  # 与库存预占相同
             )
             
             if not result.get('success'):
+                self.inventory.release(order_id)
                 return None
             
             # 创建本地订单
@@ -379,11 +667,8 @@ class Shop:
                 payment_status=PaymentStatus.PENDING
             )
             
-            # 减少库存
-            product.stock -= 1
-            
-            # 保存订单
-            self.orders[order_id] = order
+            # 保存订单（库存保持预占，直到支付完成、失败或超时）
+            self._save_order(order)
             
             return {
                 'order': order,
@@ -392,6 +677,7 @@ class Shop:
             
         except Exception as e:
             print(f"创建BEpusdt订单失败: {e}")
+            self.inventory.release(order_id)
             return None
     
     def check_bepusdt_payment(self, order_id: str) -> Dict:
@@ -410,42 +696,59 @@ class Shop:
         try:
             # 查询BEpusdt订单状态
             result = self.bepusdt.query_order(order_id)
+            return self._apply_bepusdt_status(order_id, result)
+        except Exception as e:
+            print(f"检查BEpusdt支付状态失败: {e}")
+            return {'error': f'查询异常: {str(e)}'}
+    
+    async def check_bepusdt_payment_async(self, order_id: str) -> Dict:
+        """
+        检查BEpusdt订单支付状态（异步查询网关，不阻塞事件循环）
+        
+        Args:
+            order_id: 订单ID
             
-            if not result.get('success'):
-                return {'error': result.get('message', '查询失败')}
-            
-            order_data = result['data']
-            
-            # 更新本地订单状态
-            if order_id in self.orders:
-                order = self.orders[order_id]
-                
-                # 根据BEpusdt状态更新订单
-                if order_data.get('status') == 'paid':
-                    order.payment_status = PaymentStatus.COMPLETED
-                    order.completed_at = datetime.now()
-                    # 处理发货
-                    self._process_order_fulfillment(order)
-                elif order_data.get('status') == 'expired':
-                    order.payment_status = PaymentStatus.FAILED
-                    # 恢复库存
-                    for product in order.products:
-                        if product.id in self.products:
-                            self.products[product.id].stock += 1
-            
-            return {
-                'status': order_data.get('status', 'unknown'),
-                'amount': order_data.get('amount'),
-                'currency': order_data.get('currency'),
-                'created_at': order_data.get('created_at'),
-                'paid_at': order_data.get('paid_at'),
-                'expires_at': order_data.get('expires_at')
-            }
+        Returns:
+            支付状态信息，同 check_bepusdt_payment
+        """
+        if not self.bepusdt_async:
+            return {'error': 'BEpusdt未配置'}
             
+        try:
+            result = await self.bepusdt_async.query_order(order_id)
+            return self._apply_bepusdt_status(order_id, result)
         except Exception as e:
             print(f"检查BEpusdt支付状态失败: {e}")
             return {'error': f'查询异常: {str(e)}'}
     
+    def _apply_bepusdt_status(self, order_id: str, result: Dict) -> Dict:
+        """根据BEpusdt查询结果更新本地订单状态"""
+        if not result.get('success'):
+            return {'error': result.get('message', '查询失败')}
+        
+        order_data = result['data']
+        
+        # 更新本地订单状态
+        order = self.get_order(order_id)
+        if order:
+            # 根据BEpusdt状态更新订单
+            if order_data.get('status') == 'paid':
+                if self.complete_order(order):
+                    # 处理发货
+                    self._process_order_fulfillment(order)
+            elif order_data.get('status') == 'expired':
+                # 标记失败并恢复库存
+                self.fail_order(order)
+        
+        return {
+            'status': order_data.get('status', 'unknown'),
+            'amount': order_data.get('amount'),
+            'currency': order_data.get('currency'),
+            'created_at': order_data.get('created_at'),
+            'paid_at': order_data.get('paid_at'),
+            'expires_at': order_data.get('expires_at')
+        }
+    
     def get_supported_payment_methods(self) -> List[str]:
         """
         获取支持的支付方式列表
@@ -472,7 +775,7 @@ class Shop:
         
         return list(set(methods))  # 去重
     
-    def format_payment_amount(self, cny_amount: float, payment_method: str) -> str:
+    def format_payment_amount(self, cny_amount: MoneyLike, payment_method: str) -> str:
         """
         格式化支付金额显示
         
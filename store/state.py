@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+from config import DATABASE_URL
+from .member import MemberSystem
+from .shop import Shop
+from .storage import SQLiteStorage
+
+logger = logging.getLogger(__name__)
+
+MEMBER_ENTITIES = ('user', 'transaction', 'recharge_record', 'activity', 'setting')
+SHOP_ENTITIES = ('product', 'order')
+
+
+class StateClient:
+    """共享状态客户端
+
+    机器人和各个回调服务共享同一个 SQLite 数据库（DATABASE_URL）。
+    每个进程持有一份 MemberSystem/Shop 作为读缓存：未命中时从数据库读取，
+    其他进程写入的变更通过变更日志同步，使本地缓存失效或刷新。
+    """
+
+    def __init__(self, database_url: str = DATABASE_URL, min_sync_interval: float = 0.0):
+        """
+        Args:
+            database_url: 数据库地址
+            min_sync_interval: 两次同步之间的最短间隔（秒），0 表示每次都同步
+        """
+        self.storage = SQLiteStorage.from_url(database_url)
+        self.min_sync_interval = min_sync_interval
+
+        # 先记录变更序号再热启动，避免漏掉加载期间的写入
+        self._last_seq = self.storage.last_change_seq()
+        self._last_sync = 0.0
+        self._sync_lock = threading.Lock()
+
+        self.member_system = MemberSystem(self.storage)
+        self.shop = Shop(self.member_system, self.storage)
+
+    def sync(self) -> int:
+        """同步其他进程的写入
+
+        Returns:
+            应用的变更数量
+        """
+        now = time.monotonic()
+        if now - self._last_sync < self.min_sync_interval:
+            return 0
+
+        with self._sync_lock:
+            self._last_sync = now
+            # 先读最新序号：本进程自己的写入不会出现在变更列表中，游标也要越过它们，
+            # 否则每次同步都要重新扫描本进程的全部写入
+            latest = self.storage.last_change_seq()
+            changes = self.storage.changes_since(self._last_seq)
+            if changes:
+                # 库存和累计金额按增量写入：先提交本进程排队中的增量，重新读取的值才包含它们
+                self.storage.flush()
+            for seq, entity, key in changes:
+                try:
+                    if entity in MEMBER_ENTITIES:
+                        self.member_system.invalidate(entity, key)
+                    elif entity in SHOP_ENTITIES:
+                        self.shop.invalidate(entity, key)
+                except Exception as e:
+                    logger.error(f"同步变更失败 {entity}:{key}: {e}")
+                self._last_seq = seq
+            self._last_seq = max(self._last_seq, latest)
+            # 余额以账本为准：应用其他进程追加的分录
+            try:
+                self.member_system.sync_balances()
+            except Exception as e:
+                logger.error(f"同步余额分录失败: {e}")
+            return len(changes)
+
+    def flush(self, timeout: Optional[float] = None, since: Optional[int] = None) -> bool:
+        """等待本进程的写入提交，写入失败或超时返回 False（见 SQLiteStorage.flush）"""
+        return self.storage.flush(timeout, since)
+
+    def close(self):
+        self.storage.close()
+
+
+_state: Optional[StateClient] = None
+_state_lock = threading.Lock()
+
+
+def get_state() -> StateClient:
+    """获取本进程共享的状态客户端"""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = StateClient()
+    return _state
@@ -0,0 +1,917 @@
+import dataclasses
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
+
+from config import DATABASE_URL
+from .models import Product, Order
+from .compact import SlottedRecord, now_micros
+from .ledger import OPENING
+from .money import MINOR_UNITS, Money
+from .member import User, RechargeRecord, RechargeActivity, BalanceTransaction
+from .quotas import HOLDING_STATUSES
+from .tiers import TierTable
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id, created_at);
+CREATE TABLE IF NOT EXISTS recharge_records (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_recharge_records_user ON recharge_records (user_id, created_at);
+CREATE TABLE IF NOT EXISTS activities (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, created_at);
+CREATE TABLE IF NOT EXISTS outbox (
+    dedupe_key TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt);
+CREATE TABLE IF NOT EXISTS callback_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    gateway TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    status TEXT,
+    payload TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt REAL NOT NULL,
+    outcome TEXT,
+    owner TEXT,
+    lease_until REAL,
+    UNIQUE (gateway, order_id, tx_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_callback_events_due ON callback_events (state, next_attempt);
+CREATE TABLE IF NOT EXISTS ledger (
+    seq INTEGER PRIMARY KEY,
+    account INTEGER NOT NULL,
+    contra TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    created_us INTEGER NOT NULL,
+    memo TEXT NOT NULL,
+    ref TEXT,
+    origin TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ledger_account ON ledger (account, created_us);
+CREATE TABLE IF NOT EXISTS ledger_snapshots (
+    account INTEGER PRIMARY KEY,
+    balance INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ledger_system_snapshots (
+    name TEXT PRIMARY KEY,
+    balance INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ledger_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    snapshot_seq INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO ledger_meta (id, snapshot_seq) VALUES (1, 0);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    entity TEXT NOT NULL,
+    key TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# 旧版本数据库缺少的列 (表, 列, 定义)，启动时补上
+ADDED_COLUMNS = (
+    ('callback_events', 'owner', 'TEXT'),
+    ('callback_events', 'lease_until', 'REAL'),
+)
+# 依赖补充列的索引
+# 占用活动名额的充值记录（待支付和已完成）
+HOLDING_RECHARGE = "json_extract(data, '$.status') IN ({})".format(
+    ", ".join(f"'{status}'" for status in HOLDING_STATUSES))
+
+INDEXES = f"""
+CREATE INDEX IF NOT EXISTS idx_callback_events_lease ON callback_events (state, lease_until);
+CREATE INDEX IF NOT EXISTS idx_recharge_records_activity
+    ON recharge_records (json_extract(data, '$.activity_id'), user_id) WHERE {HOLDING_RECHARGE};
+"""
+
+# 预编译语句（sqlite3 按 SQL 文本缓存已编译语句）
+# 已有用户只更新资料：累计充值、累计消费和等级保留数据库中的值，由 ADD_USER_TOTALS 按增量修改，
+# 多个进程保存同一用户时不会用各自缓存中的旧值互相覆盖
+UPSERT_USER = (
+    "INSERT INTO users (user_id, data) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+    "data = json_set(excluded.data, '$.total_recharged', json_extract(users.data, '$.total_recharged'), "
+    "'$.total_spent', json_extract(users.data, '$.total_spent'), '$.level', json_extract(users.data, '$.level'))"
+)
+ADD_USER_TOTALS = (
+    "UPDATE users SET data = json_set(data, "
+    "'$.total_recharged', round(json_extract(data, '$.total_recharged') + ?, 2), "
+    "'$.total_spent', round(json_extract(data, '$.total_spent') + ?, 2)) WHERE user_id = ?"
+)
+UPSERT_TRANSACTION = "INSERT OR REPLACE INTO transactions (id, user_id, created_at, data) VALUES (?, ?, ?, ?)"
+UPSERT_RECHARGE = "INSERT OR REPLACE INTO recharge_records (id, user_id, created_at, data) VALUES (?, ?, ?, ?)"
+# 活动总名额（为空表示不限）和用户参与次数都还有余量时才写入充值记录，名额按数据库中的充值记录统计
+INSERT_RECHARGE_IF_ROOM = (
+    "INSERT INTO recharge_records (id, user_id, created_at, data) SELECT ?, ?, ?, ? WHERE "
+    "(? IS NULL OR (SELECT COUNT(*) FROM recharge_records "
+    f"WHERE json_extract(data, '$.activity_id') = ? AND {HOLDING_RECHARGE}) < ?) AND "
+    "(SELECT COUNT(*) FROM recharge_records "
+    f"WHERE json_extract(data, '$.activity_id') = ? AND user_id = ? AND {HOLDING_RECHARGE}) < ?"
+)
+UPSERT_ACTIVITY = "INSERT OR REPLACE INTO activities (id, data) VALUES (?, ?)"
+UPSERT_SETTING = "INSERT OR REPLACE INTO settings (key, data) VALUES (?, ?)"
+# 按数据库中的累计充值（分）重新计算等级，CASE 分支由 level_statement 按等级表生成
+RECHARGED_CENTS = f"CAST(ROUND(json_extract(data, '$.total_recharged') * {MINOR_UNITS}) AS INTEGER)"
+# 已有商品只更新资料，库存保留数据库中的值，由 SET_PRODUCT_STOCK / ADJUST_PRODUCT_STOCK 修改
+UPSERT_PRODUCT = (
+    "INSERT INTO products (id, data) VALUES (?, ?) ON CONFLICT (id) DO UPDATE SET "
+    "data = json_set(excluded.data, '$.stock', json_extract(products.data, '$.stock'))"
+)
+SET_PRODUCT_STOCK = "UPDATE products SET data = json_set(data, '$.stock', ?) WHERE id = ?"
+ADJUST_PRODUCT_STOCK = \
+    "UPDATE products SET data = json_set(data, '$.stock', json_extract(data, '$.stock') + ?) WHERE id = ?"
+DELETE_PRODUCT = "DELETE FROM products WHERE id = ?"
+UPSERT_ORDER = "INSERT OR REPLACE INTO orders (id, user_id, created_at, data) VALUES (?, ?, ?, ?)"
+# 只有仍在等待支付的订单才标记失败，与归还库存在同一事务中执行
+FAIL_ORDER = "UPDATE orders SET data = ? WHERE id = ? AND json_extract(data, '$.payment_status') = 'pending'"
+INSERT_OUTBOX = ("INSERT OR IGNORE INTO outbox (dedupe_key, chat_id, payload, status, attempts, next_attempt, created_at) "
+                 "VALUES (?, ?, ?, 'pending', 0, ?, ?)")
+UPDATE_OUTBOX = "UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE dedupe_key = ?"
+PRUNE_OUTBOX = "DELETE FROM outbox WHERE status != 'pending' AND created_at < ?"
+INSERT_CALLBACK_EVENT = ("INSERT OR IGNORE INTO callback_events (gateway, order_id, tx_hash, status, payload, "
+                         "received_at, state, attempts, next_attempt) VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, ?)")
+# 只更新本实例认领的回调：租约过期后被其他进程重新认领的，结果以新的认领者为准
+UPDATE_CALLBACK_EVENT = ("UPDATE callback_events SET state = ?, attempts = ?, next_attempt = ?, outcome = ?, "
+                         "lease_until = NULL WHERE gateway = ? AND order_id = ? AND tx_hash = ? AND owner = ?")
+# 认领待结算（已到期）或租约已过期的回调，受影响行数为 1 表示认领成功
+CLAIM_CALLBACK_EVENT = ("UPDATE callback_events SET state = 'settling', owner = ?, lease_until = ? WHERE seq = ? "
+                        "AND ((state = 'queued' AND next_attempt <= ?) OR (state = 'settling' AND lease_until <= ?))")
+INSERT_LEDGER = ("INSERT INTO ledger (account, contra, amount, created_us, memo, ref, origin) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?)")
+# 余额快照：快照余额加上上次快照之后的分录，三条语句在同一事务中执行，读到同一份数据；
+# NOT INDEXED 让查询按序号范围只读取新分录（否则会按账户索引扫描全表）
+SNAPSHOT_LEDGER_ACCOUNTS = (
+    "INSERT OR REPLACE INTO ledger_snapshots (account, balance) "
+    "SELECT l.account, COALESCE((SELECT balance FROM ledger_snapshots s WHERE s.account = l.account), 0) "
+    "+ SUM(l.amount) FROM ledger l NOT INDEXED WHERE l.seq > (SELECT snapshot_seq FROM ledger_meta) GROUP BY l.account"
+)
+SNAPSHOT_LEDGER_SYSTEM = (
+    "INSERT OR REPLACE INTO ledger_system_snapshots (name, balance) "
+    "SELECT l.contra, COALESCE((SELECT balance FROM ledger_system_snapshots s WHERE s.name = l.contra), 0) "
+    "- SUM(l.amount) FROM ledger l NOT INDEXED WHERE l.seq > (SELECT snapshot_seq FROM ledger_meta) GROUP BY l.contra"
+)
+# 账本启用前已有余额的用户：记一笔期初余额分录（已有分录的用户不再记，可重复执行）
+OPEN_LEDGER_ACCOUNTS = (
+    "INSERT INTO ledger (account, contra, amount, created_us, memo, ref, origin) "
+    "SELECT user_id, ?, CAST(ROUND(json_extract(data, '$.balance') * ?) AS INTEGER), ?, '期初余额', NULL, ? "
+    "FROM users WHERE json_extract(data, '$.balance') != 0 AND user_id NOT IN (SELECT account FROM ledger)"
+)
+SNAPSHOT_LEDGER_SEQ = "UPDATE ledger_meta SET snapshot_seq = (SELECT COALESCE(MAX(seq), 0) FROM ledger)"
+INSERT_CHANGE = "INSERT INTO changes (entity, key, origin, created_at) VALUES (?, ?, ?, ?)"
+PRUNE_CHANGES = "DELETE FROM changes WHERE created_at < ?"
+
+# 变更日志保留时长（秒），其他进程据此使缓存失效
+CHANGE_RETENTION = 3600
+
+# 数据库被其他进程锁住时，一批写入的重试次数和首次重试的等待时间（秒，之后逐次加倍）
+COMMIT_RETRIES = 3
+COMMIT_BACKOFF = 0.05
+
+_STOP = object()
+_DRAIN_LEDGER = object()  # 写队列中的标记：在此处写入缓冲的全部分录
+
+
+def level_statement(tiers: TierTable) -> Tuple[str, Tuple]:
+    """按等级表生成更新用户等级的语句和参数（门槛从高到低比较，末尾追加 user_id 参数）"""
+    whens = []
+    params: List[Any] = []
+    for threshold, level in reversed(tuple(zip(tiers.thresholds, tiers.levels))):
+        whens.append(f"WHEN {RECHARGED_CENTS} >= ? THEN ?")
+        params += [threshold, level.value]
+    params.append(tiers.levels[0].value)
+    sql = f"UPDATE users SET data = json_set(data, '$.level', CASE {' '.join(whens)} ELSE ? END) WHERE user_id = ?"
+    return sql, tuple(params)
+
+
+def parse_database_url(url: str) -> str:
+    """将 sqlite:///path 形式的 DATABASE_URL 转换为文件路径"""
+    prefix = 'sqlite:///'
+    if not url.startswith(prefix):
+        raise ValueError(f"不支持的数据库地址: {url}")
+    return url[len(prefix):] or ':memory:'
+
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, Money):
+        # 以元为单位的数字（与原来的浮点金额格式相同），读取时按分还原
+        return float(value)
+    if isinstance(value, Enum):
+        return value.value
+    if dataclasses.is_dataclass(value):
+        return encode(value)
+    raise TypeError(f"无法序列化类型: {type(value).__name__}")
+
+
+def encode(obj: Any) -> Dict[str, Any]:
+    """将数据对象转换为可 JSON 序列化的字典（dataclass 包含动态添加的属性）"""
+    if isinstance(obj, SlottedRecord):
+        return obj.to_dict()
+    return dict(vars(obj))
+
+
+def dumps(obj: Any) -> str:
+    return json.dumps(encode(obj), default=_json_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def _convert(tp: Any, value: Any) -> Any:
+    """按字段类型注解还原 JSON 值"""
+    if value is None:
+        return None
+    origin = getattr(tp, '__origin__', None)
+    if origin is typing.Union:
+        args = [arg for arg in tp.__args__ if arg is not type(None)]
+        return _convert(args[0], value) if len(args) == 1 else value
+    if origin in (list, List):
+        return [_convert(tp.__args__[0], item) for item in value]
+    if tp is datetime:
+        return datetime.fromisoformat(value)
+    if tp is Decimal:
+        return Decimal(value)
+    if tp is Money:
+        return Money(value)
+    if isinstance(tp, type) and issubclass(tp, Enum):
+        return tp(value)
+    if isinstance(tp, type) and dataclasses.is_dataclass(tp):
+        return decode(tp, value)
+    return value
+
+
+def decode(cls: Type, data: Dict[str, Any]) -> Any:
+    """由字典还原数据对象"""
+    hints = typing.get_type_hints(cls)
+    slotted = issubclass(cls, SlottedRecord)
+    field_names = set(cls.FIELDS) if slotted else {f.name for f in dataclasses.fields(cls) if f.init}
+    kwargs = {name: _convert(hints[name], data[name]) for name in field_names if name in data}
+    obj = cls(**kwargs)
+    if not slotted:
+        for name, value in data.items():
+            if name not in field_names:
+                setattr(obj, name, value)
+    return obj
+
+
+def _is_busy(error: sqlite3.Error) -> bool:
+    """数据库被其他连接锁住（可重试）"""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+class SQLiteStorage:
+    """SQLite 持久化存储
+
+    - WAL 模式，读写互不阻塞
+    - 写入先进入内存队列，由后台线程分组提交：一个事务（一次 fsync）
+      包含一批写入，同一语句的连续写入合并为 executemany
+    - 提供热启动加载，重启后恢复会员系统和商城数据
+    - 每次写入同时记录一条变更日志，多个进程共享同一数据库时，
+      其他进程通过 changes_since 获取变更并使本地缓存失效
+    - 提交出错不丢弃整批：数据库被锁住时退避重试，仍失败则留到下一批；
+      其他错误只跳过出错的语句（记录日志并计入 failed_writes），其余写入照常提交
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000, flush_interval: float = 0.005):
+        """
+        初始化存储
+
+        Args:
+            path: 数据库文件路径
+            batch_size: 单次提交的最大写入条数
+            flush_interval: 收集一批写入的最长等待时间（秒）
+        """
+        self.path = path
+        self.origin = uuid.uuid4().hex  # 本实例的写入来源标识
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.execute(OPEN_LEDGER_ACCOUNTS, (OPENING, MINOR_UNITS, now_micros(), self.origin))
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.commits = 0
+        self.failed_commits = 0  # 有写入被跳过的批次数，flush 据此判断写入是否已提交
+        self.failed_writes = 0   # 出错后被跳过的写入条数
+        self.retried_commits = 0  # 数据库被锁住后重试的次数
+        self.rows_written = 0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        # 分录先进入缓冲区，一批分录只向写队列放入一个标记，减少每条分录的队列开销
+        self._ledger_rows: List[Tuple] = []
+        self._ledger_lock = threading.Lock()
+        # 写线程私有：数据库持续被锁住时留到下一批提交的写入，以及等待它们的 flush
+        self._carry: List[Tuple] = []
+        self._carry_events: List[threading.Event] = []
+        self._writer = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_url(cls, url: str = DATABASE_URL, **kwargs) -> 'SQLiteStorage':
+        """根据 DATABASE_URL 创建存储"""
+        return cls(parse_database_url(url), **kwargs)
+
+    def _migrate(self):
+        """为旧版本数据库补充新增的列和索引"""
+        for table, column, decl in ADDED_COLUMNS:
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        self._conn.executescript(INDEXES)
+
+    # ---- 写入 ----
+
+    def _enqueue(self, sql: str, params: Tuple, entity: str, key: Any):
+        self._queue.put((sql, params, (entity, str(key), self.origin)))
+
+    def append_ledger(self, account: int, contra: str, amount: int, created_us: int, memo: str,
+                      ref: Optional[str] = None):
+        """追加一条余额分录
+
+        缓冲区为空时才向写队列放入标记，写线程处理到标记时取出缓冲的全部分录，
+        因此分录不会晚于之后放入队列的其他写入提交。
+        分录不写变更日志：其他进程通过 load_ledger_since 按序号读取新分录。
+        """
+        row = (account, contra, amount, created_us, memo, ref, self.origin)
+        with self._ledger_lock:
+            self._ledger_rows.append(row)
+            first = len(self._ledger_rows) == 1
+        if first:
+            self._queue.put(_DRAIN_LEDGER)
+
+    def _take_ledger_rows(self) -> List[Tuple]:
+        with self._ledger_lock:
+            rows, self._ledger_rows = self._ledger_rows, []
+        return rows
+
+    def snapshot_ledger(self):
+        """保存各账户的余额快照（在写线程的事务中计算）"""
+        for sql in (SNAPSHOT_LEDGER_ACCOUNTS, SNAPSHOT_LEDGER_SYSTEM, SNAPSHOT_LEDGER_SEQ):
+            self._queue.put((sql, (), None))
+
+    def save_user(self, user: User):
+        self._enqueue(UPSERT_USER, (user.user_id, dumps(user)), 'user', user.user_id)
+
+    def add_user_totals(self, user_id: int, recharged: int = 0, spent: int = 0,
+                        tiers: Optional[TierTable] = None):
+        """在数据库中累加用户的累计充值和累计消费（分）
+
+        只提交增量，其他进程同时修改同一用户时不会丢失对方的累加；
+        提供 tiers 时按累加后的累计充值重新计算等级。
+        """
+        self._enqueue(ADD_USER_TOTALS, (recharged / MINOR_UNITS, spent / MINOR_UNITS, user_id), 'user', user_id)
+        if tiers is not None:
+            sql, params = level_statement(tiers)
+            self._enqueue(sql, params + (user_id,), 'user', user_id)
+
+    def save_transaction(self, transaction: BalanceTransaction):
+        self._enqueue(UPSERT_TRANSACTION, (transaction.id, transaction.user_id,
+                                           transaction.created_at.isoformat(), dumps(transaction)),
+                      'transaction', transaction.id)
+
+    def save_recharge_record(self, record: RechargeRecord):
+        self._enqueue(UPSERT_RECHARGE, (record.id, record.user_id,
+                                        record.created_at.isoformat(), dumps(record)),
+                      'recharge_record', record.id)
+
+    def reserve_recharge(self, record: RechargeRecord, activity: RechargeActivity) -> bool:
+        """写入参与活动的新充值记录，同时占用活动名额（直接提交，不经过写队列）
+
+        先等待本实例排队中的写入提交，再在一个事务中按数据库中的充值记录检查活动总名额和
+        用户参与次数，都有余量时才写入。多个进程同时占用同一活动的名额时不会超出限制。
+
+        Returns:
+            是否写入成功（名额已满时不写入）
+        """
+        self.flush()
+        max_participants = activity.max_participants
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                inserted = self._conn.execute(INSERT_RECHARGE_IF_ROOM, (
+                    record.id, record.user_id, record.created_at.isoformat(), dumps(record),
+                    max_participants, activity.id, max_participants,
+                    activity.id, record.user_id, activity.user_limit,
+                )).rowcount == 1
+                if inserted:
+                    self._conn.execute(INSERT_CHANGE, ('recharge_record', record.id, self.origin, time.time()))
+                    self._conn.execute("COMMIT")
+                else:
+                    self._conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def save_activity(self, activity: RechargeActivity):
+        self._enqueue(UPSERT_ACTIVITY, (activity.id, dumps(activity)), 'activity', activity.id)
+
+    def save_setting(self, key: str, value: Any):
+        """保存运行时配置（JSON 可序列化的值），其他进程通过变更日志重新读取"""
+        self._enqueue(UPSERT_SETTING, (key, json.dumps(value, ensure_ascii=False, separators=(',', ':'))),
+                      'setting', key)
+
+    def save_product(self, product: Product):
+        self._enqueue(UPSERT_PRODUCT, (product.id, dumps(product)), 'product', product.id)
+
+    def set_product_stock(self, product_id: str, stock: int):
+        """设置商品库存（上架、盘点）"""
+        self._enqueue(SET_PRODUCT_STOCK, (stock, product_id), 'product', product_id)
+
+    def adjust_product_stock(self, product_id: str, delta: int):
+        """在数据库中增减商品库存（预占、释放、补货），其他进程同时修改时不会丢失对方的增减"""
+        self._enqueue(ADJUST_PRODUCT_STOCK, (delta, product_id), 'product', product_id)
+
+    def delete_product(self, product_id: str):
+        self._enqueue(DELETE_PRODUCT, (product_id,), 'product', product_id)
+
+    def save_order(self, order: Order):
+        self._enqueue(UPSERT_ORDER, (order.id, str(order.user_id),
+                                     order.created_at.isoformat(), dumps(order)),
+                      'order', order.id)
+
+    def fail_order(self, order: Order, restock: Dict[str, int]) -> bool:
+        """将待支付订单标记为失败并归还库存（直接提交，不经过写队列）
+
+        先等待本实例排队中的写入提交，再在一个事务中检查订单仍为待支付、写入失败状态并归还库存。
+        多个进程同时让同一订单失败时（如预占到期和网关通知过期），只有一个会成功，库存只归还一次。
+
+        Args:
+            order: 已设为失败状态的订单
+            restock: 商品ID -> 归还数量
+
+        Returns:
+            是否由本次调用完成状态转换；订单已被结算或已失败时返回 False，不做任何修改
+        """
+        self.flush()
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute(FAIL_ORDER, (dumps(order), order.id)).rowcount != 1:
+                    self._conn.execute("ROLLBACK")
+                    return False
+                self._conn.executemany(ADJUST_PRODUCT_STOCK,
+                                       [(quantity, product_id) for product_id, quantity in restock.items()])
+                self._conn.executemany(INSERT_CHANGE, [('order', order.id, self.origin, now)] +
+                                       [('product', product_id, self.origin, now) for product_id in restock])
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def enqueue_notification(self, dedupe_key: str, chat_id: int, payload: Dict[str, Any]):
+        """写入待发送的通知（发件箱），相同 dedupe_key 只保留第一条"""
+        now = time.time()
+        self._enqueue(INSERT_OUTBOX, (dedupe_key, chat_id, json.dumps(payload, ensure_ascii=False), now, now),
+                      'notification', dedupe_key)
+
+    def update_notification(self, dedupe_key: str, status: str, attempts: int,
+                            next_attempt: float, error: Optional[str] = None):
+        """更新通知的发送状态"""
+        self._enqueue(UPDATE_OUTBOX, (status, attempts, next_attempt, error, dedupe_key),
+                      'notification', dedupe_key)
+
+    def prune_notifications(self, before: float):
+        """删除指定时间之前创建、已发送或已放弃的通知"""
+        self._enqueue(PRUNE_OUTBOX, (before,), 'notification', '*')
+
+    def append_callback_event(self, gateway: str, order_id: str, tx_hash: str, status: Optional[str],
+                              payload: Dict[str, Any]):
+        """追加一条待结算的支付回调（同一键只记录第一次）"""
+        now = time.time()
+        self._enqueue(INSERT_CALLBACK_EVENT, (gateway, order_id, tx_hash, status,
+                                              json.dumps(payload, ensure_ascii=False, default=str), now, now),
+                      'callback_event', f"{gateway}:{order_id}")
+
+    def update_callback_event(self, gateway: str, order_id: str, tx_hash: str, state: str,
+                              attempts: int, next_attempt: float, outcome: Optional[str] = None):
+        """更新本实例认领的回调的结算状态"""
+        self._enqueue(UPDATE_CALLBACK_EVENT, (state, attempts, next_attempt, outcome, gateway, order_id, tx_hash,
+                                              self.origin),
+                      'callback_event', f"{gateway}:{order_id}")
+
+    def claim_callback_events(self, seqs: List[int], lease_until: float, now: float) -> List[int]:
+        """认领一批待结算的回调（直接提交，不经过写队列）
+
+        多个进程共享数据库时，同一回调只会被一个实例认领；认领者在 lease_until 之前
+        未写回结算结果的（如进程退出），租约过期后可被重新认领。
+
+        Returns:
+            认领成功的回调序号
+        """
+        claimed = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for seq in seqs:
+                    if self._conn.execute(CLAIM_CALLBACK_EVENT, (self.origin, lease_until, seq, now, now)).rowcount == 1:
+                        claimed.append(seq)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def flush(self, timeout: Optional[float] = None, since: Optional[int] = None) -> bool:
+        """等待此前所有写入提交到磁盘
+
+        Args:
+            timeout: 最长等待时间（秒）
+            since: 写入前读取的 failed_commits，默认为调用时的值
+
+        Returns:
+            全部提交返回 True；超时，或 since 之后有写入出错被跳过返回 False
+        """
+        failed = self.failed_commits if since is None else since
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout) and self.failed_commits == failed
+
+    def close(self):
+        """提交剩余写入并关闭连接"""
+        self._queue.put(_STOP)
+        self._writer.join()
+        with self._lock:
+            self._conn.close()
+
+    def _run(self):
+        """后台写线程：收集一批写入后在一个事务中提交"""
+        stopping = False
+        while not stopping:
+            # 有留待重试的写入时不无限等待新写入
+            try:
+                item = self._queue.get(timeout=COMMIT_BACKOFF if self._carry else None)
+            except queue.Empty:
+                self._commit([])
+                continue
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+        # 退出前提交队列中剩余的写入
+        rest = []
+        while True:
+            try:
+                rest.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._commit([item for item in rest if item is not _STOP], final=True)
+
+    def _commit(self, batch: List, final: bool = False):
+        events = self._carry_events + [item for item in batch if isinstance(item, threading.Event)]
+        writes = self._carry
+        self._carry, self._carry_events = [], []
+        for item in batch:
+            if item is _DRAIN_LEDGER:
+                # 缓冲的分录展开为普通写入，出错重试或留到下一批时不会丢失
+                writes.extend((INSERT_LEDGER, row, None) for row in self._take_ledger_rows())
+            elif not isinstance(item, threading.Event):
+                writes.append(item)
+
+        if writes:
+            try:
+                self._write_with_retry(writes)
+                writes = []
+            except sqlite3.Error as e:
+                if not _is_busy(e):
+                    logger.error(f"批量写入失败（{len(writes)} 条），逐段提交以跳过出错的语句: {e}")
+                    failed, writes = self._isolate(writes)
+                    if failed:
+                        self.failed_writes += len(failed)
+                        # 在唤醒等待者之前计数，同一批的 flush 也返回失败
+                        self.failed_commits += 1
+            if writes and not final:
+                # 数据库仍被其他进程锁住：未提交的写入留到下一批，等待者继续等待
+                logger.warning(f"数据库被锁住，{len(writes)} 条写入留待重试")
+                self._carry, self._carry_events = writes, events
+                return
+            if writes:
+                logger.error(f"关闭时数据库仍被锁住，{len(writes)} 条写入未能提交")
+                self.failed_writes += len(writes)
+                self.failed_commits += 1
+
+        for event in events:
+            event.set()
+
+    def _write(self, writes: List[Tuple]):
+        """在一个事务中提交写入，合并连续的相同语句，出错时回滚并抛出异常"""
+        groups: List[Tuple[str, List[Tuple]]] = []
+        now = time.time()
+        changes = []
+        for sql, params, change in writes:
+            if groups and groups[-1][0] == sql:
+                groups[-1][1].append(params)
+            else:
+                groups.append((sql, [params]))
+            if change is not None:
+                changes.append(change + (now,))
+        if changes:
+            groups.append((INSERT_CHANGE, changes))
+
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN")
+                for sql, rows in groups:
+                    self._conn.executemany(sql, rows)
+                if self.commits % 1000 == 0:
+                    self._conn.execute(PRUNE_CHANGES, (now - CHANGE_RETENTION,))
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+        self.commits += 1
+        self.rows_written += len(writes)
+
+    def _write_with_retry(self, writes: List[Tuple]):
+        """提交写入，数据库被锁住时退避重试"""
+        for attempt in range(COMMIT_RETRIES + 1):
+            try:
+                return self._write(writes)
+            except sqlite3.Error as e:
+                if not _is_busy(e) or attempt == COMMIT_RETRIES:
+                    raise
+                self.retried_commits += 1
+                time.sleep(COMMIT_BACKOFF * 2 ** attempt)
+
+    def _isolate(self, writes: List[Tuple]) -> Tuple[List[Tuple], List[Tuple]]:
+        """按顺序逐段提交，对半拆分出错的段，只跳过出错的单条写入
+
+        Returns:
+            (被跳过的写入, 数据库被锁住而未提交的写入)
+        """
+        failed = []
+        parts = [writes]
+        while parts:
+            part = parts.pop()
+            try:
+                self._write_with_retry(part)
+            except sqlite3.Error as e:
+                if _is_busy(e):
+                    return failed, [item for rest in [part] + parts[::-1] for item in rest]
+                if len(part) > 1:
+                    middle = len(part) // 2
+                    parts.append(part[middle:])
+                    parts.append(part[:middle])
+                    continue
+                sql, params, change = part[0]
+                logger.error(f"写入失败，已跳过: {e}; {sql} {params!r} {change!r}")
+                failed.append(part[0])
+        return failed, []
+
+    # ---- 读取 ----
+
+    def _select(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _select_one(self, sql: str, params: Tuple) -> Optional[Tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def last_change_seq(self) -> int:
+        """获取当前最新的变更序号"""
+        row = self._select_one("SELECT MAX(seq) FROM changes", ())
+        return row[0] or 0
+
+    def changes_since(self, seq: int) -> List[Tuple[int, str, str]]:
+        """获取其他实例在指定序号之后写入的变更 (seq, entity, key)"""
+        return self._select(
+            "SELECT seq, entity, key FROM changes WHERE seq > ? AND origin != ? ORDER BY seq",
+            (seq, self.origin)
+        )
+
+    def last_ledger_seq(self) -> int:
+        row = self._select_one("SELECT COALESCE(MAX(seq), 0) FROM ledger", ())
+        return row[0]
+
+    def load_ledger_balances(self) -> Tuple[Dict[int, int], Dict[str, int], int]:
+        """由最近的快照和之后的分录恢复余额
+
+        Returns:
+            (用户账户余额, 系统账户余额, 已读取的最大分录序号)
+        """
+        with self._lock:
+            # 在一个读事务中读取，快照和分录属于同一时刻
+            self._conn.execute("BEGIN")
+            try:
+                snapshot_seq = self._conn.execute("SELECT snapshot_seq FROM ledger_meta").fetchone()[0]
+                accounts = dict(self._conn.execute("SELECT account, balance FROM ledger_snapshots"))
+                system = dict(self._conn.execute("SELECT name, balance FROM ledger_system_snapshots"))
+                last_seq = snapshot_seq
+                for account, contra, amount, seq in self._conn.execute(
+                        "SELECT account, contra, amount, seq FROM ledger WHERE seq > ? ORDER BY seq", (snapshot_seq,)):
+                    accounts[account] = accounts.get(account, 0) + amount
+                    system[contra] = system.get(contra, 0) - amount
+                    last_seq = seq
+            finally:
+                self._conn.execute("COMMIT")
+        return accounts, system, last_seq
+
+    def load_ledger_since(self, seq: int, limit: int = 10000) -> List[Tuple[int, int, str, int]]:
+        """其他实例在指定序号之后追加的分录 (seq, account, contra, amount)"""
+        return self._select(
+            "SELECT seq, account, contra, amount FROM ledger WHERE seq > ? AND origin != ? ORDER BY seq LIMIT ?",
+            (seq, self.origin, limit)
+        )
+
+    def load_ledger_range(self, account: int, start_us: int, end_us: int,
+                          limit: int = 1000) -> List[Tuple[int, int, str, int, int, str, Optional[str]]]:
+        """账户在 [start_us, end_us) 内的分录 (seq, account, contra, amount, created_us, memo, ref)，按时间排序"""
+        return self._select(
+            "SELECT seq, account, contra, amount, created_us, memo, ref FROM ledger "
+            "WHERE account = ? AND created_us >= ? AND created_us < ? ORDER BY created_us, seq LIMIT ?",
+            (account, start_us, end_us, limit)
+        )
+
+    def ledger_balance_before(self, account: int, before_us: int) -> int:
+        """账户在指定时间之前的分录合计"""
+        row = self._select_one("SELECT COALESCE(SUM(amount), 0) FROM ledger WHERE account = ? AND created_us < ?",
+                               (account, before_us))
+        return row[0]
+
+    def load_due_notifications(self, now: float, limit: int = 100) -> List[Tuple[str, int, Dict[str, Any], int]]:
+        """获取已到发送时间的通知 (dedupe_key, chat_id, payload, attempts)，按到期时间排序"""
+        rows = self._select(
+            "SELECT dedupe_key, chat_id, payload, attempts FROM outbox "
+            "WHERE status = 'pending' AND next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+            (now, limit)
+        )
+        return [(key, chat_id, json.loads(payload), attempts) for key, chat_id, payload, attempts in rows]
+
+    def load_callback_keys(self, since: float = 0.0) -> Iterator[Tuple[str, str, str]]:
+        """获取指定时间之后记录的回调键 (gateway, order_id, tx_hash)"""
+        return iter(self._select(
+            "SELECT gateway, order_id, tx_hash FROM callback_events WHERE received_at >= ?", (since,)
+        ))
+
+    def load_callback_events(self, since_seq: int = 0, gateway: Optional[str] = None,
+                             limit: int = 1000) -> List[Tuple[int, str, str, str, Optional[str], str, Dict[str, Any], float]]:
+        """按序号读取回调事件 (seq, gateway, order_id, tx_hash, status, state, payload, received_at)"""
+        sql = ("SELECT seq, gateway, order_id, tx_hash, status, state, payload, received_at "
+               "FROM callback_events WHERE seq > ?")
+        params: Tuple = (since_seq,)
+        if gateway is not None:
+            sql += " AND gateway = ?"
+            params += (gateway,)
+        rows = self._select(sql + " ORDER BY seq LIMIT ?", params + (limit,))
+        return [row[:6] + (json.loads(row[6]), row[7]) for row in rows]
+
+    def load_due_callback_events(self, gateways: Tuple[str, ...], now: float, limit: int = 100,
+                                 after_seq: int = 0) -> List[Tuple[int, str, str, str, Dict[str, Any], int, float]]:
+        """获取到期待结算或认领租约已过期的回调 (seq, gateway, order_id, tx_hash, payload, attempts, received_at)，
+        按序号排序（结算前需用 claim_callback_events 认领）
+
+        Args:
+            after_seq: 只返回序号大于该值的回调（读取新写入的回调时使用）
+        """
+        marks = ', '.join('?' * len(gateways))
+        rows = self._select(
+            "SELECT seq, gateway, order_id, tx_hash, payload, attempts, received_at FROM callback_events "
+            "WHERE seq > ? AND ((state = 'queued' AND next_attempt <= ?) OR (state = 'settling' AND lease_until <= ?)) "
+            f"AND gateway IN ({marks}) ORDER BY seq LIMIT ?",
+            (after_seq, now, now) + tuple(gateways) + (limit,)
+        )
+        return [row[:4] + (json.loads(row[4]),) + row[5:] for row in rows]
+
+    def callback_event_counts(self, gateways: Tuple[str, ...]) -> Dict[str, int]:
+        """各结算状态的回调数量"""
+        marks = ', '.join('?' * len(gateways))
+        return dict(self._select(
+            f"SELECT state, COUNT(*) FROM callback_events WHERE gateway IN ({marks}) GROUP BY state",
+            tuple(gateways)
+        ))
+
+    def notification_counts(self) -> Dict[str, int]:
+        """各发送状态的通知数量"""
+        return dict(self._select("SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+
+    def load_user(self, user_id: int) -> Optional[User]:
+        row = self._select_one("SELECT data FROM users WHERE user_id = ?", (user_id,))
+        return decode(User, json.loads(row[0])) if row else None
+
+    def load_transaction(self, transaction_id: str) -> Optional[BalanceTransaction]:
+        row = self._select_one("SELECT data FROM transactions WHERE id = ?", (transaction_id,))
+        return decode(BalanceTransaction, json.loads(row[0])) if row else None
+
+    def load_recharge_record(self, record_id: str) -> Optional[RechargeRecord]:
+        row = self._select_one("SELECT data FROM recharge_records WHERE id = ?", (record_id,))
+        return decode(RechargeRecord, json.loads(row[0])) if row else None
+
+    def load_activity(self, activity_id: str) -> Optional[RechargeActivity]:
+        row = self._select_one("SELECT data FROM activities WHERE id = ?", (activity_id,))
+        return decode(RechargeActivity, json.loads(row[0])) if row else None
+
+    def load_setting(self, key: str) -> Optional[Any]:
+        row = self._select_one("SELECT data FROM settings WHERE key = ?", (key,))
+        return json.loads(row[0]) if row else None
+
+    def load_product(self, product_id: str) -> Optional[Product]:
+        row = self._select_one("SELECT data FROM products WHERE id = ?", (product_id,))
+        return decode(Product, json.loads(row[0])) if row else None
+
+    def load_order(self, order_id: str) -> Optional[Order]:
+        row = self._select_one("SELECT data FROM orders WHERE id = ?", (order_id,))
+        return decode(Order, json.loads(row[0])) if row else None
+
+    def load_users(self) -> Iterator[User]:
+        for (data,) in self._select("SELECT data FROM users"):
+            yield decode(User, json.loads(data))
+
+    def load_transactions(self) -> Iterator[BalanceTransaction]:
+        for (data,) in self._select("SELECT data FROM transactions ORDER BY created_at"):
+            yield decode(BalanceTransaction, json.loads(data))
+
+    def load_recharge_records(self) -> Iterator[RechargeRecord]:
+        for (data,) in self._select("SELECT data FROM recharge_records ORDER BY created_at"):
+            yield decode(RechargeRecord, json.loads(data))
+
+    def load_activities(self) -> Iterator[RechargeActivity]:
+        for (data,) in self._select("SELECT data FROM activities"):
+            yield decode(RechargeActivity, json.loads(data))
+
+    def load_products(self) -> Iterator[Product]:
+        for (data,) in self._select("SELECT data FROM products"):
+            yield decode(Product, json.loads(data))
+
+    def load_orders(self) -> Iterator[Order]:
+        for (data,) in self._select("SELECT data FROM orders ORDER BY created_at"):
+            yield decode(Order, json.loads(data))
@@ -0,0 +1,221 @@
+import argparse
+import json
+import threading
+from bisect import bisect_right
+from collections.abc import Mapping
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from store.money import MoneyLike, basis_points, cents_of
+
+class MemberLevel(Enum):
+    """会员等级"""
+    BRONZE = "bronze"      # 青铜会员
+    SILVER = "silver"      # 白银会员
+    GOLD = "gold"          # 黄金会员
+    PLATINUM = "platinum"  # 铂金会员
+    DIAMOND = "diamond"    # 钻石会员
+    SUPREME = "supreme"    # 至尊会员
+
+# 默认等级配置：累计充值达到 threshold 即升到该等级
+DEFAULT_TIER_CONFIG: List[Dict[str, Any]] = [
+    {"level": "bronze", "threshold": 0, "discount": 0.0, "recharge_bonus": 0.0, "name": "青铜会员", "emoji": "🥉"},
+    {"level": "silver", "threshold": 500, "discount": 0.05, "recharge_bonus": 0.02, "name": "白银会员", "emoji": "🥈"},
+    {"level": "gold", "threshold": 2000, "discount": 0.10, "recharge_bonus": 0.05, "name": "黄金会员", "emoji": "🥇"},
+    {"level": "platinum", "threshold": 5000, "discount": 0.15, "recharge_bonus": 0.08, "name": "铂金会员", "emoji": "💎"},
+    {"level": "diamond", "threshold": 10000, "discount": 0.20, "recharge_bonus": 0.10, "name": "钻石会员", "emoji": "💍"},
+    {"level": "supreme", "threshold": 30000, "discount": 0.25, "recharge_bonus": 0.15, "name": "至尊会员", "emoji": "👑"},
+]
+
+
+class LevelBenefits(Mapping):
+    """一个等级的权益（只读）
+
+    可按属性读取，也可像原来的权益字典一样用 benefits['discount']、
+    benefits.get('name') 读取；同一等级的所有用户共用一个对象。
+    discount_bp 是预先换算的折扣基点，计算折扣金额时直接使用（见 Money.at_rate）。
+    """
+
+    __slots__ = ('level', 'threshold', 'discount', 'recharge_bonus', 'name', 'emoji', 'discount_bp')
+    KEYS = ('discount', 'recharge_bonus', 'name', 'emoji')
+
+    def __init__(self, level: MemberLevel, threshold: float, discount: float, recharge_bonus: float,
+                 name: str, emoji: str):
+        for slot, value in (('level', level), ('threshold', threshold), ('discount', discount),
+                            ('recharge_bonus', recharge_bonus), ('name', name), ('emoji', emoji),
+                            ('discount_bp', basis_points(discount))):
+            object.__setattr__(self, slot, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("等级权益只读，请通过新的等级表修改")
+
+    __delattr__ = __setattr__
+
+    def __getitem__(self, key: str):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.KEYS else default
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.KEYS)
+
+    def __len__(self) -> int:
+        return len(self.KEYS)
+
+    def to_config(self) -> Dict[str, Any]:
+        """配置格式的字典（包含等级和门槛）"""
+        return {"level": self.level.value, "threshold": self.threshold, "discount": self.discount,
+                "recharge_bonus": self.recharge_bonus, "name": self.name, "emoji": self.emoji}
+
+    def __repr__(self) -> str:
+        return f"LevelBenefits({self.to_config()!r})"
+
+
+class TierTable:
+    """会员等级表（创建后不可修改）
+
+    按门槛升序保存各等级（门槛换算为整数分），根据累计充值金额二分查找等级；
+    各等级的权益预先构建为 LevelBenefits，查询时不创建任何对象。
+    修改等级时创建新的等级表并整体替换（见 activate_tiers）。
+    """
+
+    __slots__ = ('_thresholds', '_levels', '_benefits', '_ranks', '_lowest')
+
+    def __init__(self, tiers: List[LevelBenefits]):
+        """
+        Args:
+            tiers: 各等级的权益，门槛必须各不相同
+        """
+        tiers = sorted(tiers, key=lambda tier: tier.threshold)
+        if not tiers:
+            raise ValueError("等级表不能为空")
+        if len({tier.level for tier in tiers}) != len(tiers):
+            raise ValueError("等级表中有重复的等级")
+        self._thresholds: Tuple[int, ...] = tuple(cents_of(tier.threshold) for tier in tiers)
+        if len(set(self._thresholds)) != len(tiers):
+            raise ValueError("等级表中有重复的门槛")
+        self._levels: Tuple[MemberLevel, ...] = tuple(tier.level for tier in tiers)
+        self._benefits: Dict[MemberLevel, LevelBenefits] = {tier.level: tier for tier in tiers}
+        self._ranks: Dict[MemberLevel, int] = {level: rank for rank, level in enumerate(self._levels)}
+        self._lowest = tiers[0]
+
+    @classmethod
+    def from_config(cls, config: List[Dict[str, Any]]) -> 'TierTable':
+        """由配置（DEFAULT_TIER_CONFIG 格式的列表）创建等级表
+
+        Raises:
+            ValueError: 配置无效（未知等级、缺少字段、重复等级或门槛）
+        """
+        try:
+            return cls([LevelBenefits(MemberLevel(item['level']), item['threshold'], item['discount'],
+                                      item['recharge_bonus'], item['name'], item['emoji'])
+                        for item in config])
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"等级配置无效: {e}") from e
+
+    @classmethod
+    def load(cls, path: str) -> 'TierTable':
+        """从 JSON 文件读取等级表"""
+        with open(path, encoding='utf-8') as f:
+            return cls.from_config(json.load(f))
+
+    def to_config(self) -> List[Dict[str, Any]]:
+        return [self._benefits[level].to_config() for level in self._levels]
+
+    def level_for(self, total_recharged: MoneyLike) -> MemberLevel:
+        """累计充值金额对应的等级（低于最低门槛时为最低等级）"""
+        index = bisect_right(self._thresholds, cents_of(total_recharged)) - 1
+        return self._levels[index] if index >= 0 else self._lowest.level
+
+    def benefits(self, level: MemberLevel) -> LevelBenefits:
+        """等级的权益（等级表中没有该等级时返回最低等级的权益）"""
+        return self._benefits.get(level, self._lowest)
+
+    def rank(self, level: Optional[MemberLevel]) -> int:
+        """等级的序号（按门槛从低到高，从 0 开始；None 或不在等级表中的等级为 0）
+
+        比较等级高低应使用序号，而不是等级的字符串值。
+        """
+        return self._ranks.get(level, 0)
+
+    @property
+    def levels(self) -> Tuple[MemberLevel, ...]:
+        """按门槛升序的等级"""
+        return self._levels
+
+    @property
+    def thresholds(self) -> Tuple[int, ...]:
+        """与 levels 一一对应的门槛（分）"""
+        return self._thresholds
+
+    def __eq__(self, other):
+        if not isinstance(other, TierTable):
+            return NotImplemented
+        return self.to_config() == other.to_config()
+
+    __hash__ = None
+
+
+DEFAULT_TIERS = TierTable.from_config(DEFAULT_TIER_CONFIG)
+
+# 当前生效的等级表：读取不加锁（整体替换引用是原子的），替换时加锁
+_active: TierTable = DEFAULT_TIERS
+_active_lock = threading.Lock()
+
+
+def active_tiers() -> TierTable:
+    """当前生效的等级表"""
+    return _active
+
+
+def activate_tiers(table: Optional[TierTable]) -> TierTable:
+    """替换当前生效的等级表（None 恢复默认），已在处理中的请求继续使用旧表
+
+    Returns:
+        被替换的等级表
+    """
+    global _active
+    with _active_lock:
+        previous = _active
+        _active = table if table is not None else DEFAULT_TIERS
+        return previous
+
+
+def main():
+    """运行中查看或修改会员等级表（共享同一数据库的进程在下次同步时启用）
+
+    用法：
+        python -m store.tiers show
+        python -m store.tiers set tiers.json
+        python -m store.tiers reset
+    """
+    parser = argparse.ArgumentParser(description="查看或修改会员等级表")
+    parser.add_argument('command', choices=('show', 'set', 'reset'))
+    parser.add_argument('path', nargs='?', help='等级配置 JSON 文件（set 时必填，格式同 DEFAULT_TIER_CONFIG）')
+    args = parser.parse_args()
+
+    # 延迟导入：member 模块依赖本模块
+    from store.member import TIERS_SETTING
+    from store.storage import SQLiteStorage
+
+    storage = SQLiteStorage.from_url()
+    try:
+        if args.command == 'set':
+            if not args.path:
+                parser.error("set 需要指定等级配置文件")
+            storage.save_setting(TIERS_SETTING, TierTable.load(args.path).to_config())
+        elif args.command == 'reset':
+            storage.save_setting(TIERS_SETTING, None)
+        storage.flush()
+        config = storage.load_setting(TIERS_SETTING)
+        print(json.dumps(TierTable.from_config(config).to_config() if config else DEFAULT_TIER_CONFIG,
+                         ensure_ascii=False, indent=2))
+    finally:
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
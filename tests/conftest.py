@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# 回调服务等模块在导入时按 DATABASE_URL 打开共享数据库，测试使用临时文件
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
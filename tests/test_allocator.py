@@ -0,0 +1,41 @@
+from decimal import Decimal
+
+from payments.allocator import AmountAllocator
+
+RECEIVING = 'TYASr5UV6HEcXatwdFQfmLVUqQQQMUxHLS'
+RECEIVING_HEX = '41f372e671e8e872e14f17236ab29c7995296a3bad'
+
+
+def test_released_bases_do_not_accumulate():
+    allocator = AmountAllocator()
+    for i in range(1000):
+        allocator.allocate(f'o{i}', RECEIVING, 'USDT', Decimal(10 + i))
+        allocator.release(f'o{i}')
+
+    assert len(allocator) == 0
+    assert allocator.bases() == 0
+
+
+def test_live_orders_get_unique_amounts():
+    allocator = AmountAllocator()
+    amounts = [allocator.allocate(f'o{i}', RECEIVING, 'USDT', '10') for i in range(3)]
+    assert amounts == [Decimal('10'), Decimal('10.0001'), Decimal('10.0002')]
+    assert allocator.bases() == 1
+
+    # 仍有未释放的订单时保留轮转位置，释放的金额在轮转回来后复用
+    allocator.release('o0')
+    assert allocator.allocate('o3', RECEIVING, 'USDT', '10') == Decimal('10.0003')
+    allocator.release('o1')
+    allocator.release('o2')
+    allocator.release('o3')
+    assert allocator.bases() == 0
+    assert allocator.allocate('o4', RECEIVING, 'USDT', '10') == Decimal('10')
+
+
+def test_lookup_accepts_base58_and_hex_address():
+    allocator = AmountAllocator()
+    allocator.allocate('o1', RECEIVING, 'TRX', '25.5')
+
+    assert allocator.lookup(RECEIVING, 'TRX', '25.5') == 'o1'
+    assert allocator.lookup(RECEIVING_HEX, 'TRX', Decimal(25500000) / 10 ** 6) == 'o1'
+    assert allocator.lookup(RECEIVING_HEX, 'USDT', '25.5') is None
@@ -0,0 +1,52 @@
+import sys
+import threading
+
+from bot.expiry import TimerWheel
+
+
+def test_concurrent_schedule_and_advance_fires_every_timer_once():
+    wheel = TimerWheel(tick=1.0, slots=8, levels=3, now=0)
+    threads_count, per_thread = 4, 5000
+    fired = []
+    done = threading.Event()
+
+    def producer(index):
+        for i in range(per_thread):
+            # 到期时间分布在各层，推进时会不断重新分配
+            wheel.schedule((index, i), float(i % 300))
+
+    def advance():
+        now = 0
+        while not done.is_set() or len(wheel):
+            now += 1
+            fired.extend(wheel.advance(now))
+
+    # 频繁切换线程，让添加和推进交错执行
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        producers = [threading.Thread(target=producer, args=(index,)) for index in range(threads_count)]
+        advancer = threading.Thread(target=advance)
+        advancer.start()
+        for thread in producers:
+            thread.start()
+        for thread in producers:
+            thread.join()
+        done.set()
+        advancer.join(30)
+    finally:
+        sys.setswitchinterval(interval)
+
+    keys = [key for key, _ in fired]
+    assert len(keys) == threads_count * per_thread
+    assert len(set(keys)) == len(keys)
+    assert len(wheel) == 0
+
+
+def test_overdue_timer_fires_on_next_tick():
+    wheel = TimerWheel(tick=1.0, slots=64, levels=4, now=1000)
+    wheel.schedule('overdue', 900.0, 'a')
+    wheel.schedule('now', 1000.0, 'b')
+
+    assert sorted(wheel.advance(1001)) == [('now', 'b'), ('overdue', 'a')]
+    assert len(wheel) == 0
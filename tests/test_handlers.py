@@ -0,0 +1,43 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bot import handlers
+from store.money import Money
+
+
+class FakeMessage:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def run_pay(*args):
+    message = FakeMessage()
+    asyncio.run(handlers.pay(SimpleNamespace(message=message), SimpleNamespace(args=list(args))))
+    return message.replies
+
+
+def test_pay_creates_order_with_money_amount():
+    before = set(handlers.umpay.orders)
+    replies = run_pay('10.5', 'usdt')
+
+    (order_id,) = set(handlers.umpay.orders) - before
+    order = handlers.umpay.orders[order_id]
+    assert order['base_amount'] == Money('10.50')
+    assert order['currency'] == 'USDT'
+    assert order_id in replies[0]
+
+
+@pytest.mark.parametrize('amount', ['abc', 'nan', 'inf', '1e'])
+def test_pay_rejects_invalid_amount(amount):
+    before = len(handlers.umpay.orders)
+    assert run_pay(amount, 'USDT') == ["❌ 金额格式错误！请输入有效的数字。"]
+    assert len(handlers.umpay.orders) == before
+
+
+def test_pay_rejects_non_positive_amount():
+    assert run_pay('0.001', 'TRX') == ["❌ 金额必须大于0！"]
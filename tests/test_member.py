@@ -0,0 +1,35 @@
+import pytest
+
+from store.member import MemberSystem, RechargeActivity, RechargeActivityType
+from store.money import Money
+
+
+@pytest.fixture
+def member_system():
+    member_system = MemberSystem()
+    activity = RechargeActivity(name="限量赠送", activity_type=RechargeActivityType.BONUS,
+                                min_amount=Money(50), bonus_rate=0.5, max_participants=1, user_limit=5)
+    member_system.activities = {activity.id: activity}
+    member_system.activity_index.rebuild(member_system.activities.values())
+    for user_id in (1, 2):
+        member_system.register_user(user_id, f'user{user_id}', f'User {user_id}')
+    return member_system
+
+
+def test_best_activity_preview_follows_quotas(member_system):
+    assert member_system.get_best_activity(2, Money(100)).bonus_for(Money(100)) == Money(50)
+
+    record = member_system.create_recharge_order(1, Money(100), 'usdt')
+    assert record.bonus_amount == Money(50)
+    # 待支付的充值已占用唯一名额，预览与创建订单一致：没有奖励
+    assert member_system.get_best_activity(2, Money(100)) is None
+    assert member_system.create_recharge_order(2, Money(100), 'usdt').bonus_amount == Money(0)
+
+    assert member_system.complete_recharge(record.id, 'pay-1')
+    assert member_system.get_best_activity(2, Money(100)) is None
+
+
+def test_failed_recharge_returns_quota_to_preview(member_system):
+    record = member_system.create_recharge_order(1, Money(100), 'usdt')
+    assert member_system.set_recharge_status(record.id, 'expired')
+    assert member_system.get_best_activity(2, Money(100)) is not None
@@ -0,0 +1,32 @@
+import pytest
+
+from webhooks import member_callback
+
+
+@pytest.fixture
+def client():
+    return member_callback.app.test_client()
+
+
+def signed(data):
+    return dict(data, signature=member_callback.umpay_signature(data))
+
+
+def test_failed_commit_returns_500_and_accepts_retry(client, monkeypatch):
+    data = {'order_id': 'R-commit-failure', 'status': 'paid', 'payment_order_id': 'tx-commit-failure'}
+    storage = member_callback.state.storage
+    flush = storage.flush
+    monkeypatch.setattr(storage, 'flush', lambda timeout=None, since=None: False)
+
+    response = client.post('/webhook/member/umpay', json=signed(data))
+    assert response.status_code == 500
+    assert not member_callback.events.seen(member_callback.events.key(member_callback.UMPAY_GATEWAY, data))
+
+    # 网关重试时重新写入日志，而不是作为重复回调确认
+    monkeypatch.setattr(storage, 'flush', flush)
+    response = client.post('/webhook/member/umpay', json=signed(data))
+    assert response.status_code == 200
+    assert response.get_json()['message'] == 'Callback accepted'
+
+    response = client.post('/webhook/member/umpay', json=signed(data))
+    assert response.get_json()['message'] == 'Duplicate callback'
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import Counter
+
+from store.events import CallbackEventLog
+from store.storage import SQLiteStorage
+from webhooks.settlement import SettlementWorkers
+
+GATEWAY = 'umpay_member'
+
+
+class Recorder:
+    """记录每个订单被结算的次数"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def settle(self, gateway, data):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls[data['order_id']] += 1
+        return {'outcome': 'ok'}, 200
+
+
+def record_callbacks(storage, count):
+    events = CallbackEventLog(storage)
+    for i in range(count):
+        data = {'order_id': f"R{i}", 'status': 'paid', 'payment_order_id': f"tx-{i}"}
+        events.claim(events.key(GATEWAY, data))
+        events.record(events.key(GATEWAY, data), 'paid', data)
+    assert storage.flush(5)
+
+
+def wait_settled(storage, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        storage.flush()
+        counts = storage.callback_event_counts((GATEWAY,))
+        if not counts.get('queued') and not counts.get('settling'):
+            return counts
+        time.sleep(0.02)
+    raise AssertionError(f"回调未结算完: {counts}")
+
+
+def test_two_dispatchers_settle_each_callback_once(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    first, second = SQLiteStorage(path), SQLiteStorage(path)
+    record_callbacks(first, 300)
+
+    recorder = Recorder(delay=0.001)
+    pools = [SettlementWorkers(CallbackEventLog(storage), (GATEWAY,), recorder.settle, workers=4,
+                               batch_size=50, poll_interval=0.01)
+             for storage in (first, second)]
+    try:
+        for pool in pools:
+            pool.start()
+        counts = wait_settled(first)
+    finally:
+        for pool in pools:
+            pool.stop()
+        first.close()
+        second.close()
+
+    assert counts == {'settled': 300}
+    assert len(recorder.calls) == 300
+    assert set(recorder.calls.values()) == {1}
+    assert sum(pool.settled for pool in pools) == 300
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    first, second = SQLiteStorage(path), SQLiteStorage(path)
+    record_callbacks(first, 10)
+
+    # 第一个实例认领后没有结算（相当于认领后进程退出）
+    stalled = SettlementWorkers(CallbackEventLog(first), (GATEWAY,), Recorder().settle, lease=0.2)
+    assert stalled.dispatch_once() == 10
+
+    recorder = Recorder()
+    pool = SettlementWorkers(CallbackEventLog(second), (GATEWAY,), recorder.settle, poll_interval=0.01)
+    try:
+        assert pool.dispatch_once() == 0
+        assert pool.contended == 0  # 租约未过期的回调不会被读取
+        time.sleep(0.3)
+        pool.start()
+        counts = wait_settled(second)
+    finally:
+        pool.stop()
+        first.close()
+        second.close()
+
+    assert counts == {'settled': 10}
+    assert sum(recorder.calls.values()) == 10
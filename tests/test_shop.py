@@ -0,0 +1,51 @@
+import pytest
+
+from store.member import MemberSystem
+from store.models import PaymentStatus, Product
+from store.money import Money
+from store.shop import Shop
+
+
+@pytest.fixture
+def shop():
+    shop = Shop(MemberSystem())
+    shop._process_order_fulfillment = lambda order: None
+    shop.member_system.register_user(1, 'buyer', 'Buyer')
+    shop.add_product(Product(id='p1', name='P1', description='test', price=Money(10), stock=1))
+    return shop
+
+
+def expire_reservations(shop, payment_order):
+    shop.inventory.release_expired(now=payment_order['expires_at'] + 1)
+
+
+def test_reservation_expires_with_payment_order(shop):
+    result = shop.create_order('1', 'p1', 'USDT')
+    assert shop.inventory.get(result['order'].id).expires_at == result['payment_order']['expires_at']
+
+
+def test_late_payment_reserves_stock_again(shop):
+    result = shop.create_order('1', 'p1', 'USDT')
+    order = result['order']
+    expire_reservations(shop, result['payment_order'])
+    assert order.payment_status == PaymentStatus.FAILED
+    assert shop.inventory.available('p1') == 1
+
+    assert shop.complete_order(order) is True
+    assert order.payment_status == PaymentStatus.COMPLETED
+    assert shop.inventory.available('p1') == 0
+
+
+def test_late_payment_without_stock_is_refunded_once(shop):
+    result = shop.create_order('1', 'p1', 'USDT')
+    order = result['order']
+    expire_reservations(shop, result['payment_order'])
+    shop.adjust_stock('p1', -1)  # 释放的库存已被其他订单买走
+
+    assert shop.complete_order(order) is False
+    assert order.payment_status == PaymentStatus.REFUNDED
+    assert shop.member_system.get_user(1).balance == Money(10)
+
+    # 重复的支付通知不会再次退款
+    assert shop.complete_order(order) is False
+    assert shop.member_system.get_user(1).balance == Money(10)
@@ -0,0 +1,115 @@
+import pytest
+
+from store.member import RechargeActivity, RechargeActivityType
+from store.models import PaymentStatus, Product
+from store.money import Money
+from store.state import StateClient
+from store.tiers import MemberLevel
+
+
+@pytest.fixture
+def processes(tmp_path):
+    """共享同一数据库的两个进程（机器人和回调服务）"""
+    url = f"sqlite:///{tmp_path / 'shared.db'}"
+    bot = StateClient(url)
+    bot.shop.add_product(Product(id='p1', name='P1', description='test', price=Money(10), stock=5))
+    bot.member_system.register_user(1, 'buyer', 'Buyer')
+    bot.flush()
+    webhook = StateClient(url)
+    yield bot, webhook
+    bot.close()
+    webhook.close()
+
+
+def test_stale_stock_adjustment_keeps_other_process_reservation(processes):
+    bot, webhook = processes
+    assert webhook.shop.get_product('p1').stock == 5
+
+    assert bot.shop.inventory.reserve('o1', 'p1')
+    bot.flush()
+    # 回调服务还没有同步到这次预占，按缓存中的 5 件归还一件
+    webhook.shop.adjust_stock('p1', 1)
+    webhook.flush()
+
+    assert bot.storage.load_product('p1').stock == 5
+    webhook.sync()
+    bot.sync()
+    assert webhook.shop.get_product('p1').stock == 5
+    assert bot.shop.inventory.available('p1') == 5
+
+
+def test_product_edit_does_not_overwrite_stock(processes):
+    bot, webhook = processes
+    assert bot.shop.inventory.reserve('o1', 'p1')
+    bot.flush()
+    webhook.shop.update_product('p1', name='P1 新版')
+    webhook.flush()
+
+    product = bot.storage.load_product('p1')
+    assert (product.name, product.stock) == ('P1 新版', 4)
+
+
+def test_stale_user_writes_keep_other_process_totals(processes):
+    bot, webhook = processes
+    assert bot.member_system.add_balance(1, Money(100), 'admin', '测试')
+    bot.flush()
+    assert webhook.member_system.get_user(1).total_spent == Money(0)  # 缓存用户
+
+    assert bot.member_system.deduct_balance(1, Money(30), 'purchase', '购买')
+    bot.flush()
+    # 回调服务用缓存中的旧用户完成充值，并再次保存用户资料
+    record = webhook.member_system.create_recharge_order(1, Money(600), 'usdt')
+    assert webhook.member_system.complete_recharge(record.id, 'pay-1')
+    assert webhook.member_system.add_balance(1, Money(1), 'admin', '测试')
+    webhook.flush()
+
+    user = bot.storage.load_user(1)
+    assert user.total_spent == Money(30)
+    assert user.total_recharged == Money(600)
+    assert user.level == MemberLevel.SILVER
+    bot.sync()
+    assert bot.member_system.get_user(1).total_recharged == Money(600)
+
+
+def test_order_failed_by_both_processes_restores_stock_once(processes):
+    bot, webhook = processes
+    result = bot.shop.create_order('1', 'p1', 'USDT')
+    order_id = result['order'].id
+    bot.flush()
+    stale = webhook.shop.get_order(order_id)
+
+    # 网关通知过期：回调服务没有本地预占，由它完成状态转换并归还库存
+    assert webhook.shop.fail_order(stale)
+    webhook.flush()
+    # 机器人还没有同步到失败状态，本地预占随后到期
+    bot.shop.inventory.release_expired(now=result['payment_order']['expires_at'] + 1)
+    bot.flush()
+
+    assert bot.storage.load_product('p1').stock == 5
+    assert bot.shop.get_order(order_id).payment_status == PaymentStatus.FAILED
+    assert bot.shop.inventory.available('p1') == 5
+    assert bot.shop.inventory.get(order_id) is None
+    # 再收到一次过期通知也不会归还
+    assert not webhook.shop.fail_order(webhook.shop.get_order(order_id))
+    assert bot.storage.load_product('p1').stock == 5
+
+
+def test_activity_quota_is_checked_in_storage(processes):
+    bot, webhook = processes
+    activity = RechargeActivity(name="限量赠送", activity_type=RechargeActivityType.BONUS,
+                                min_amount=Money(50), bonus_rate=0.5, max_participants=1, user_limit=5)
+    for state in (bot, webhook):
+        state.member_system.activities = {activity.id: activity}
+        state.member_system.activity_index.rebuild(state.member_system.activities.values())
+        state.member_system.register_user(2, 'other', 'Other')
+
+    # 两个进程在同步之前各自按本地缓存都还有名额，只有先写入的一方占到唯一名额
+    first = bot.member_system.create_recharge_order(1, Money(100), 'usdt')
+    second = webhook.member_system.create_recharge_order(2, Money(100), 'usdt')
+    assert first.activity_id == activity.id and first.bonus_amount == Money(50)
+    assert second.activity_id is None and second.bonus_amount == Money(0)
+    assert webhook.member_system.quotas.participants(activity.id) == 0
+
+    webhook.flush()
+    webhook.sync()
+    assert webhook.member_system.quotas.participants(activity.id) == 1
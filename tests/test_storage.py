@@ -0,0 +1,48 @@
+import sqlite3
+
+from store.storage import SQLiteStorage
+
+
+def test_flush_reports_failed_batch(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'store.db'))
+    try:
+        before = storage.failed_commits
+        storage.enqueue_notification('ok', 1, {'text': 'hi'})
+        # 同一批中的一条写入出错，只跳过这一条，其余写入照常提交
+        storage._enqueue("INSERT INTO missing_table VALUES (?)", (1,), 'test', 1)
+        storage.enqueue_notification('after', 1, {'text': 'hi'})
+        assert storage.flush(5) is False
+        assert storage.failed_writes == 1
+        assert storage.notification_counts() == {'pending': 2}
+
+        # 之后的写入正常提交；从出错前开始等待的调用方仍然得到失败
+        storage.enqueue_notification('later', 1, {'text': 'hi'})
+        assert storage.flush(5) is True
+        assert storage.flush(5, since=before) is False
+        assert storage.notification_counts() == {'pending': 3}
+    finally:
+        storage.close()
+
+
+def test_locked_database_keeps_writes_until_released(tmp_path):
+    path = str(tmp_path / 'store.db')
+    storage = SQLiteStorage(path)
+    other = sqlite3.connect(path, isolation_level=None, timeout=0)
+    try:
+        with storage._lock:
+            storage._conn.execute("PRAGMA busy_timeout = 0")
+        # 另一个进程持有写锁，超过重试次数后写入留到下一批
+        other.execute("BEGIN IMMEDIATE")
+        storage.append_ledger(1, 'recharge', 500, 1, 'test')
+        storage.enqueue_notification('ok', 1, {'text': 'hi'})
+        assert storage.flush(0.5) is False
+        assert storage.retried_commits > 0
+
+        other.execute("COMMIT")
+        assert storage.flush(5) is True
+        assert storage.failed_writes == 0
+        assert storage.notification_counts() == {'pending': 1}
+        assert other.execute("SELECT account, contra, amount FROM ledger").fetchall() == [(1, 'recharge', 500)]
+    finally:
+        other.close()
+        storage.close()
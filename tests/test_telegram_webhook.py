@@ -0,0 +1,172 @@
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+
+import pytest
+from flask import Flask
+from telegram.ext import Application, CallbackQueryHandler, MessageHandler, filters
+from telegram.request import BaseRequest
+
+from bot.updates import ChatOrderedProcessor
+from bot.webhook import WebhookBridge
+from webhooks.telegram_webhook import SECRET_HEADER, init_telegram_webhook
+
+SECRET = 'test-secret'
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Test', 'username': 'test_bot'}
+
+
+class FakeBotAPI(BaseRequest):
+    """内存中的 Bot API：记录调用，按接口返回最小的合法结果"""
+
+    def __init__(self):
+        self.calls = []
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls.append((endpoint, request_data.parameters if request_data else {}))
+        if endpoint == 'getMe':
+            result = dict(BOT_USER, can_join_groups=False, can_read_all_group_messages=False,
+                          supports_inline_queries=False)
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def count(self, endpoint: str) -> int:
+        return sum(1 for name, _ in self.calls if name == endpoint)
+
+
+class FakeTelegram:
+    """模拟 Telegram：按顺序编号更新，带 secret token 推送到 webhook 路由"""
+
+    def __init__(self, client):
+        self.client = client
+        self._ids = itertools.count(1)
+
+    def user(self, chat_id: int) -> dict:
+        return {'id': chat_id, 'is_bot': False, 'first_name': f'User {chat_id}'}
+
+    def message(self, chat_id: int, text: str) -> dict:
+        update_id = next(self._ids)
+        return {'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'}, 'from': self.user(chat_id)}}
+
+    def tap(self, chat_id: int, data: str) -> dict:
+        update_id = next(self._ids)
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self.user(chat_id), 'chat_instance': str(chat_id), 'data': data,
+            'message': {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+                        'from': BOT_USER, 'text': '订单状态'}}}
+
+    def push(self, update: dict, secret=SECRET):
+        headers = {SECRET_HEADER: secret} if secret is not None else {}
+        return self.client.post('/webhook/telegram', json=update, headers=headers)
+
+
+def wait_until(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def bot():
+    """在机器人线程中运行的 Application 和挂载 webhook 路由的回调服务"""
+    api = FakeBotAPI()
+    handled = []                    # (会话, 文本或回调数据)
+    gate = threading.Event()        # 文本为 "block" 的消息在放行前一直占用会话
+    gate.set()
+
+    async def on_message(update, context):
+        if update.message.text == 'block':
+            while not gate.is_set():
+                await asyncio.sleep(0.01)
+        else:
+            await asyncio.sleep(random.uniform(0, 0.005))
+        handled.append((update.effective_chat.id, update.message.text))
+
+    async def on_tap(update, context):
+        handled.append((update.effective_chat.id, update.callback_query.data))
+
+    def build(update_queue):
+        application = (
+            Application.builder().token('123:TEST').request(api).update_queue(update_queue)
+            .concurrent_updates(ChatOrderedProcessor(16, max_per_chat=64)).build()
+        )
+        application.add_handler(MessageHandler(filters.TEXT, on_message))
+        application.add_handler(CallbackQueryHandler(on_tap))
+        return application
+
+    bridge = WebhookBridge(build, SECRET, queue_size=1000)
+    bridge.start()
+    app = Flask(__name__)
+    init_telegram_webhook(app, bridge)
+    yield FakeTelegram(app.test_client()), bridge, api, handled, gate
+    gate.set()
+    bridge.stop(timeout=5)
+
+
+def test_updates_of_each_chat_are_handled_in_order(bot):
+    telegram, bridge, api, handled, gate = bot
+    sent = []
+    for seq in range(30):
+        for chat_id in (101, 102, 103):
+            assert telegram.push(telegram.message(chat_id, str(seq))).status_code == 200
+            sent.append((chat_id, str(seq)))
+
+    wait_until(lambda: len(handled) == len(sent))
+    for chat_id in (101, 102, 103):
+        assert [text for chat, text in handled if chat == chat_id] == [str(seq) for seq in range(30)]
+
+
+def test_repeated_refresh_taps_are_coalesced(bot):
+    telegram, bridge, api, handled, gate = bot
+    gate.clear()
+    telegram.push(telegram.message(201, 'block'))
+    for _ in range(3):
+        telegram.push(telegram.tap(201, 'check_order_abc'))
+    telegram.push(telegram.tap(201, 'check_recharge_xyz'))
+    processor = bridge.application.update_processor
+    # 第一次点击排队等待会话，后两次相同的点击合并，并应答以结束客户端的加载状态
+    wait_until(lambda: processor.coalesced == 2 and api.count('answerCallbackQuery') == 2)
+
+    gate.set()
+    wait_until(lambda: len(handled) == 3)
+    assert handled == [(201, 'block'), (201, 'check_order_abc'), (201, 'check_recharge_xyz')]
+
+    # 前一次刷新已处理完，再次点击正常处理
+    telegram.push(telegram.tap(201, 'check_order_abc'))
+    wait_until(lambda: len(handled) == 4)
+    assert processor.coalesced == 2
+
+
+@pytest.mark.parametrize('secret', ['wrong-secret', '', None])
+def test_wrong_secret_is_rejected(bot, secret):
+    telegram, bridge, api, handled, gate = bot
+    response = telegram.push(telegram.message(301, 'forged'), secret=secret)
+
+    assert response.status_code == 403
+    assert bridge.invalid == 1 and bridge.accepted == 0
+    assert telegram.push(telegram.message(301, 'genuine')).status_code == 200
+    wait_until(lambda: handled)
+    assert handled == [(301, 'genuine')]
+
+
+def test_bridge_requires_secret():
+    with pytest.raises(ValueError):
+        WebhookBridge(lambda queue: None, '')
@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+
+from payments.allocator import AmountAllocator
+from payments.watcher import PaymentWatcher, TronGridBlockSource
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'trongrid_blocks.json')
+USDT_CONTRACT = 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t'
+RECEIVING = 'TYASr5UV6HEcXatwdFQfmLVUqQQQMUxHLS'
+
+# 录制区块 60000000-60000039，每 3 秒一个区块
+FIRST_BLOCK = 60000000
+HEAD = 60000039
+
+
+def block_time(number: int) -> int:
+    return 1700000000 + (number - FIRST_BLOCK) * 3
+
+
+# (订单ID, 币种, 订单金额, 创建区块)：金额互不相同，分配器不加偏移。A、B、E 已在确认区块中付款；
+# C 只有早于创建时间和执行失败的转账，D 的金额转到了其他地址，F 的付款还未确认
+ORDERS = (
+    ('A', 'USDT', '10.0001', 60000003),
+    ('B', 'TRX', '25.5', 60000010),
+    ('C', 'USDT', '10.0002', 60000020),
+    ('D', 'USDT', '10.0003', 60000020),
+    ('E', 'USDT', '50', 60000020),
+    ('F', 'TRX', '7', 60000030),
+)
+
+
+class RecordedTronGrid:
+    """按请求的区块范围回放录制的 wallet/getblockbylimitnext 响应"""
+
+    def __init__(self, path: str):
+        with open(path, encoding='utf-8') as f:
+            self.blocks = json.load(f)['block']
+        self.provider = self
+        self.calls = []
+
+    def get_latest_block_number(self) -> int:
+        return HEAD
+
+    def make_request(self, method: str, params: dict) -> dict:
+        assert method == 'wallet/getblockbylimitnext'
+        self.calls.append((params['startNum'], params['endNum']))
+        return {'block': [block for block in self.blocks
+                          if params['startNum'] <= block['block_header']['raw_data']['number'] < params['endNum']]}
+
+
+@pytest.fixture
+def tron():
+    return RecordedTronGrid(FIXTURE)
+
+
+def make_watcher(tron, settled):
+    return PaymentWatcher(TronGridBlockSource(tron), USDT_CONTRACT, AmountAllocator(),
+                          on_payment=lambda order_id, transfer: settled.append((order_id, transfer.block)),
+                          confirmations=12, clock=lambda: block_time(HEAD))
+
+
+def watch(watcher, order_id, currency, amount, created_block):
+    assert str(watcher.allocator.allocate(order_id, RECEIVING, currency, amount)) == amount
+    watcher.watch(order_id, RECEIVING, block_time(created_block))
+
+
+def watch_orders(watcher):
+    for order in ORDERS:
+        watch(watcher, *order)
+
+
+def test_first_poll_scans_from_oldest_order(tron):
+    # 重启后游标为空：从最早订单创建时的区块开始扫描，不跳到最新的已确认区块
+    settled = []
+    watcher = make_watcher(tron, settled)
+    watch_orders(watcher)
+
+    assert watcher.poll() == 3
+    assert sorted(settled) == [('A', 60000008), ('B', 60000012), ('E', 60000024)]
+    assert watcher.cursor == HEAD - 12
+    assert tron.calls[0][0] <= 60000003
+    assert len(watcher) == 3  # C、D、F 仍在等待
+
+
+def test_order_older_than_cursor_rewinds_scan(tron):
+    settled = []
+    watcher = make_watcher(tron, settled)
+    watcher.poll()  # 没有待支付订单，游标直接前移
+    assert watcher.cursor == HEAD - 12 and not tron.calls
+
+    watch_orders(watcher)
+    assert watcher.poll() == 3
+    assert sorted(order_id for order_id, _ in settled) == ['A', 'B', 'E']
+
+
+def test_new_order_does_not_rescan_confirmed_blocks(tron):
+    settled = []
+    watcher = make_watcher(tron, settled)
+    watcher.poll()
+    watch(watcher, 'G', 'USDT', '10.0001', HEAD)
+
+    assert watcher.poll() == 0
+    assert not tron.calls and not settled
+
+
+def test_failed_payment_callback_is_retried(tron):
+    settled = []
+    failures = {'A': 2}
+
+    def on_payment(order_id, transfer):
+        if failures.get(order_id):
+            failures[order_id] -= 1
+            raise RuntimeError('database is locked')
+        settled.append((order_id, transfer.block))
+
+    watcher = PaymentWatcher(TronGridBlockSource(tron), USDT_CONTRACT, AmountAllocator(),
+                             on_payment=on_payment, confirmations=12, clock=lambda: block_time(HEAD))
+    watch_orders(watcher)
+
+    assert watcher.poll() == 2
+    assert 'A' not in dict(settled) and watcher.metrics()['retrying'] == 1
+    # 游标照常前移，失败的订单仍在登记中，重试时不再拉取区块
+    tron.calls.clear()
+    assert watcher.poll() == 0
+    assert watcher.poll() == 1
+    assert ('A', 60000008) in settled and not tron.calls
+    assert watcher.metrics()['retrying'] == 0 and len(watcher) == 3
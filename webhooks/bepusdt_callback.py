@@ -1,18 +1,52 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 import logging
-from payments.bepusdt import BEpusdt
-from store.shop import Shop
-from config import BEPUSDT_API_URL, BEPUSDT_APP_ID, BEPUSDT_APP_SECRET
+from store.events import CallbackEventLog, DUPLICATE, IN_PROGRESS
+from webhooks.settlement import SettlementWorkers
+from store.models import PaymentStatus
+from store.state import get_state
+from config import SETTLEMENT_WORKERS
 
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-shop = Shop()
+state = get_state()
+shop = state.shop
 
-# 初始化BEpusdt
-bepusdt = None
-if BEPUSDT_API_URL and BEPUSDT_APP_ID and BEPUSDT_APP_SECRET:
-    bepusdt = BEpusdt(BEPUSDT_API_URL, BEPUSDT_APP_ID, BEPUSDT_APP_SECRET)
+# BEpusdt同步客户端（与商城共用连接池）
+bepusdt = shop.bepusdt
+
+# 回调事件日志（幂等处理）
+GATEWAY = 'bepusdt'
+events = CallbackEventLog(state.storage)
+CALLBACK_ENDPOINTS = ('bepusdt_callback',)
+
+@app.before_request
+def sync_state():
+    """处理请求前同步其他进程写入的数据
+
+    支付回调只验证签名并写入事件日志，不读取订单/会员数据；
+    结算线程在每批结算前同步。
+    """
+    # 记录写入前的失败批次数，响应前据此判断本次请求的写入是否已提交
+    g.failed_commits = state.storage.failed_commits
+    if request.endpoint not in CALLBACK_ENDPOINTS:
+        state.sync()
+
+@app.after_request
+def flush_state(response):
+    """返回响应前确保本次请求的写入已提交
+
+    提交失败时返回 500 让网关重试，并放弃本次记录的回调键，重试的回调会重新写入日志。
+    """
+    if state.flush(since=g.get('failed_commits')):
+        return response
+    key = g.pop('callback_key', None)
+    if key is not None:
+        events.release(key)
+    logger.error(f"请求 {request.path} 的写入未能提交")
+    response = jsonify({'error': 'Failed to persist callback'})
+    response.status_code = 500
+    return response
 
 @app.route('/webhook/bepusdt', methods=['POST'])
 def bepusdt_callback():
@@ -31,67 +65,112 @@ def bepusdt_callback():
         logger.info(f"收到BEpusdt回调: {data}")
         
         # 验证签名
-        if not bepusdt.verify_callback_signature(data):
+        if not bepusdt.verify_callback(data):
             logger.error("BEpusdt回调签名验证失败")
             return jsonify({'error': 'Invalid signature'}), 400
         
-        # 获取订单信息
-        order_id = data.get('order_id')
-        status = data.get('status')
-        amount = data.get('amount')
-        currency = data.get('currency')
-        tx_hash = data.get('tx_hash')
-        
-        if not order_id:
+        if not data.get('order_id'):
             logger.error("回调数据缺少订单ID")
             return jsonify({'error': 'Missing order_id'}), 400
         
-        # 查找本地订单
-        order = shop.orders.get(order_id)
-        if not order:
-            logger.error(f"订单不存在: {order_id}")
-            return jsonify({'error': 'Order not found'}), 404
-        
-        # 处理支付状态
-        if status == 'paid':
-            # 支付成功，更新订单状态
-            order.status = 'paid'
-            order.payment_info = {
-                'method': 'bepusdt',
-                'amount': amount,
-                'currency': currency,
-                'tx_hash': tx_hash,
-                'paid_at': data.get('paid_at')
-            }
-            
-            # 自动发货
-            try:
-                shop.deliver_order(order)
-                logger.info(f"订单 {order_id} 支付成功并已发货")
-            except Exception as e:
-                logger.error(f"订单 {order_id} 发货失败: {e}")
-            
-        elif status == 'expired':
-            # 订单过期，恢复库存
-            order.status = 'expired'
-            for product in order.products:
-                if product.id in shop.products:
-                    shop.products[product.id].stock += 1
-            logger.info(f"订单 {order_id} 已过期，库存已恢复")
-        
-        # 保存订单状态
-        shop.orders[order_id] = order
+        # 重复回调直接确认，不再修改订单
+        key = events.key(GATEWAY, data)
+        claim = events.claim(key)
+        if claim == DUPLICATE:
+            logger.info(f"重复的BEpusdt回调: {key}")
+            return jsonify({'success': True, 'duplicate': True}), 200
+        if claim == IN_PROGRESS:
+            return jsonify({'error': 'Callback is being processed'}), 409
         
+        # 写入事件日志后立即确认（响应前提交），订单更新和发货由结算线程完成
+        try:
+            events.record(key, data.get('status'), data)
+        except Exception:
+            events.release(key)
+            raise
+        g.callback_key = key
+        settlement.notify()
         return jsonify({'success': True}), 200
         
     except Exception as e:
         logger.error(f"处理BEpusdt回调时出错: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+def apply_bepusdt_callback(data):
+    """根据已验证的回调更新订单（结算线程和重放日志时调用）
+    
+    Returns:
+        (响应内容, 状态码)
+    """
+    order_id = data.get('order_id')
+    status = data.get('status')
+    
+    # 查找本地订单
+    order = shop.get_order(order_id)
+    if not order:
+        logger.error(f"订单不存在: {order_id}")
+        return {'error': 'Order not found'}, 404
+    
+    # 只有待支付的订单会被修改，订单已由查询或其他回调处理时直接确认；
+    # 已超时失败的订单仍要处理迟到的支付（重新预占库存或退款）
+    late_payment = status == 'paid' and order.payment_status == PaymentStatus.FAILED
+    if order.payment_status != PaymentStatus.PENDING and not late_payment:
+        return {'success': True, 'outcome': 'unchanged'}, 200
+    
+    if status == 'paid':
+        # 支付成功，更新订单状态
+        order.status = 'paid'
+        order.payment_info = {
+            'method': 'bepusdt',
+            'amount': data.get('amount'),
+            'currency': data.get('currency'),
+            'tx_hash': data.get('tx_hash'),
+            'paid_at': data.get('paid_at')
+        }
+        if not shop.complete_order(order):
+            # 超时失败后才到账、商品已售完：已退款到余额，不发货
+            logger.info(f"订单 {order_id} 超时后支付，商品已售完，已退款到余额")
+            return {'success': True, 'outcome': 'refunded'}, 200
+        
+        # 自动发货
+        try:
+            shop.deliver_order(order)
+            shop.save_order(order)
+            logger.info(f"订单 {order_id} 支付成功并已发货")
+        except Exception as e:
+            logger.error(f"订单 {order_id} 发货失败: {e}")
+        return {'success': True, 'outcome': 'paid'}, 200
+        
+    if status == 'expired':
+        # 订单过期，恢复库存
+        order.status = 'expired'
+        shop.fail_order(order)
+        logger.info(f"订单 {order_id} 已过期，库存已恢复")
+        return {'success': True, 'outcome': 'expired'}, 200
+    
+    return {'success': True, 'outcome': 'ignored'}, 200
+
+def settle_callback(gateway, data):
+    return apply_bepusdt_callback(data)
+
+def order_user(gateway, data):
+    """结算分区键：同一用户的订单依次结算"""
+    order = shop.get_order(data.get('order_id'))
+    return order.user_id if order else data.get('order_id')
+
+# 结算线程池
+settlement = SettlementWorkers(events, (GATEWAY,), settle_callback, partition=order_user,
+                                workers=SETTLEMENT_WORKERS, before_batch=state.sync)
+settlement.start()
+
+def replay_events(since_seq=0):
+    """重放事件日志中的BEpusdt回调"""
+    return events.replay({GATEWAY: apply_bepusdt_callback}, since_seq)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
-    return jsonify({'status': 'ok'}), 200
+    return jsonify({'status': 'ok', 'callbacks': events.stats(), 'settlement': settlement.metrics()}), 200
 
 if __name__ == '__main__':
     # 配置日志
@@ -1,22 +1,64 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 import hashlib
 import hmac
 import json
 import logging
 from datetime import datetime
-from store.member import MemberSystem
+from store.events import CallbackEventLog, DUPLICATE, IN_PROGRESS
+from webhooks.settlement import SettlementWorkers
+from store.state import get_state
 from payments.umpay import UMPay
-from payments.bepusdt import BEpusdt
-from config import UMPAY_SECRET_KEY, BEPUSDT_APP_SECRET
+from webhooks.notifier import NotificationSender
+from config import UMPAY_SECRET_KEY, BEPUSDT_APP_SECRET, SETTLEMENT_WORKERS
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 初始化系统
-member_system = MemberSystem()
+# 初始化系统（共享状态）
+state = get_state()
+member_system = state.member_system
 umpay = UMPay()
-bepusdt = BEpusdt()
+bepusdt = state.shop.bepusdt
+
+# 回调事件日志（幂等处理）
+UMPAY_GATEWAY = 'umpay_member'
+BEPUSDT_GATEWAY = 'bepusdt_member'
+GATEWAY_LABELS = {UMPAY_GATEWAY: 'UMPay', BEPUSDT_GATEWAY: 'BEpusdt'}
+events = CallbackEventLog(state.storage)
+CALLBACK_ENDPOINTS = ('umpay_member_callback', 'bepusdt_member_callback')
+
+# 充值通知发件箱：回调只写入通知，由后台线程发送
+notifier = NotificationSender(state.storage)
+notifier.start()
+
+@app.before_request
+def sync_state():
+    """处理请求前同步其他进程写入的数据
+
+    支付回调只验证签名并写入事件日志，不读取订单/会员数据；
+    结算线程在每批结算前同步。
+    """
+    # 记录写入前的失败批次数，响应前据此判断本次请求的写入是否已提交
+    g.failed_commits = state.storage.failed_commits
+    if request.endpoint not in CALLBACK_ENDPOINTS:
+        state.sync()
+
+@app.after_request
+def flush_state(response):
+    """返回响应前确保本次请求的写入已提交
+
+    提交失败时返回 500 让网关重试，并放弃本次记录的回调键，重试的回调会重新写入日志。
+    """
+    if state.flush(since=g.get('failed_commits')):
+        return response
+    key = g.pop('callback_key', None)
+    if key is not None:
+        events.release(key)
+    logger.error(f"请求 {request.path} 的写入未能提交")
+    response = jsonify({"status": "error", "message": "Failed to persist callback"})
+    response.status_code = 500
+    return response
 
 @app.route('/webhook/member/umpay', methods=['POST'])
 def umpay_member_callback():
@@ -34,44 +76,11 @@ def umpay_member_callback():
             logger.error("UMPay回调：签名验证失败")
             return jsonify({"status": "error", "message": "Invalid signature"}), 400
         
-        # 获取订单信息
-        order_id = data.get('order_id')
-        status = data.get('status')
-        payment_order_id = data.get('payment_order_id', '')
-        
-        if not order_id:
+        if not data.get('order_id'):
             logger.error("UMPay回调：缺少订单ID")
             return jsonify({"status": "error", "message": "Missing order_id"}), 400
         
-        # 查找充值记录
-        record = member_system.recharge_records.get(order_id)
-        if not record:
-            logger.error(f"UMPay回调：未找到充值记录 {order_id}")
-            return jsonify({"status": "error", "message": "Order not found"}), 404
-        
-        # 处理支付成功
-        if status == 'paid' and record.status == 'pending':
-            success = member_system.complete_recharge(order_id, payment_order_id)
-            if success:
-                logger.info(f"UMPay会员充值成功: {order_id}, 用户: {record.user_id}, 金额: {record.amount}")
-                
-                # 发送通知给用户（这里需要集成Telegram Bot API）
-                send_recharge_success_notification(record)
-                
-                return jsonify({"status": "success", "message": "Payment processed"})
-            else:
-                logger.error(f"UMPay会员充值处理失败: {order_id}")
-                return jsonify({"status": "error", "message": "Failed to process payment"}), 500
-        
-        # 处理支付失败或过期
-        elif status in ['failed', 'expired']:
-            record.status = status
-            logger.info(f"UMPay会员充值{status}: {order_id}")
-            return jsonify({"status": "success", "message": f"Order {status}"})
-        
-        else:
-            logger.warning(f"UMPay回调：未处理的状态 {status} for order {order_id}")
-            return jsonify({"status": "success", "message": "Status noted"})
+        return process_once(UMPAY_GATEWAY, data)
     
     except Exception as e:
         logger.error(f"UMPay会员充值回调处理异常: {e}")
@@ -93,49 +102,109 @@ def bepusdt_member_callback():
             logger.error("BEpusdt回调：签名验证失败")
             return jsonify({"status": "error", "message": "Invalid signature"}), 400
         
-        # 获取订单信息
-        order_id = data.get('order_id')
-        status = data.get('status')
-        payment_order_id = data.get('payment_order_id', '')
-        
-        if not order_id:
+        if not data.get('order_id'):
             logger.error("BEpusdt回调：缺少订单ID")
             return jsonify({"status": "error", "message": "Missing order_id"}), 400
         
-        # 查找充值记录
-        record = member_system.recharge_records.get(order_id)
-        if not record:
-            logger.error(f"BEpusdt回调：未找到充值记录 {order_id}")
-            return jsonify({"status": "error", "message": "Order not found"}), 404
-        
-        # 处理支付成功
-        if status == 'paid' and record.status == 'pending':
-            success = member_system.complete_recharge(order_id, payment_order_id)
-            if success:
-                logger.info(f"BEpusdt会员充值成功: {order_id}, 用户: {record.user_id}, 金额: {record.amount}")
-                
-                # 发送通知给用户
-                send_recharge_success_notification(record)
-                
-                return jsonify({"status": "success", "message": "Payment processed"})
-            else:
-                logger.error(f"BEpusdt会员充值处理失败: {order_id}")
-                return jsonify({"status": "error", "message": "Failed to process payment"}), 500
-        
-        # 处理支付失败或过期
-        elif status in ['failed', 'expired']:
-            record.status = status
-            logger.info(f"BEpusdt会员充值{status}: {order_id}")
-            return jsonify({"status": "success", "message": f"Order {status}"})
-        
-        else:
-            logger.warning(f"BEpusdt回调：未处理的状态 {status} for order {order_id}")
-            return jsonify({"status": "success", "message": "Status noted"})
+        return process_once(BEPUSDT_GATEWAY, data)
     
     except Exception as e:
         logger.error(f"BEpusdt会员充值回调处理异常: {e}")
         return jsonify({"status": "error", "message": "Internal server error"}), 500
 
+def process_once(gateway, data):
+    """确认已验证的回调
+
+    回调写入事件日志后立即确认（响应前提交），充值入账和通知由结算线程完成；
+    重复回调直接确认，不再修改充值记录和余额。
+    """
+    key = events.key(gateway, data)
+    claim = events.claim(key)
+    if claim == DUPLICATE:
+        logger.info(f"重复的充值回调: {key}")
+        return jsonify({"status": "success", "message": "Duplicate callback"})
+    if claim == IN_PROGRESS:
+        return jsonify({"status": "error", "message": "Callback is being processed"}), 409
+    
+    try:
+        events.record(key, data.get('status'), data)
+    except Exception:
+        events.release(key)
+        raise
+    g.callback_key = key
+    settlement.notify()
+    return jsonify({"status": "success", "message": "Callback accepted"})
+
+def apply_recharge_callback(gateway, data):
+    """根据已验证的回调更新充值记录（结算线程和重放日志时调用）
+    
+    Returns:
+        (响应内容, 状态码)
+    """
+    label = GATEWAY_LABELS[gateway]
+    order_id = data.get('order_id')
+    status = data.get('status')
+    payment_order_id = data.get('payment_order_id', '')
+    
+    # 查找充值记录
+    record = member_system.get_recharge_record(order_id)
+    if not record:
+        logger.error(f"{label}回调：未找到充值记录 {order_id}")
+        return {"status": "error", "message": "Order not found"}, 404
+    
+    # 只处理待支付的记录，已完成或已关闭的记录直接确认
+    if record.status != 'pending':
+        return {"status": "success", "message": f"Order already {record.status}"}, 200
+    
+    # 处理支付成功
+    if status == 'paid':
+        success = member_system.complete_recharge(order_id, payment_order_id)
+        if success:
+            logger.info(f"{label}会员充值成功: {order_id}, 用户: {record.user_id}, 金额: {record.amount}")
+            
+            # 发送通知给用户
+            send_recharge_success_notification(record)
+            
+            return {"status": "success", "message": "Payment processed"}, 200
+        else:
+            logger.error(f"{label}会员充值处理失败: {order_id}")
+            return {"status": "error", "message": "Failed to process payment"}, 500
+    
+    # 处理支付失败或过期
+    elif status in ['failed', 'expired']:
+        member_system.set_recharge_status(order_id, status)
+        logger.info(f"{label}会员充值{status}: {order_id}")
+        return {"status": "success", "message": f"Order {status}"}, 200
+    
+    else:
+        logger.warning(f"{label}回调：未处理的状态 {status} for order {order_id}")
+        return {"status": "success", "message": "Status noted"}, 200
+
+def recharge_user(gateway, data):
+    """结算分区键：同一用户的充值依次结算，避免并发修改余额"""
+    record = member_system.get_recharge_record(data.get('order_id'))
+    return record.user_id if record else data.get('order_id')
+
+def replay_events(since_seq=0):
+    """重放事件日志中的会员充值回调"""
+    handlers = {
+        gateway: (lambda data, gateway=gateway: apply_recharge_callback(gateway, data))
+        for gateway in GATEWAY_LABELS
+    }
+    return events.replay(handlers, since_seq)
+
+def umpay_signature(params, secret=None):
+    """计算UMPay回调签名（MD5，大写）"""
+    sign_string = '&'.join([f"{k}={v}" for k, v in sorted(params.items())])
+    sign_string += f"&key={UMPAY_SECRET_KEY if secret is None else secret}"
+    return hashlib.md5(sign_string.encode()).hexdigest().upper()
+
+def bepusdt_member_signature(params, secret=None):
+    """计算BEpusdt会员充值回调签名（SHA256）"""
+    sign_string = '&'.join([f"{k}={v}" for k, v in sorted(params.items())])
+    sign_string += f"&key={BEPUSDT_APP_SECRET if secret is None else secret}"
+    return hashlib.sha256(sign_string.encode()).hexdigest()
+
 def verify_umpay_signature(data):
     """验证UMPay签名"""
     try:
@@ -143,15 +212,7 @@ def verify_umpay_signature(data):
         if not received_signature:
             return False
         
-        # 构建签名字符串
-        sorted_params = sorted(data.items())
-        sign_string = '&'.join([f"{k}={v}" for k, v in sorted_params])
-        sign_string += f"&key={UMPAY_SECRET_KEY}"
-        
-        # 计算签名
-        calculated_signature = hashlib.md5(sign_string.encode()).hexdigest().upper()
-        
-        return hmac.compare_digest(received_signature.upper(), calculated_signature)
+        return hmac.compare_digest(received_signature.upper(), umpay_signature(data))
     
     except Exception as e:
         logger.error(f"UMPay签名验证异常: {e}")
@@ -164,28 +225,18 @@ def verify_bepusdt_signature(data):
         if not received_signature:
             return False
         
-        # 构建签名字符串
-        sorted_params = sorted(data.items())
-        sign_string = '&'.join([f"{k}={v}" for k, v in sorted_params])
-        sign_string += f"&key={BEPUSDT_APP_SECRET}"
-        
-        # 计算签名
-        calculated_signature = hashlib.sha256(sign_string.encode()).hexdigest()
-        
-        return hmac.compare_digest(received_signature, calculated_signature)
+        return hmac.compare_digest(received_signature, bepusdt_member_signature(data))
     
     except Exception as e:
         logger.error(f"BEpusdt签名验证异常: {e}")
         return False
 
 def send_recharge_success_notification(record):
-    """发送充值成功通知"""
+    """发送充值成功通知
+
+    通知写入发件箱后立即返回，由后台线程发送；同一充值记录只通知一次。
+    """
     try:
-        # 这里需要集成Telegram Bot API来发送消息
-        # 由于在webhook环境中，我们需要使用HTTP请求而不是直接调用bot
-        import requests
-        from config import TELEGRAM_TOKEN
-        
         user = member_system.get_user(record.user_id)
         if not user:
             return
@@ -205,22 +256,10 @@ def send_recharge_success_notification(record):
 
 感谢您的充值！🎉"""
         
-        # 发送消息
-        url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-        payload = {
-            "chat_id": record.user_id,
-            "text": message,
-            "parse_mode": "Markdown"
-        }
-        
-        response = requests.post(url, json=payload, timeout=10)
-        if response.status_code == 200:
-            logger.info(f"充值成功通知已发送给用户 {record.user_id}")
-        else:
-            logger.error(f"发送充值成功通知失败: {response.text}")
+        notifier.notify(f"recharge_success:{record.id}", record.user_id, message, parse_mode="Markdown")
     
     except Exception as e:
-        logger.error(f"发送充值成功通知异常: {e}")
+        logger.error(f"写入充值成功通知异常: {e}")
 
 @app.route('/health/member', methods=['GET'])
 def health_check():
@@ -229,7 +268,10 @@ def health_check():
         "status": "healthy",
         "service": "member_callback",
         "timestamp": datetime.now().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "notifications": notifier.metrics(),
+        "callbacks": events.stats(),
+        "settlement": settlement.metrics()
     })
 
 @app.route('/stats/member', methods=['GET'])
@@ -250,7 +292,7 @@ def member_stats():
         return jsonify({
             "total_users": total_users,
             "total_recharges": total_recharges,
-            "total_amount": total_amount,
+            "total_amount": float(total_amount),
             "active_activities": active_activities,
             "level_distribution": level_distribution,
             "timestamp": datetime.now().isoformat()
@@ -260,5 +302,11 @@ def member_stats():
         logger.error(f"获取会员统计异常: {e}")
         return jsonify({"status": "error", "message": "Failed to get stats"}), 500
 
+# 结算线程池（模块中的结算函数均已定义后启动）
+settlement = SettlementWorkers(events, tuple(GATEWAY_LABELS), apply_recharge_callback,
+                                partition=recharge_user, workers=SETTLEMENT_WORKERS,
+                                before_batch=state.sync)
+settlement.start()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
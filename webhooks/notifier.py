@@ -0,0 +1,257 @@
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import TELEGRAM_TOKEN, TELEGRAM_API_BASE
+
+logger = logging.getLogger(__name__)
+
+# 通知状态
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+
+# 已发送/已放弃的通知保留时长（秒），期间相同 dedupe_key 的通知不会重复发送
+RETENTION = 7 * 24 * 3600
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个令牌，最多积累 capacity 个"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """距离下一个可用令牌的时间（秒），0 表示现在可用"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class NotificationSender:
+    """Telegram 通知发件箱
+
+    回调处理中只把通知写入数据库发件箱（随本次请求的写入一起提交），
+    不等待 Telegram。后台线程按到期时间读取待发送的通知，通过保持连接的
+    会话发送：
+
+    - 全局和每个会话各有一个令牌桶，遵守 Telegram 的发送频率限制
+    - 429 按 retry_after 延后，网络错误和 5xx 按指数退避重试
+    - 通知以 dedupe_key（如充值记录ID）去重，重复的回调不会重复通知
+    """
+
+    def __init__(self, storage, token: Optional[str] = TELEGRAM_TOKEN, api_base: str = TELEGRAM_API_BASE,
+                 global_rate: float = 25.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_attempts: int = 8, base_delay: float = 2.0, max_delay: float = 600.0,
+                 poll_interval: float = 1.0, batch_size: int = 100):
+        """
+        Args:
+            storage: SQLiteStorage 实例（发件箱所在数据库）
+            token: 机器人 token
+            api_base: Bot API 地址
+            global_rate: 全局每秒发送上限
+            chat_rate: 单个会话每秒发送上限
+            chat_burst: 单个会话可连续发送的条数
+            max_attempts: 最多发送次数，超过后放弃
+            base_delay: 首次重试的等待时间（秒），之后每次翻倍
+            max_delay: 重试等待时间上限（秒）
+            poll_interval: 没有待发送通知时检查发件箱的间隔（秒）
+            batch_size: 每次从发件箱读取的通知数
+        """
+        self.storage = storage
+        self.url = f"{api_base}/bot{token}/sendMessage"
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = (5, 15)
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0     # 收到全局 429 后暂停发送
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_prune = 0.0
+
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    def notify(self, dedupe_key: str, chat_id: int, text: str, parse_mode: Optional[str] = None):
+        """写入一条待发送的通知，立即返回
+
+        Args:
+            dedupe_key: 去重键，相同键的通知只发送一次
+            chat_id: 接收者
+            text: 消息内容
+            parse_mode: Markdown / HTML
+        """
+        payload: Dict[str, Any] = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        self.storage.enqueue_notification(dedupe_key, chat_id, payload)
+        self.enqueued += 1
+        self._wakeup.set()
+
+    def start(self):
+        """启动后台发送线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='notification-sender', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.session.close()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                wait = self.run_once()
+            except Exception as e:
+                logger.error(f"发送通知出错: {e}")
+                wait = self.poll_interval
+            if wait > 0:
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+
+    def run_once(self) -> float:
+        """发送一批到期的通知
+
+        Returns:
+            建议下次检查前等待的时间（秒）
+        """
+        # 先等待本进程已写入的通知提交，避免刚写入的通知读不到
+        self.storage.flush()
+        now = time.time()
+        self._prune(now)
+        rows = self.storage.load_due_notifications(now, self.batch_size)
+        if not rows:
+            return self.poll_interval
+
+        next_wait = self.poll_interval
+        for key, chat_id, payload, attempts in rows:
+            if self._stopping.is_set():
+                break
+            # 会话令牌不足时跳过，先发送其他会话的通知
+            chat_delay = self._chat_bucket(chat_id).delay(time.monotonic())
+            if chat_delay > 0:
+                next_wait = min(next_wait, chat_delay)
+                continue
+            self._wait_global()
+            self._chat_bucket(chat_id).take(time.monotonic())
+            self._send(key, chat_id, payload, attempts)
+            next_wait = 0
+
+        self.storage.flush()
+        return next_wait
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # 清理已回满的令牌桶（与新建的桶等价）
+                now = time.monotonic()
+                self._chats = {c: b for c, b in self._chats.items() if b.delay(now) > 0 or b.tokens < b.capacity}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _wait_global(self):
+        while True:
+            now = time.monotonic()
+            delay = max(self._global.delay(now), self._paused_until - now)
+            if delay <= 0:
+                self._global.take(now)
+                return
+            self._stopping.wait(delay)
+
+    def _send(self, key: str, chat_id: int, payload: Dict[str, Any], attempts: int):
+        attempts += 1
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._retry(key, attempts, f"{type(e).__name__}: {e}")
+            return
+
+        if response.status_code == 200:
+            self.storage.update_notification(key, SENT, attempts, time.time())
+            self.sent += 1
+            return
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        description = body.get('description') or response.text[:200]
+
+        if response.status_code == 429:
+            retry_after = (body.get('parameters') or {}).get('retry_after', self.base_delay)
+            self.rate_limited += 1
+            self._paused_until = time.monotonic() + retry_after
+            logger.warning(f"Telegram 限流，{retry_after} 秒后重试")
+            self.storage.update_notification(key, PENDING, attempts - 1, time.time() + retry_after, description)
+        elif response.status_code >= 500:
+            self._retry(key, attempts, description)
+        else:
+            # 400/403 等（用户屏蔽机器人、消息格式错误）重试也不会成功
+            logger.error(f"通知 {key} 发送给 {chat_id} 失败: {description}")
+            self.storage.update_notification(key, FAILED, attempts, time.time(), description)
+            self.failed += 1
+
+    def _retry(self, key: str, attempts: int, error: str):
+        if attempts >= self.max_attempts:
+            logger.error(f"通知 {key} 发送 {attempts} 次失败，放弃: {error}")
+            self.storage.update_notification(key, FAILED, attempts, time.time(), error)
+            self.failed += 1
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        self.storage.update_notification(key, PENDING, attempts, time.time() + delay, error)
+        self.retried += 1
+
+    def _prune(self, now: float):
+        if now - self._last_prune < 3600:
+            return
+        self._last_prune = now
+        self.storage.prune_notifications(now - RETENTION)
+
+    def metrics(self) -> Dict[str, Any]:
+        """发送统计及发件箱中各状态的通知数"""
+        return {
+            'enqueued': self.enqueued,
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'rate_limited': self.rate_limited,
+            'outbox': self.storage.notification_counts(),
+        }
@@ -0,0 +1,227 @@
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from store.events import CallbackEventLog
+
+logger = logging.getLogger(__name__)
+
+# 结算函数：回调数据 -> (结果, 状态码)，状态码 200 表示已结算
+Settle = Callable[[str, Dict[str, Any]], Tuple[Dict[str, Any], int]]
+
+
+class SettlementWorkers:
+    """支付回调结算线程池
+
+    回调请求只验证签名并把回调写入事件日志；本线程池从日志中读取待结算的回调，
+    更新订单/充值记录、发货和发送通知。
+
+    - 按分区键（如用户ID）把回调分配给固定的线程，同一用户的回调依次结算，
+      不同用户并行结算
+    - 结算失败（订单尚未同步、处理异常等）按指数退避重试，超过次数后放弃
+    - 进程重启后日志中未结算的回调会继续结算
+    - 多个进程共享同一数据库时，每个回调先在数据库中认领（带租约）再结算，
+      同一回调只由一个进程结算；认领者退出后，租约过期的回调由其他进程重新认领
+
+    分配线程按序号游标读取新写入的回调，只在每 poll_interval 秒一次的全量扫描中
+    读取到期重试的回调，积压时不会反复读取已分配的回调。
+    """
+
+    def __init__(self, events: CallbackEventLog, gateways: Tuple[str, ...], settle: Settle,
+                 partition: Optional[Callable[[str, Dict[str, Any]], Hashable]] = None,
+                 workers: int = 4, batch_size: int = 200, poll_interval: float = 1.0,
+                 max_attempts: int = 10, base_delay: float = 1.0, max_delay: float = 300.0,
+                 lease: float = 300.0, before_batch: Optional[Callable[[], Any]] = None):
+        """
+        Args:
+            events: 回调事件日志
+            gateways: 本线程池结算的网关
+            settle: 结算函数 (网关, 回调数据) -> (结果, 状态码)
+            partition: 分区函数 (网关, 回调数据) -> 分区键，默认按订单ID
+            workers: 结算线程数
+            batch_size: 每次从日志读取的回调数
+            poll_interval: 没有新回调时检查日志的间隔（秒）
+            max_attempts: 最多结算次数
+            base_delay: 首次重试的等待时间（秒），之后每次翻倍
+            max_delay: 重试等待时间上限（秒）
+            lease: 认领的租约时长（秒），应大于回调从认领到写回结算结果的最长时间
+            before_batch: 每次读取回调前调用（如同步其他进程写入的数据）
+        """
+        self.events = events
+        self.gateways = tuple(gateways)
+        self.settle = settle
+        self.partition = partition or (lambda gateway, data: data.get('order_id'))
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.before_batch = before_batch
+
+        self._queues: List["queue.Queue"] = [queue.Queue() for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._inflight: Set[int] = set()       # 已分配、尚未结算完的回调序号
+        self._completed: List[int] = []        # 已结算、结果可能尚未提交的回调序号
+        self._cursor = 0                       # 已分配的最大回调序号
+        self._last_scan = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+        self.settled = 0
+        self.retried = 0
+        self.failed = 0
+        self.contended = 0      # 已被其他进程认领的回调数
+        self.lag = 0.0          # 最近一次结算距收到回调的时间
+        self.max_lag = 0.0
+
+    def notify(self):
+        """有新回调写入日志时调用，立即唤醒分配线程"""
+        self._wakeup.set()
+
+    def start(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(self._queues[index],),
+                                      name=f'settlement-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        dispatcher = threading.Thread(target=self._dispatch, name='settlement-dispatcher', daemon=True)
+        dispatcher.start()
+        self._threads.append(dispatcher)
+
+    def stop(self, timeout: float = 10.0):
+        """停止分配新回调，等待已分配的回调结算完"""
+        self._stopping.set()
+        self._wakeup.set()
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self.events.storage.flush(timeout)
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            try:
+                full = time.monotonic() - self._last_scan >= self.poll_interval
+                dispatched = self.dispatch_once(full)
+            except Exception as e:
+                logger.error(f"分配待结算回调出错: {e}")
+                dispatched = 0
+            if not dispatched:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def dispatch_once(self, full: bool = True) -> int:
+        """读取一批待结算的回调并分配给结算线程
+
+        Args:
+            full: 扫描所有到期的回调（含重试）；否则只读取游标之后新写入的回调
+
+        Returns:
+            新分配的回调数
+        """
+        with self._lock:
+            completed, self._completed = self._completed, []
+        # 提交此前的写入：新的回调和已完成回调的结算结果
+        self.events.storage.flush()
+        with self._lock:
+            self._inflight.difference_update(completed)
+        if self.before_batch is not None:
+            self.before_batch()
+
+        if full:
+            self._last_scan = time.monotonic()
+        after_seq = 0 if full else self._cursor
+        now = time.time()
+        rows = self.events.storage.load_due_callback_events(self.gateways, now, self.batch_size, after_seq)
+        if rows:
+            self._cursor = max(self._cursor, rows[-1][0])
+        with self._lock:
+            rows = [row for row in rows if row[0] not in self._inflight]
+        if not rows:
+            return 0
+        # 认领后才结算：其他进程已认领的回调由它们结算
+        claimed = set(self.events.storage.claim_callback_events([row[0] for row in rows], now + self.lease, now))
+        with self._lock:
+            self.contended += len(rows) - len(claimed)
+            self._inflight.update(claimed)
+
+        dispatched = 0
+        for seq, gateway, order_id, tx_hash, payload, attempts, received_at in rows:
+            if seq not in claimed:
+                continue
+            try:
+                key = self.partition(gateway, payload)
+            except Exception:
+                key = order_id
+            item = (seq, (gateway, order_id, tx_hash), payload, attempts, received_at)
+            self._queues[hash(key) % self.workers].put(item)
+            dispatched += 1
+        return dispatched
+
+    def _work(self, q: "queue.Queue"):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            seq, key, payload, attempts, received_at = item
+            try:
+                self._settle_one(key, payload, attempts, received_at)
+            except Exception as e:
+                logger.error(f"结算回调 {key} 出错: {e}")
+            finally:
+                with self._lock:
+                    self._completed.append(seq)
+                self._wakeup.set()
+
+    def _settle_one(self, key: Tuple[str, str, str], payload: Dict[str, Any], attempts: int,
+                    received_at: float):
+        gateway = key[0]
+        attempts += 1
+        try:
+            body, code = self.settle(gateway, dict(payload))
+        except Exception as e:
+            body, code = {'message': f"{type(e).__name__}: {e}"}, 500
+
+        outcome = str(body.get('outcome') or body.get('message') or body.get('error') or code)
+        if code == 200:
+            self.events.settle(key, attempts, outcome)
+            lag = time.time() - received_at
+            with self._lock:
+                self.settled += 1
+                self.lag = lag
+                self.max_lag = max(self.max_lag, lag)
+            return
+
+        if attempts >= self.max_attempts:
+            logger.error(f"回调 {key} 结算 {attempts} 次失败，放弃: {outcome}")
+            self.events.fail(key, attempts, outcome)
+            with self._lock:
+                self.failed += 1
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        self.events.retry(key, attempts, time.time() + delay, outcome)
+        with self._lock:
+            self.retried += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            inflight = len(self._inflight)
+        return {
+            'workers': self.workers,
+            'inflight': inflight,
+            'settled': self.settled,
+            'retried': self.retried,
+            'failed': self.failed,
+            'contended': self.contended,
+            'lag_ms': round(self.lag * 1000, 2),
+            'max_lag_ms': round(self.max_lag * 1000, 2),
+            'log': self.events.storage.callback_event_counts(self.gateways),
+        }
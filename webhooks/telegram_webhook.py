@@ -0,0 +1,50 @@
+from flask import Blueprint, Flask, current_app, jsonify, request
+import logging
+
+logger = logging.getLogger(__name__)
+
+telegram_bp = Blueprint('telegram', __name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def init_telegram_webhook(app: Flask, bridge):
+    """在回调服务上挂载 Telegram webhook 路由
+
+    Args:
+        app: Flask 应用（支付回调服务）
+        bridge: bot.webhook.WebhookBridge 实例
+    """
+    app.extensions['telegram_bridge'] = bridge
+    app.register_blueprint(telegram_bp)
+
+
+@telegram_bp.route('/webhook/telegram', methods=['POST'])
+def telegram_update():
+    """接收 Telegram 推送的更新"""
+    bridge = current_app.extensions.get('telegram_bridge')
+    if bridge is None:
+        return jsonify({'error': 'Bot not running'}), 503
+
+    if not bridge.check_secret(request.headers.get(SECRET_HEADER)):
+        logger.warning("Telegram webhook secret token 校验失败")
+        return jsonify({'error': 'Invalid secret token'}), 403
+
+    data = request.get_json(silent=True)
+    if not data or 'update_id' not in data:
+        return jsonify({'error': 'Invalid update'}), 400
+
+    # 放入队列后立即返回；队列已满时返回 503，Telegram 会稍后重试
+    if not bridge.submit(data):
+        return jsonify({'error': 'Update queue full'}), 503
+
+    return jsonify({'status': 'ok'})
+
+
+@telegram_bp.route('/health-telegram', methods=['GET'])
+def telegram_health():
+    """Telegram webhook 队列状态"""
+    bridge = current_app.extensions.get('telegram_bridge')
+    if bridge is None:
+        return jsonify({'status': 'disabled'})
+    return jsonify({'status': 'ok', **bridge.metrics()})